@@ -0,0 +1,246 @@
+"""
+End-to-end crawl benchmark against a local stub Wayback Machine.
+
+Spiders run unchanged with the project settings, only Wayback Machine
+requests are sent to the stub server and items are stored in memory
+instead of MongoDB. Reports CDX rows per second, requests per second,
+items per second and peak memory.
+
+Usage from the repository root:
+
+    python -m benchmarks.crawl.bench --articles 2000 --latency 0.01
+    python -m benchmarks.crawl.bench --error-rate 0.05 --output crawl.json
+    python -m benchmarks.crawl.bench --discovery
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import yaml
+from scrapy.crawler import CrawlerProcess
+from scrapy.settings import Settings
+
+from benchmarks.crawl.harness import MemoryStore, with_memory_database
+from benchmarks.crawl.server import StubWaybackServer, StubWaybackState
+from wbm_newspapers.waybackmachine import settings as project_settings
+
+SETTINGS_DIR = os.path.join(os.path.dirname(__file__), '..', '..',
+                            'settings')
+
+SPIDERS = {
+    'rbc': ('wbm_newspapers.waybackmachine.spiders.rbc', 'SpiderRBC',
+            'www.rbc.ru'),
+    'meduza': ('wbm_newspapers.waybackmachine.spiders.meduza',
+               'SpiderMeduza', 'meduza.io'),
+}
+
+
+# Front pages and article links of the discovery mode.
+DISCOVERY = {
+    'rbc': {'pages': ['https://www.rbc.ru/'],
+            'allow': [r'rbc\.ru/\w+/\d{2}/\d{2}/\d{4}/']},
+    'meduza': {'pages': ['https://meduza.io/'],
+               'allow': [r'meduza\.io/\w+/\d{4}/\d{2}/\d{2}/']},
+}
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of the process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux and bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def write_spider_settings(domain: str,
+                          directory: str,
+                          page_size: int,
+                          discovery: bool = False) -> str:
+    """
+    Spider settings file with the project filters and stub CDX query,
+    or daily front page discovery.
+    """
+    with open(os.path.join(SETTINGS_DIR, f'{domain}.yaml'),
+              'r', encoding='utf-8') as fobj:
+        spider_settings = yaml.safe_load(fobj)
+
+    spider_settings['cdx'] = {
+        'url': SPIDERS[domain][2],
+        'from_dt': "2019-01-01 00:00:00",
+        'limits': page_size,
+        'match_type': 'prefix',
+    }
+    spider_settings['filter_original'] = True
+    spider_settings.pop('cdx_cache', None)
+    if discovery:
+        spider_settings['discovery'] = dict(DISCOVERY[domain],
+                                            to_dt="2019-12-31 00:00:00",
+                                            every='1D')
+
+    path = os.path.join(directory, f'{domain}.yaml')
+    with open(path, 'w', encoding='utf-8') as fobj:
+        yaml.safe_dump(spider_settings, fobj)
+    return path
+
+
+def crawler_settings(stub_url: str, concurrency: int) -> Settings:
+    """Project settings redirected to the stub server."""
+    settings = Settings()
+    settings.setmodule(project_settings, priority='project')
+    settings.update({
+        'LOG_LEVEL': 'WARNING',
+        'ROBOTSTXT_OBEY': False,
+        'DOWNLOAD_DELAY': 0,
+        'CONCURRENT_REQUESTS': concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency,
+        'TELNETCONSOLE_ENABLED': False,
+        'RETRY_HTTP_CODES': [503],
+        'STUB_WAYBACK_URL': stub_url,
+        'EXTENSIONS': {},
+        'DOWNLOADER_MIDDLEWARES': {
+            'benchmarks.crawl.harness.StubRedirectMiddleware': 585,
+        },
+        'ITEM_PIPELINES': {
+            'benchmarks.crawl.harness.MemoryStorePipeline': 300,
+        },
+    })
+    return settings
+
+
+def import_spider(domain: str):
+    """Spider class of the domain using MemoryStore."""
+    module_name, class_name, _ = SPIDERS[domain]
+    module = __import__(module_name, fromlist=[class_name])
+    return with_memory_database(getattr(module, class_name))
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run all spiders once against the stub server."""
+    state = StubWaybackState(args.articles, args.latency, args.error_rate,
+                             args.page_size)
+    server = StubWaybackServer(state)
+    server.start()
+
+    crawlers = []
+    with tempfile.TemporaryDirectory() as directory:
+        process = CrawlerProcess(crawler_settings(server.url,
+                                                  args.concurrency))
+        for domain in args.domains:
+            crawler = process.create_crawler(import_spider(domain))
+            process.crawl(crawler,
+                          settings_file=write_spider_settings(
+                              domain, directory, args.page_size,
+                              args.discovery))
+            crawlers.append((domain, crawler))
+
+        start = time.perf_counter()
+        process.start()
+        elapsed = time.perf_counter() - start
+    server.stop()
+
+    results = []
+    for domain, crawler in crawlers:
+        stats = crawler.stats.get_stats()
+        results.append({
+            'domain': domain,
+            'items': stats.get('item_scraped_count', 0),
+            'stored': len(MemoryStore.collection(crawler.spider.name)
+                          .documents),
+            'requests': stats.get('downloader/request_count', 0),
+            'responses': stats.get('downloader/response_count', 0),
+            'retries': stats.get('retry/count', 0),
+            'rows_selected': stats.get('cdx/rows_selected', 0),
+        })
+
+    counters = state.counters
+    return {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'articles': args.articles,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'concurrency': args.concurrency,
+            'discovery': args.discovery,
+        },
+        'elapsed_sec': elapsed,
+        'cdx_rows_per_sec': counters['cdx_rows'] / elapsed,
+        'requests_per_sec': counters['requests'] / elapsed,
+        'items_per_sec': sum(result['items'] for result in results) / elapsed,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'server': dict(counters),
+        'results': results,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    """Print human readable results."""
+    print(f"elapsed {report['elapsed_sec']:.2f} sec, "
+          f"CDX rows {report['cdx_rows_per_sec']:.1f}/sec, "
+          f"requests {report['requests_per_sec']:.1f}/sec, "
+          f"items {report['items_per_sec']:.1f}/sec, "
+          f"peak RSS {report['peak_rss_bytes'] / 2 ** 20:.1f} MB")
+    server = report['server']
+    print(f"    server   CDX rows {server['cdx_rows']}  "
+          f"front pages {server['front_page_requests']}  "
+          f"snapshots {server['snapshot_requests']}")
+    for result in report['results']:
+        print(f"    {result['domain']:<8} items {result['items']:>6}  "
+              f"requests {result['requests']:>6}  "
+              f"retries {result['retries']:>4}")
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """Argument parsing."""
+    parser = argparse.ArgumentParser(description=(
+        'End-to-end crawl benchmark against a local stub Wayback Machine.'
+    ))
+    parser.add_argument('--domains', nargs='+', default=list(SPIDERS),
+                        choices=list(SPIDERS), help=(
+                            'Spiders to run in one process.'
+                        ))
+    parser.add_argument('--articles', type=int, default=1000, help=(
+        'Number of synthetic articles per domain.'
+    ))
+    parser.add_argument('--page-size', type=int, default=1000, help=(
+        'CDX rows per page.'
+    ))
+    parser.add_argument('--latency', type=float, default=0.0, help=(
+        'Stub server response delay in seconds.'
+    ))
+    parser.add_argument('--error-rate', type=float, default=0.0, help=(
+        'Fraction of stub server responses failing with 503.'
+    ))
+    parser.add_argument('--concurrency', type=int, default=16, help=(
+        'Scrapy CONCURRENT_REQUESTS.'
+    ))
+    parser.add_argument('--discovery', action='store_true', help=(
+        'Discover articles on daily front page captures instead of '
+        'prefix CDX queries.'
+    ))
+    parser.add_argument('--output', help=(
+        'Write results to JSON file.'
+    ))
+    return parser.parse_args(argv)
+
+
+def main():
+    """Main function."""
+    args = parse_args()
+    report = run(args)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fobj:
+            json.dump(report, fobj, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Scrapy components redirecting spiders to the stub server in memory."""
+import threading
+from typing import Any, Dict, Optional, Set, Type
+from urllib.parse import urlparse, urlunparse
+
+import scrapy
+from itemadapter import ItemAdapter
+
+from wbm_newspapers.waybackmachine.spiders.base import \
+    SpiderWaybackMachineBase
+from wbm_newspapers.waybackmachine.spiders.response import \
+    WaybackMachineResponseCDX
+
+
+class MemoryCollection:
+    """In-process stand-in of the MongoDB snapshot collection."""
+
+    def __init__(self):
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.originals: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def insert(self, document: Dict[str, Any]) -> bool:
+        """Insert document with unique URL, returns False for duplicates."""
+        with self._lock:
+            if document['url'] in self.documents:
+                return False
+            self.documents[document['url']] = document
+            self.originals.add(document['original'])
+            return True
+
+    def find_original_url(self, original: str) -> bool:
+        """Check the original URL is stored."""
+        return original in self.originals
+
+
+class MemoryStore:  # pylint: disable=too-few-public-methods
+    """Collections by spider name."""
+
+    collections: Dict[str, MemoryCollection] = {}
+
+    @classmethod
+    def collection(cls, name: str) -> MemoryCollection:
+        """Get or create collection."""
+        return cls.collections.setdefault(name, MemoryCollection())
+
+
+class MemorySpiderDatabase:
+    """Stand-in of SpiderDatabase working with MemoryStore."""
+
+    def __init__(self, name: str):
+        self.collection = MemoryStore.collection(name)
+
+    def close(self):
+        """Nothing to release."""
+
+    def filter(self,
+               data: WaybackMachineResponseCDX) -> WaybackMachineResponseCDX:
+        """Filter already stored original URLs."""
+        return data.filter_values(
+            'original',
+            lambda original: not self.collection.find_original_url(original))
+
+
+class MemoryStorePipeline:  # pylint: disable=too-few-public-methods
+    """Store items in MemoryStore, snapshot text is not kept."""
+
+    def process_item(self, item: Any, spider: scrapy.Spider):
+        """Process item."""
+        data = {key: value
+                for key, value in ItemAdapter(item).asdict().items()
+                if key != 'snapshot'}
+        if MemoryStore.collection(spider.name).insert(data):
+            spider.crawler.stats.inc_value('memory_store/inserted')
+        else:
+            spider.crawler.stats.inc_value('memory_store/duplicates')
+        return item
+
+
+class StubRedirectMiddleware:
+    """
+    Send Wayback Machine requests to the stub server.
+
+    Responses get the original archive URL back, so spiders parse
+    them as real Wayback Machine responses.
+    """
+
+    META_KEY = 'stub_original_url'
+
+    def __init__(self, stub_url: str):
+        self.stub = urlparse(stub_url)
+
+    @classmethod
+    def from_crawler(cls, crawler) -> 'StubRedirectMiddleware':
+        """Instantiate from crawler."""
+        return cls(crawler.settings.get('STUB_WAYBACK_URL'))
+
+    def process_request(self,
+                        request: scrapy.Request,
+                        spider: scrapy.Spider) -> Optional[scrapy.Request]:  # pylint: disable=unused-argument
+        """Rewrite archive.org host to the stub server."""
+        parsed = urlparse(request.url)
+        if not parsed.netloc.endswith('archive.org'):
+            return None
+        url = urlunparse(parsed._replace(scheme=self.stub.scheme,
+                                         netloc=self.stub.netloc))
+        meta = dict(request.meta)
+        meta[self.META_KEY] = request.url
+        return request.replace(url=url, meta=meta)
+
+    def process_response(self,
+                         request: scrapy.Request,
+                         response: scrapy.http.Response,
+                         spider: scrapy.Spider) -> scrapy.http.Response:  # pylint: disable=unused-argument
+        """Restore archive URL of the response."""
+        original_url = request.meta.get(self.META_KEY)
+        if original_url is None:
+            return response
+        return response.replace(url=original_url)
+
+
+def with_memory_database(spider_class: Type[SpiderWaybackMachineBase]) \
+        -> Type[SpiderWaybackMachineBase]:
+    """Spider class using MemoryStore instead of MongoDB."""
+
+    def create_database(self):
+        return MemorySpiderDatabase(self.name)
+
+    return type(spider_class.__name__,
+                (spider_class,),
+                {'create_database': create_database})
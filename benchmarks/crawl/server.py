@@ -0,0 +1,280 @@
+"""Local HTTP server mimicking Wayback Machine CDX and snapshot endpoints."""
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), '..', 'extraction',
+                            'fixtures')
+
+CDX_HEADER = ["urlkey", "timestamp", "original", "mimetype", "statuscode",
+              "digest", "length"]
+
+MEDUZA_SECTIONS = ['news', 'feature', 'cards', 'short', 'shapito', 'slides']
+
+# Article URL date patterns with (year, month, day) group numbers.
+ARTICLE_DATES = [
+    (re.compile(r'rbc\.ru/politics/(\d{2})/(\d{2})/(\d{4})/'), (3, 2, 1)),
+    (re.compile(r'meduza\.io/(?:' + '|'.join(MEDUZA_SECTIONS)
+                + r')/(\d{4})/(\d{2})/(\d{2})/'), (1, 2, 3)),
+]
+
+
+def _urlkey(original: str) -> str:
+    parsed = urlparse(original)
+    host = parsed.netloc.split(':')[0]
+    if host.startswith('www.'):
+        host = host[4:]
+    host = ",".join(reversed(host.split('.')))
+    return f"{host}){parsed.path}".lower()
+
+
+def _captures(rng: random.Random,
+              original: str,
+              mimetype: str,
+              max_captures: int) -> List[List[str]]:
+    rows = []
+    for _ in range(rng.randint(1, max_captures)):
+        timestamp = (f"2019{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+                     f"{rng.randint(0, 23):02d}{rng.randint(0, 59):02d}00")
+        statuscode = "404" if rng.random() < 0.05 else "200"
+        digest = f"{rng.getrandbits(128):032X}"
+        length = str(rng.randint(5000, 60000))
+        rows.append([_urlkey(original), timestamp, original, mimetype,
+                     statuscode, digest, length])
+    return rows
+
+
+def synthetic_cdx(domain: str,
+                  n_articles: int,
+                  max_captures: int = 4,
+                  seed: int = 0) -> List[List[str]]:
+    """
+    CDX rows of the domain sorted like the CDX server does.
+
+    Articles are mixed with assets and service pages which the
+    spider settings filter out.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for index in range(n_articles):
+        if domain == 'rbc':
+            article = (f"https://www.rbc.ru/politics/{rng.randint(1, 28):02d}/"
+                       f"{rng.randint(1, 12):02d}/2019/{index:024x}")
+            asset = f"https://www.rbc.ru/static/img/{index}.png"
+            service = f"https://www.rbc.ru/tags/?tag={index}"
+        else:
+            section = MEDUZA_SECTIONS[index % len(MEDUZA_SECTIONS)]
+            article = (f"https://meduza.io/{section}/2019/"
+                       f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/"
+                       f"material-{index}")
+            asset = f"https://meduza.io/image/attachments/{index}.jpg"
+            service = f"https://meduza.io/amp/news/2019/01/01/material-{index}"
+
+        rows.extend(_captures(rng, article, "text/html", max_captures))
+        rows.extend(_captures(rng, asset, "image/png", 1))
+        rows.extend(_captures(rng, service, "text/html", 1))
+
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return rows
+
+
+def _article_day(original: str) -> Optional[str]:
+    for pattern, groups in ARTICLE_DATES:
+        match = pattern.search(original)
+        if match is not None:
+            return ''.join(match.group(group) for group in groups)
+    return None
+
+
+def front_page_links(rows: List[List[str]]) -> Dict[str, List[str]]:
+    """Article URLs of CDX rows by article day, 'YYYYMMDD'."""
+    links: Dict[str, List[str]] = {}
+    for row in rows:
+        day = _article_day(row[2])
+        if day is not None and row[2] not in links.get(day, []):
+            links.setdefault(day, []).append(row[2])
+    return links
+
+
+class StubWaybackState:  # pylint: disable=too-many-instance-attributes
+    """Data and counters shared by request handlers."""
+
+    def __init__(self,
+                 n_articles: int,
+                 latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 page_size: int = 1000):
+        self.cdx = {domain: synthetic_cdx(domain, n_articles, seed=index)
+                    for index, domain in enumerate(['rbc', 'meduza'])}
+        self.snapshots = self._load_snapshots()
+        self.front_pages = {domain: front_page_links(rows)
+                            for domain, rows in self.cdx.items()}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.counters = {'requests': 0, 'cdx_requests': 0, 'cdx_rows': 0,
+                         'snapshot_requests': 0, 'front_page_requests': 0,
+                         'errors': 0, 'bytes': 0}
+        self.lock = threading.Lock()
+        self.rng = random.Random(42)
+
+    @staticmethod
+    def _load_snapshots() -> Dict[str, bytes]:
+        snapshots = {}
+        with open(os.path.join(FIXTURES_DIR, 'fixtures.json'),
+                  'r', encoding='utf-8') as fobj:
+            for fixture in json.load(fobj):
+                with open(os.path.join(FIXTURES_DIR, fixture['file']),
+                          'rb') as html:
+                    snapshots[fixture['name']] = html.read()
+        return snapshots
+
+    def count(self, **values: int):
+        """Increment counters."""
+        with self.lock:
+            for key, value in values.items():
+                self.counters[key] += value
+
+    def fail(self) -> bool:
+        """Draw if the request fails."""
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+
+class StubWaybackHandler(BaseHTTPRequestHandler):
+    """Serve CDX pages with resume keys and snapshots."""
+
+    server: 'StubWaybackServer'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle GET request."""
+        state = self.server.state
+        state.count(requests=1)
+
+        if state.latency > 0:
+            time.sleep(state.latency)
+
+        if state.fail():
+            state.count(errors=1)
+            self._send(503, b"Service Unavailable", "text/plain")
+            return
+
+        parsed = urlparse(self.path)
+        if parsed.path.startswith('/cdx/search/cdx'):
+            self._cdx(parse_qs(parsed.query))
+        elif parsed.path.startswith('/web/'):
+            self._snapshot(self.path)
+        else:
+            self._send(404, b"Not Found", "text/plain")
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.state.count(bytes=len(body))
+
+    def _cdx(self, query: Dict[str, List[str]]):
+        state = self.server.state
+        url = query.get('url', [''])[0]
+        rows = state.cdx['rbc' if 'rbc' in url else 'meduza']
+
+        if query.get('collapse', [''])[0] == 'urlkey':
+            rows = [row for index, row in enumerate(rows)
+                    if index == 0 or rows[index - 1][0] != row[0]]
+
+        offset = int(query.get('resumeKey', ['0'])[0] or 0)
+        page_size = int(query.get('limit', [state.page_size])[0])
+        page = rows[offset:offset + page_size]
+
+        data: List[List[str]] = [CDX_HEADER] + page
+        if offset + page_size < len(rows):
+            data += [[], [str(offset + page_size)]]
+
+        state.count(cdx_requests=1, cdx_rows=len(page))
+        self._send(200, json.dumps(data).encode('utf-8'), "application/json")
+
+    def _snapshot(self, path: str):
+        state = self.server.state
+        match = re.match(r'/web/(\d+)[a-z_]*/(.+)', path)
+        if match is None:
+            self._send(404, b"Not Found", "text/plain")
+            return
+
+        timestamp, original = match.groups()
+        if urlparse(original).path.strip('/') == '':
+            self._front_page(timestamp, original)
+            return
+
+        name = self._fixture_name(original)
+        if name is None:
+            self._send(404, b"Not Found", "text/plain")
+            return
+
+        state.count(snapshot_requests=1)
+        self._send(200, state.snapshots[name], "text/html; charset=utf-8")
+
+    def _front_page(self, timestamp: str, original: str):
+        # Articles of the capture day with links rewritten to archive
+        # URLs, like Wayback Machine does, and a few service links.
+        state = self.server.state
+        domain = 'rbc' if 'rbc.ru' in original else 'meduza'
+        host = original.rstrip('/')
+        links = state.front_pages[domain].get(timestamp[:8], [])
+        links = links + [f"{host}/tags/?tag=front",
+                         f"{host}/static/img/logo.png"]
+        body = ''.join(f'<a href="/web/{timestamp}/{link}">{link}</a>\n'
+                       for link in links)
+        state.count(front_page_requests=1)
+        self._send(200,
+                   f"<html><body>{body}</body></html>".encode('utf-8'),
+                   "text/html; charset=utf-8")
+
+    @staticmethod
+    def _fixture_name(original: str) -> Optional[str]:
+        if 'rbc.ru' in original:
+            return 'rbc/article'
+        for section in MEDUZA_SECTIONS:
+            if f'meduza.io/{section}/' in original:
+                return f'meduza/{section}'
+        return None
+
+
+class StubWaybackServer(ThreadingHTTPServer):
+    """Stub Wayback Machine server running in a background thread."""
+
+    daemon_threads = True
+
+    def __init__(self,
+                 state: StubWaybackState,
+                 address: Tuple[str, int] = ('127.0.0.1', 0)):
+        super().__init__(address, StubWaybackHandler)
+        self.state = state
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
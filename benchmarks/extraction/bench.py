@@ -0,0 +1,225 @@
+"""
+Extraction micro-benchmark over saved snapshots.
+
+Measures pages per second, latency of HTML parsing, preprocessing and
+every extractor field, and peak memory of one page extraction.
+
+Usage from the repository root:
+
+    python -m benchmarks.extraction.bench --output results.json
+    python -m benchmarks.extraction.bench --compare results.json
+"""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from bs4 import BeautifulSoup
+
+from wbm_newspapers.extraction.extraction import BaseExtractor
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+FIELDS = ['get_text', 'get_title', 'get_summary', 'get_authors',
+          'get_datetime', 'get_header_datetime']
+
+
+def load_fixtures(directory: str = FIXTURES_DIR) -> List[Dict[str, Any]]:
+    """Read fixtures manifest and snapshots."""
+    with open(os.path.join(directory, 'fixtures.json'),
+              'r', encoding='utf-8') as fobj:
+        fixtures = json.load(fobj)
+
+    for fixture in fixtures:
+        with open(os.path.join(directory, fixture['file']),
+                  'r', encoding='utf-8') as fobj:
+            fixture['html'] = fobj.read()
+    return fixtures
+
+
+def import_extractor(path: str) -> Callable[..., BaseExtractor]:
+    """Import extractor class by its full name."""
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def extract_page(extractor_class: Callable[..., BaseExtractor],
+                 html: str,
+                 url: str) -> Tuple[Dict[str, float], Dict[str, Any]]:
+    """Extract all fields from the page and measure every step."""
+    timings = {}
+
+    start = time.perf_counter()
+    soup = BeautifulSoup(html, features="lxml")
+    timings['html_parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    extractor = extractor_class(soup, url)
+    timings['preprocess'] = time.perf_counter() - start
+
+    values = {}
+    for field in FIELDS:
+        start = time.perf_counter()
+        values[field] = getattr(extractor, field)()
+        timings[field] = time.perf_counter() - start
+
+    return timings, values
+
+
+def peak_memory(extractor_class: Callable[..., BaseExtractor],
+                html: str,
+                url: str) -> int:
+    """Peak traced memory of one page extraction in bytes."""
+    tracemalloc.start()
+    try:
+        extract_page(extractor_class, html, url)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * len(ordered))))]
+    return {
+        'mean_ms': statistics.mean(ordered) * 1e3,
+        'median_ms': statistics.median(ordered) * 1e3,
+        'p95_ms': p95 * 1e3,
+    }
+
+
+def bench_fixture(fixture: Dict[str, Any],
+                  repeat: int,
+                  warmup: int) -> Dict[str, Any]:
+    """Benchmark extraction of one fixture."""
+    extractor_class = import_extractor(fixture['extractor'])
+    html, url = fixture['html'], fixture['url']
+
+    for _ in range(warmup):
+        extract_page(extractor_class, html, url)
+
+    samples: Dict[str, List[float]] = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        timings, values = extract_page(extractor_class, html, url)
+        for name, value in timings.items():
+            samples.setdefault(name, []).append(value)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'name': fixture['name'],
+        'extractor': fixture['extractor'],
+        'bytes': len(html.encode('utf-8')),
+        'repeat': repeat,
+        'pages_per_sec': repeat / elapsed,
+        'text_length': len(values['get_text']),
+        'title_length': len(values['get_title']),
+        'latency': {name: summarize(values)
+                    for name, values in samples.items()},
+        'peak_memory_bytes': peak_memory(extractor_class, html, url),
+    }
+
+
+def run(repeat: int, warmup: int) -> Dict[str, Any]:
+    """Run benchmark over all fixtures."""
+    results = [bench_fixture(fixture, repeat, warmup)
+               for fixture in load_fixtures()]
+    return {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(current: Dict[str, Any],
+            baseline: Dict[str, Any],
+            threshold: float) -> List[str]:
+    """
+    Compare throughput with the baseline run.
+
+    Returns names of fixtures slower than the baseline by more than
+    the threshold fraction.
+    """
+    baseline_results = {result['name']: result
+                        for result in baseline['results']}
+    regressions = []
+    print(f"{'fixture':<20} {'baseline':>10} {'current':>10} {'change':>8}")
+    for result in current['results']:
+        base = baseline_results.get(result['name'])
+        if base is None:
+            continue
+        change = result['pages_per_sec'] / base['pages_per_sec'] - 1
+        print(f"{result['name']:<20} {base['pages_per_sec']:>10.1f} "
+              f"{result['pages_per_sec']:>10.1f} {change:>+8.1%}")
+        if change < -threshold:
+            regressions.append(result['name'])
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    """Print human readable results."""
+    for result in report['results']:
+        print(f"{result['name']}: {result['pages_per_sec']:.1f} pages/sec, "
+              f"peak memory {result['peak_memory_bytes'] / 2 ** 20:.2f} MB")
+        for name, latency in result['latency'].items():
+            print(f"    {name:<22} median {latency['median_ms']:8.3f} ms  "
+                  f"p95 {latency['p95_ms']:8.3f} ms")
+
+
+def parse_args():
+    """Argument parsing."""
+    parser = argparse.ArgumentParser(description=(
+        'Extraction micro-benchmark over saved snapshots.'
+    ))
+    parser.add_argument('--repeat', type=int, default=50, help=(
+        'Number of measured extractions per fixture.'
+    ))
+    parser.add_argument('--warmup', type=int, default=3, help=(
+        'Number of extractions before measuring.'
+    ))
+    parser.add_argument('--output', help=(
+        'Write results to JSON file.'
+    ))
+    parser.add_argument('--compare', help=(
+        'Baseline JSON results to compare with.'
+    ))
+    parser.add_argument('--threshold', type=float, default=0.2, help=(
+        'Allowed throughput drop relative to the baseline.'
+    ))
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+    args = parse_args()
+    report = run(args.repeat, args.warmup)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fobj:
+            json.dump(report, fobj, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as fobj:
+            baseline = json.load(fobj)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+#!/bin/bash
+export PYTHONPATH="$PYTHONPATH:$(pwd)"
+python -m wbm_newspapers crawl rbc meduza --settings-dir settings
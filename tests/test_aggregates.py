@@ -0,0 +1,86 @@
+import pytest
+
+from wbm_newspapers.analysis.aggregates import AggregateStore, PageQuery, \
+    read_page
+from wbm_newspapers.sqlite import connect
+
+
+def article(path, day, text='Бюджет и налоги', domain='rbc.ru'):
+    return {'url': f'https://web.archive.org/web/{day}/{domain}/{path}',
+            'original': f'https://www.{domain}/{path}',
+            'url_date': f'2019-01-{day:02d}',
+            'title': 'Заголовок',
+            'text': text}
+
+
+@pytest.fixture
+def connection(tmp_path):
+    path = str(tmp_path / 'aggregates.db')
+    store = AggregateStore(path, batch_size=3)
+    for day in range(1, 8):
+        assert store.add(article(f'politics/{day}', day))
+    assert store.add(article('economics/1', 1, domain='meduza.io'))
+    assert not store.add(article('politics/1', 1))
+    store.close()
+    connection = connect(path)
+    yield connection
+    connection.close()
+
+
+def days(page):
+    return [row[page.columns.index('day')] for row in page.rows]
+
+
+def test_pages_cover_all_rows_once(connection):
+    query = PageQuery(filters={'domain': 'rbc.ru'}, per_page=3)
+    pages = [read_page(connection, query._replace(page=number))
+             for number in range(1, 4)]
+    assert [page.total for page in pages] == [7, 7, 7]
+    assert pages[0].n_pages == 3
+    assert [days(page) for page in pages] == [
+        ['2019-01-07', '2019-01-06', '2019-01-05'],
+        ['2019-01-04', '2019-01-03', '2019-01-02'],
+        ['2019-01-01']]
+    assert read_page(connection, query._replace(page=4)).rows == []
+
+
+def test_ties_have_stable_order(connection):
+    query = PageQuery(sort='articles', descending=False, per_page=1)
+    rows = [read_page(connection, query._replace(page=number)).rows[0]
+            for number in range(1, 9)]
+    assert len(set(rows)) == 8
+    assert rows[:2] == [('meduza.io', '2019-01-01', 1, 3),
+                        ('rbc.ru', '2019-01-01', 1, 3)]
+
+
+def test_filters_and_date_range(connection):
+    page = read_page(connection, PageQuery(
+        table='section_day', filters={'section': 'politics'},
+        date_from='2019-01-02', date_to='2019-01-03', descending=False))
+    assert page.columns == ('domain', 'section', 'day', 'articles')
+    assert page.rows == [('rbc.ru', 'politics', '2019-01-02', 1),
+                         ('rbc.ru', 'politics', '2019-01-03', 1)]
+
+    page = read_page(connection, PageQuery(
+        table='term_day', filters={'day': '2019-01-01'}, sort='term',
+        descending=False))
+    assert page.rows == [('бюджет', '2019-01-01', 2, 2),
+                         ('заголовок', '2019-01-01', 2, 2),
+                         ('налоги', '2019-01-01', 2, 2)]
+
+
+def test_empty_result(connection):
+    page = read_page(connection, PageQuery(filters={'domain': 'lenta.ru'}))
+    assert page.total == 0
+    assert page.rows == []
+    assert page.n_pages == 1
+
+
+@pytest.mark.parametrize('query', [
+    PageQuery(table='articles'),
+    PageQuery(sort='domain; DROP TABLE domain_day'),
+    PageQuery(filters={'articles': '1'}),
+])
+def test_unknown_names(connection, query):
+    with pytest.raises(ValueError):
+        read_page(connection, query)
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from scrapy.http import HtmlResponse, Request
+
+from wbm_newspapers.waybackmachine.spiders.discovery import \
+    FrontPageDiscovery, capture_timestamp, original_url
+
+PAGE = 'https://www.rbc.ru/'
+
+BODY = '''<html><body>
+<a href="/web/20190105101500/https://www.rbc.ru/politics/05/01/2019/a">A</a>
+<a href="https://web.archive.org/web/20190104000000id_/http://rbc.ru/b#top">
+B</a>
+<a href="/web/20190105101500/https://www.rbc.ru/politics/05/01/2019/a">A</a>
+<a href="/web/20190105101500/https://lenta.ru/news/c">C</a>
+<a href="/web/20190105101500/https://www.rbc.ru/tags/d">D</a>
+</body></html>'''
+
+
+def front_page(url='https://web.archive.org/web/20190105101500/'
+                   'https://www.rbc.ru/',
+               body=BODY):
+    return HtmlResponse(url, body=body.encode('utf-8'), encoding='utf-8',
+                        request=Request(url))
+
+
+def test_archive_urls():
+    url = 'https://web.archive.org/web/20190105101500id_/https://rbc.ru/a'
+    assert original_url(url) == 'https://rbc.ru/a'
+    assert capture_timestamp(url) == '20190105101500'
+    assert original_url('https://rbc.ru/a') == 'https://rbc.ru/a'
+    assert capture_timestamp('https://rbc.ru/a') is None
+
+
+def test_captures_at_time_steps():
+    discovery = FrontPageDiscovery([PAGE, PAGE + 'politics/'],
+                                   datetime(2019, 1, 1),
+                                   datetime(2019, 1, 2, 12))
+    assert list(discovery.captures()) == [
+        (PAGE, '20190101000000'), (PAGE + 'politics/', '20190101000000'),
+        (PAGE, '20190102000000'), (PAGE + 'politics/', '20190102000000')]
+
+
+def test_to_cdx_rows_of_new_site_links():
+    discovery = FrontPageDiscovery([PAGE], datetime(2019, 1, 1),
+                                   datetime(2019, 1, 2))
+    data = discovery.to_cdx(front_page(), PAGE, '20190105000000')
+    assert data.column('original').tolist() == [
+        'https://www.rbc.ru/politics/05/01/2019/a',
+        'http://rbc.ru/b',
+        'https://www.rbc.ru/tags/d']
+    # Timestamp of the redirected capture.
+    assert set(data.column('timestamp')) == {20190105101500}
+    assert set(data.column('statuscode').astype(str)) == {'200'}
+    assert data.resume_key is None
+    assert discovery.n_discovered == 3
+
+    again = discovery.to_cdx(front_page(), PAGE, '20190106000000')
+    assert again.n_rows == 0
+
+
+def test_to_cdx_allow_and_requested_timestamp():
+    discovery = FrontPageDiscovery([PAGE], datetime(2019, 1, 1),
+                                   datetime(2019, 1, 2),
+                                   allow=[r'/\d{2}/\d{2}/\d{4}/'])
+    # Page without an archive URL, like a live page.
+    body = '<a href="/politics/05/01/2019/a">A</a><a href="/tags/d">D</a>'
+    data = discovery.to_cdx(front_page(PAGE, body), PAGE, '20190105000000')
+    assert data.column('original').tolist() == [
+        'https://www.rbc.ru/politics/05/01/2019/a']
+    assert data.column('timestamp').tolist() == [20190105000000]
@@ -0,0 +1,107 @@
+import contextlib
+from datetime import datetime, timedelta
+
+import pandas as pd
+from bson import ObjectId
+
+from wbm_newspapers.waybackmachine.export import ExportOptions, \
+    export_collection, read_state
+
+
+class Collection:
+    """Collection with the `find` used by the export."""
+
+    name = 'rbc'
+
+    def __init__(self):
+        self.documents = []
+
+    def insert(self, seconds, timestamp='20190101000000', **fields):
+        created = datetime(2022, 1, 1) + timedelta(seconds=seconds)
+        # Time part of the id and a unique client part.
+        id_ = (str(ObjectId.from_datetime(created))[:8]
+               + f'{len(self.documents):016x}')
+        document = dict({'_id': ObjectId(id_),
+                         'timestamp': timestamp,
+                         'url': f'https://rbc.ru/{seconds}'}, **fields)
+        self.documents.append(document)
+        return document['_id']
+
+    def find(self, query, projection, sort, batch_size):
+        del projection, sort, batch_size
+        after = query.get('_id', {}).get('$gt')
+        return sorted((document for document in self.documents
+                       if after is None or document['_id'] > after),
+                      key=lambda document: document['_id'])
+
+
+def exported_urls(output):
+    data = pd.read_parquet(output / 'domain=rbc')
+    return sorted(data['url'].astype(str))
+
+
+def test_export_appends_new_documents(tmp_path):
+    collection = Collection()
+    collection.insert(0)
+    collection.insert(10)
+    assert export_collection(collection, 'rbc', str(tmp_path)) == 2
+
+    collection.insert(20)
+    assert export_collection(collection, 'rbc', str(tmp_path)) == 1
+    assert exported_urls(tmp_path) == ['https://rbc.ru/0',
+                                       'https://rbc.ru/10',
+                                       'https://rbc.ru/20']
+
+
+def test_export_appends_late_smaller_ids(tmp_path):
+    collection = Collection()
+    collection.insert(0)
+    collection.insert(100)
+    export_collection(collection, 'rbc', str(tmp_path),
+                      ExportOptions(overlap=60))
+
+    # Inserted after the export by a client with a late clock.
+    collection.insert(50)
+    collection.insert(10)
+    assert export_collection(collection, 'rbc', str(tmp_path),
+                             ExportOptions(overlap=60)) == 1
+    assert exported_urls(tmp_path) == ['https://rbc.ru/0',
+                                       'https://rbc.ru/100',
+                                       'https://rbc.ru/50']
+
+    state = read_state(str(tmp_path))['rbc']
+    assert state['last_id'] == str(collection.documents[1]['_id'])
+    assert len(state['recent']) == 2
+
+
+def test_full_export_replaces_files(tmp_path):
+    collection = Collection()
+    collection.insert(0)
+    export_collection(collection, 'rbc', str(tmp_path))
+    assert export_collection(collection, 'rbc', str(tmp_path),
+                             ExportOptions(full=True)) == 1
+    assert exported_urls(tmp_path) == ['https://rbc.ru/0']
+
+
+def object_strings():
+    """String columns of object dtype, as before pandas 3."""
+    try:
+        pd.get_option('future.infer_string')
+    except KeyError:
+        return contextlib.nullcontext()
+    return pd.option_context('future.infer_string', False)
+
+
+def test_missing_fields_are_null(tmp_path):
+    collection = Collection()
+    collection.insert(0, duplicate_of='https://rbc.ru/10')
+    collection.insert(10, title_date='05 фев, 12:03')
+    collection.insert(20, title_date=None)
+    with object_strings():
+        export_collection(collection, 'rbc', str(tmp_path))
+
+    data = pd.read_parquet(tmp_path / 'domain=rbc').sort_values('url')
+    assert data['duplicate_of'].isna().tolist() == [False, True, True]
+    assert data['title_date'].isna().tolist() == [True, False, True]
+    assert 'nan' not in set(data['duplicate_of'].dropna())
+    assert data['title_date'].dropna().tolist() == ['05 фев, 12:03']
@@ -0,0 +1,168 @@
+import math
+from datetime import date
+
+import pytest
+
+from wbm_newspapers.analysis.index import NO_DATE, Document, InvertedIndex, \
+    item_document, simple_analyzer, to_day
+
+DOCUMENTS = [
+    Document('a', 'rbc.ru', to_day('2019-01-01'), 'Бюджет бюджет налоги'),
+    Document('b', 'rbc.ru', to_day('2019-02-01'), 'Налоги и расходы'),
+    Document('c', 'meduza.io', to_day('2019-03-01'), 'Бюджет'),
+    Document('d', 'meduza.io', NO_DATE, 'Погода в Москве'),
+    Document('e', 'rbc.ru', to_day('2019-04-01'),
+             'Бюджет расходы расходы расходы налоги погода'),
+]
+
+
+def bm25(query, documents, k1=1.2, b=0.75):
+    """Reference BM25 scores by document key."""
+    terms = [simple_analyzer(document.text) for document in documents]
+    avg_length = sum(len(doc_terms) for doc_terms in terms) / len(terms)
+    scores = {}
+    for document, doc_terms in zip(documents, terms):
+        score = 0.0
+        for term in set(simple_analyzer(query)):
+            df = sum(term in other for other in terms)
+            idf = math.log(1 + (len(terms) - df + 0.5) / (df + 0.5))
+            tf = doc_terms.count(term)
+            norm = k1 * (1 - b + b * len(doc_terms) / avg_length)
+            score += idf * tf * (k1 + 1) / (tf + norm)
+        if score > 0:
+            scores[document.key] = score
+    return scores
+
+
+def build(directory, segment_size):
+    index = InvertedIndex(str(directory), segment_size=segment_size)
+    for document in DOCUMENTS:
+        index.add(document)
+    index.flush()
+    return index
+
+
+def scores(hits):
+    return {hit.key: hit.score for hit in hits}
+
+
+def test_analyzer():
+    assert simple_analyzer('Ёлка-палка, 2019 г.') == ['елка-палка', '2019',
+                                                      'г']
+
+
+def test_to_day():
+    assert to_day('1970-01-02') == 1
+    assert to_day('19700103120000') == 2
+    assert to_day(date(1970, 1, 4)) == 3
+    assert to_day('') == NO_DATE
+    assert to_day('no date') == NO_DATE
+
+
+@pytest.mark.parametrize('segment_size', [100, 2, 1])
+def test_bm25_over_segments(tmp_path, segment_size):
+    index = build(tmp_path, segment_size)
+    for query in ['бюджет', 'налоги расходы', 'погода бюджет']:
+        hits = index.search(query, limit=10)
+        expected = bm25(query, DOCUMENTS)
+        assert scores(hits) == pytest.approx(expected)
+        assert [hit.score for hit in hits] == sorted(
+            (hit.score for hit in hits), reverse=True)
+
+
+def test_limit_keeps_best_hits(tmp_path):
+    index = build(tmp_path, 2)
+    expected = bm25('бюджет расходы', DOCUMENTS)
+    best = sorted(expected, key=expected.get, reverse=True)[:2]
+    assert [hit.key for hit in index.search('бюджет расходы', limit=2)] == \
+        best
+
+
+def test_domain_and_date_filters(tmp_path):
+    index = build(tmp_path, 2)
+    hits = index.search('бюджет', domains=['meduza.io'])
+    assert [(hit.key, hit.domain, hit.date) for hit in hits] == [
+        ('c', 'meduza.io', date(2019, 3, 1))]
+    hits = index.search('бюджет погода', date_from=date(2019, 2, 1),
+                        date_to=date(2019, 3, 31))
+    assert set(scores(hits)) == {'c'}
+    # Undated documents are left out by date filters.
+    assert set(scores(index.search('погода'))) == {'d', 'e'}
+    hits = index.search('погода', date_from=date(2019, 1, 1))
+    assert set(scores(hits)) == {'e'}
+    hits = index.search('погода', date_to=date(2019, 12, 31))
+    assert set(scores(hits)) == {'e'}
+
+
+def test_merge_keeps_postings_and_scores(tmp_path):
+    index = build(tmp_path, 2)
+    assert len(index.segments) == 3
+    before = scores(index.search('бюджет налоги погода', limit=10))
+    counts = index.count_by_domain('бюджет')
+
+    index.merge()
+    assert len(index.segments) == 1
+    [segment] = index.segments
+    assert segment.n_docs == len(DOCUMENTS)
+    assert sorted(segment.domains) == ['meduza.io', 'rbc.ru']
+    docs, tf = segment.postings('расходы')
+    assert [segment.arrays['doc_keys'][doc].decode() for doc in docs] == \
+        ['b', 'e']
+    assert list(tf) == [1, 3]
+
+    assert scores(index.search('бюджет налоги погода', limit=10)) == \
+        pytest.approx(before)
+    assert index.count_by_domain('бюджет') == counts == {'rbc.ru': 2,
+                                                        'meduza.io': 1}
+
+
+def test_merge_keeps_few_segments(tmp_path):
+    index = build(tmp_path, 2)
+    index.merge(max_segments=3)
+    assert len(index.segments) == 3
+
+
+def test_reopened_index(tmp_path):
+    index = build(tmp_path, 2)
+    index.close(max_segments=2)
+    reopened = InvertedIndex(str(tmp_path))
+    assert len(reopened.segments) == 1
+    assert scores(reopened.search('бюджет')) == pytest.approx(
+        bm25('бюджет', DOCUMENTS))
+
+
+def test_item_document():
+    document = item_document({'url': 'u', 'original': 'https://www.rbc.ru/a',
+                              'timestamp': '19700105000000',
+                              'title': 'Заголовок', 'text': 'Текст'})
+    assert document == Document('u', 'rbc.ru', 4, 'Заголовок\nТекст')
+
+
+def test_known_keys_are_not_indexed_again(tmp_path):
+    index = build(tmp_path, 2)
+    # Written and buffered keys.
+    assert not index.add(DOCUMENTS[0])
+    assert index.add(Document('f', 'rbc.ru', NO_DATE, 'Новость'))
+    assert not index.add(Document('f', 'rbc.ru', NO_DATE, 'Новость'))
+    index.flush()
+    before = scores(index.search('бюджет налоги погода', limit=10))
+    counts = index.count_by_domain('бюджет')
+    index.close()
+
+    # Same documents again, like a second run over the same export.
+    reopened = build(tmp_path, 2)
+    assert sum(segment.n_docs for segment in reopened.segments) == \
+        len(DOCUMENTS) + 1
+    assert scores(reopened.search('бюджет налоги погода', limit=10)) == \
+        pytest.approx(before)
+    assert reopened.count_by_domain('бюджет') == counts
+    hits = reopened.search('бюджет', limit=10)
+    assert len(hits) == len({hit.key for hit in hits})
+
+
+def test_keys_of_segments_without_key_file(tmp_path):
+    build(tmp_path, 2).close()
+    (tmp_path / 'keys.db').unlink()
+    reopened = InvertedIndex(str(tmp_path))
+    assert all(reopened.is_indexed(document.key) for document in DOCUMENTS)
+    assert not reopened.is_indexed('f')
@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from wbm_newspapers.waybackmachine.spiders.response import \
+    WaybackMachineResponseCDX
+
+HEADER = ['urlkey', 'timestamp', 'original', 'mimetype', 'statuscode',
+          'digest', 'length']
+
+
+def rows(*originals):
+    return [['ru,rbc)/', f'2019010100000{number}', original, 'text/html',
+             '200', f'DIGEST{number}', '1000']
+            for number, original in enumerate(originals)]
+
+
+def test_from_list_compacts_columns():
+    data = WaybackMachineResponseCDX.from_list(
+        [HEADER] + rows('https://rbc.ru/a', 'https://rbc.ru/b'))
+    assert data.n_rows == 2
+    assert data.resume_key is None
+    assert list(data.columns) == list(
+        WaybackMachineResponseCDX.default_columns)
+    assert data.data['timestamp'].dtype == np.int64
+    assert isinstance(data.data['statuscode'].dtype, pd.CategoricalDtype)
+    assert data.column('original').tolist() == ['https://rbc.ru/a',
+                                                'https://rbc.ru/b']
+
+
+def test_from_text_resume_key():
+    text = json.dumps([HEADER] + rows('https://rbc.ru/a') + [[], ['key']])
+    data = WaybackMachineResponseCDX.from_text(text)
+    assert data.n_rows == 1
+    assert data.resume_key == 'key'
+
+
+def test_empty_response():
+    data = WaybackMachineResponseCDX.from_list([HEADER])
+    assert data.n_rows == 0
+    assert WaybackMachineResponseCDX.from_list([]).n_rows == 0
+
+
+def test_mask_narrows_index():
+    data = WaybackMachineResponseCDX.from_list(
+        [HEADER] + rows('https://rbc.ru/a', 'https://rbc.ru/b',
+                        'https://rbc.ru/c'))
+    masked = data.mask(np.array([True, False, True]))
+    assert masked.index.tolist() == [0, 2]
+    assert masked.column('original').tolist() == ['https://rbc.ru/a',
+                                                  'https://rbc.ru/c']
+
+    again = masked.mask(np.array([False, True]))
+    assert again.index.tolist() == [2]
+    assert again.column('original').tolist() == ['https://rbc.ru/c']
+
+
+def test_assign_values_of_selected_rows():
+    data = WaybackMachineResponseCDX.from_list(
+        [HEADER] + rows('https://rbc.ru/a', 'https://rbc.ru/b'))
+    masked = data.mask(np.array([False, True])).assign('score', [7.0])
+    assert masked.column('score').tolist() == [7.0]
+    assert masked.column('original').tolist() == ['https://rbc.ru/b']
+
+
+def test_filter_values_once_per_unique_value():
+    data = WaybackMachineResponseCDX.from_list(
+        [HEADER] + rows('https://rbc.ru/a', 'https://rbc.ru/b',
+                        'https://rbc.ru/a'))
+    calls = []
+
+    def condition(value):
+        calls.append(value)
+        return value.endswith('/a')
+
+    filtered = data.filter_values('original', condition)
+    assert sorted(calls) == ['https://rbc.ru/a', 'https://rbc.ru/b']
+    assert filtered.index.tolist() == [0, 2]
+
+
+def test_filter_values_drops_missing_values():
+    data = WaybackMachineResponseCDX(
+        pd.DataFrame({'original': ['https://rbc.ru/a', None]}))
+    filtered = data.filter_values('original', lambda value: True)
+    assert filtered.index.tolist() == [0]
+
+
+def test_concat_keeps_selected_rows_and_last_resume_key():
+    first = WaybackMachineResponseCDX.from_list(
+        [HEADER] + rows('https://rbc.ru/a', 'https://rbc.ru/b'))
+    second = WaybackMachineResponseCDX.from_list(
+        [HEADER] + rows('https://rbc.ru/c') + [[], ['key']])
+    data = WaybackMachineResponseCDX.concat(
+        [first.mask(np.array([False, True])), second])
+    assert data.column('original').tolist() == ['https://rbc.ru/b',
+                                                'https://rbc.ru/c']
+    assert data.resume_key == 'key'
+
+
+def test_archive_url():
+    url = WaybackMachineResponseCDX.to_archive_url('https://rbc.ru/a',
+                                                   '20190101000000')
+    assert url == 'https://web.archive.org/web/20190101000000/https://rbc.ru/a'
+    parsed = WaybackMachineResponseCDX.from_archive_url(url)
+    assert parsed['original'] == 'https://rbc.ru/a'
+    assert parsed['timestamp'] == '20190101000000'
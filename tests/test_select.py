@@ -0,0 +1,114 @@
+import pandas as pd
+import pytest
+
+from wbm_newspapers.waybackmachine.spiders.response import \
+    WaybackMachineResponseCDX
+from wbm_newspapers.waybackmachine.spiders.select import SnapshotSelector, \
+    url_keys
+
+HEADER = ['timestamp', 'original', 'statuscode', 'mimetype']
+
+
+def cdx(*rows):
+    return WaybackMachineResponseCDX.from_list(
+        [HEADER] + [[timestamp, original, '200', 'text/html']
+                    for timestamp, original in rows])
+
+
+def selected(data):
+    return list(zip(data.column('timestamp').tolist(),
+                    data.column('original').tolist()))
+
+
+def test_url_keys_ignore_scheme_www_and_default_port():
+    originals = pd.Series(['https://www.Rbc.ru/a',
+                           'http://rbc.ru:80/a',
+                           'rbc.ru/a',
+                           'https://rbc.ru:8080/a'])
+    assert url_keys(originals).tolist() == ['rbc.ru/a', 'rbc.ru/a',
+                                            'rbc.ru/a', 'rbc.ru:8080/a']
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        SnapshotSelector('best')
+
+
+def test_all_keeps_every_capture():
+    data = cdx(('20190101000000', 'http://rbc.ru/a'),
+               ('20190102000000', 'http://rbc.ru/a'))
+    assert SnapshotSelector('all').select(data).n_rows == 2
+
+
+def test_earliest_and_latest():
+    data = cdx(('20190102000000', 'http://rbc.ru/a'),
+               ('20190101000000', 'https://www.rbc.ru/a'),
+               ('20190103000000', 'http://rbc.ru/b'))
+    assert selected(SnapshotSelector('earliest').select(data)) == [
+        (20190101000000, 'https://www.rbc.ru/a'),
+        (20190103000000, 'http://rbc.ru/b')]
+    assert selected(SnapshotSelector('latest').select(data)) == [
+        (20190102000000, 'http://rbc.ru/a'),
+        (20190103000000, 'http://rbc.ru/b')]
+
+
+def test_closest_to_url_date():
+    data = cdx(('20190101000000', 'http://rbc.ru/a'),
+               ('20190110000000', 'http://rbc.ru/a'),
+               ('20190120000000', 'http://rbc.ru/a'))
+    url_dates = pd.Series(pd.to_datetime(['2019-01-11'] * 3))
+    data = data.assign('url_date', url_dates)
+    assert selected(SnapshotSelector('closest').select(data)) == [
+        (20190110000000, 'http://rbc.ru/a')]
+
+
+def test_last_url_key_is_carried_to_next_page():
+    selector = SnapshotSelector('latest')
+    first = selector.select(
+        cdx(('20190101000000', 'http://rbc.ru/a'),
+            ('20190102000000', 'http://rbc.ru/b'),
+            ('20190103000000', 'https://www.rbc.ru/b')),
+        stream='partition', final=False)
+    assert selected(first) == [(20190101000000, 'http://rbc.ru/a')]
+
+    last = selector.select(
+        cdx(('20190104000000', 'http://rbc.ru:80/b'),
+            ('20190105000000', 'http://rbc.ru/c')),
+        stream='partition', final=True)
+    assert selected(last) == [(20190104000000, 'http://rbc.ru:80/b'),
+                              (20190105000000, 'http://rbc.ru/c')]
+    assert selector.n_selected == 3
+
+
+def test_streams_carry_separately():
+    selector = SnapshotSelector('earliest')
+    assert selector.select(cdx(('20190101000000', 'http://rbc.ru/a')),
+                           stream=1, final=False).n_rows == 0
+    assert selector.select(cdx(('20190102000000', 'http://rbc.ru/b')),
+                           stream=2, final=True).n_rows == 1
+    assert selected(selector.select(cdx(), stream=1, final=True)) == [
+        (20190101000000, 'http://rbc.ru/a')]
+
+
+def test_selected_url_keys_are_not_selected_again():
+    selector = SnapshotSelector('earliest')
+    selector.select(cdx(('20190101000000', 'http://rbc.ru/a')), stream=1)
+    again = selector.select(cdx(('20190102000000', 'https://rbc.ru/a')),
+                            stream=2)
+    assert again.n_rows == 0
+
+
+def test_held_rows_are_flushed_without_next_page():
+    selector = SnapshotSelector('latest')
+    selector.select(cdx(('20190101000000', 'http://rbc.ru/a'),
+                        ('20190102000000', 'http://rbc.ru/b'),
+                        ('20190103000000', 'https://rbc.ru/b')),
+                    stream='partition', final=False)
+    assert selector.held_streams == ['partition']
+
+    # The request of the next page failed.
+    flushed = selector.flush('partition')
+    assert selected(flushed) == [(20190103000000, 'https://rbc.ru/b')]
+    assert selector.held_streams == []
+    assert selector.n_selected == 2
+    assert selector.flush('partition') is None
@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+from wbm_newspapers.analysis.simhash import BITS, SimHashIndex, hamming, \
+    shingles, simhash
+
+WORDS = ('бюджет налоги расходы правительство депутаты решение страна '
+         'рост компания источник год власть интерес развитие').split()
+
+
+def text(seed, n_words=60):
+    generator = random.Random(seed)
+    return ' '.join(generator.choice(WORDS) for _ in range(n_words))
+
+
+def flip(signature, bits):
+    for bit in bits:
+        signature ^= 1 << bit
+    return signature
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SimHashIndex(str(tmp_path / 'simhash.npz'), distance=3,
+                        min_tokens=10)
+
+
+def test_shingles():
+    assert shingles(['a', 'b', 'c', 'd']) == ['a b c', 'b c d']
+    assert shingles(['a', 'b']) == ['a b']
+
+
+def test_simhash_is_stable_and_64_bit():
+    features = shingles(text(1).split())
+    assert simhash(features) == simhash(list(features))
+    assert 0 <= simhash(features) < 2 ** BITS
+
+
+def test_similar_texts_have_close_signatures():
+    words = text(1, 200).split()
+    edited = words[:100] + ['новость'] + words[101:]
+    other = text(2, 200).split()
+    signature = simhash(shingles(words))
+    assert hamming(signature, simhash(shingles(edited))) < \
+        hamming(signature, simhash(shingles(other)))
+
+
+@pytest.mark.parametrize('bits', [
+    [], [0], [63], [0, 16, 32], [15, 31, 47], [60, 61, 62], [5, 6, 7],
+])
+def test_signatures_within_distance_share_a_band(index, bits):
+    signature = index.signature(text(1))
+    assert index.check('a', text(1)) is None
+    assert index.find(flip(signature, bits)) == 'a'
+
+
+@pytest.mark.parametrize('bits', [[0, 16, 32, 48], [1, 2, 3, 4, 5]])
+def test_signatures_beyond_distance_are_not_found(index, bits):
+    signature = index.signature(text(1))
+    index.check('a', text(1))
+    assert index.find(flip(signature, bits)) is None
+
+
+def test_nearest_signature_is_found(index):
+    index.check('a', text(1))
+    signature = index.signature(text(1))
+    assert index.find(flip(signature, [1])) == 'a'
+    assert index.check('b', text(1)) == 'a'
+    assert index.keys == ['a']
+
+
+def test_short_texts_are_not_checked(index):
+    assert index.signature('бюджет налоги') is None
+    assert index.check('a', 'бюджет налоги') is None
+    assert index.check('b', 'бюджет налоги') is None
+    assert index.keys == []
+
+
+def test_saved_signatures_are_loaded(tmp_path):
+    path = str(tmp_path / 'simhash.npz')
+    first = SimHashIndex(path, min_tokens=10)
+    first.check('a', text(1))
+    first.save()
+
+    # Another process saved meanwhile.
+    second = SimHashIndex(path, min_tokens=10)
+    second.check('b', text(2))
+    second.save()
+    first.check('c', text(3))
+    first.save()
+
+    loaded = SimHashIndex(path, min_tokens=10)
+    assert sorted(loaded.keys) == ['a', 'b', 'c']
+    assert loaded.check('d', text(2)) == 'b'
@@ -0,0 +1,114 @@
+import pandas as pd
+import pytest
+
+from wbm_newspapers.waybackmachine.spiders.response import \
+    WaybackMachineResponseCDX
+from wbm_newspapers.waybackmachine.spiders.sqlite_db import \
+    SqliteSnapshotStore, SqliteSpiderDatabase, acquire_store, release_store
+
+
+def snapshot(original, timestamp='20190101000000', **fields):
+    return dict({'url': f'https://web.archive.org/web/{timestamp}/{original}',
+                 'original': original,
+                 'timestamp': timestamp,
+                 'text': 'Текст',
+                 'title': 'Заголовок',
+                 'snapshot': '<html></html>'}, **fields)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteSnapshotStore(str(tmp_path / 'db' / 'snapshots.db'), 'rbc',
+                                batch_size=2)
+    yield store
+    store.close()
+
+
+def test_insert_is_batched(store):
+    store.insert(snapshot('https://rbc.ru/a'))
+    assert store.has_original('https://rbc.ru/a')
+    assert store.find_url(snapshot('https://rbc.ru/a')['url'])['title'] == \
+        'Заголовок'
+
+    store.insert(snapshot('https://rbc.ru/b'))
+    store.insert(snapshot('https://rbc.ru/c'))
+    assert store.count() == 3
+    assert not store.has_original('https://rbc.ru/d')
+
+
+def test_duplicate_urls_are_skipped(store):
+    store.insert(snapshot('https://rbc.ru/a'))
+    store.insert(snapshot('https://rbc.ru/a', title='Другой'))
+    store.insert(snapshot('https://rbc.ru/a', '20190102000000'))
+    assert store.count() == 2
+    rows = store.find_original_url('https://rbc.ru/a')
+    assert [row['timestamp'] for row in rows] == ['20190101000000',
+                                                  '20190102000000']
+    assert rows[0]['title'] == 'Заголовок'
+    assert 'snapshot' not in rows[0]
+
+
+def test_missing_fields_are_null(store):
+    store.insert(snapshot('https://rbc.ru/a', summary=None))
+    assert store.find_original_url('https://rbc.ru/a')[0]['summary'] is None
+
+
+def test_drop(store):
+    store.insert(snapshot('https://rbc.ru/a'))
+    store.flush()
+    store.drop()
+    assert store.count() == 0
+    assert not store.has_original('https://rbc.ru/a')
+
+
+def test_compact(store, tmp_path):
+    for number in range(5):
+        store.insert(snapshot(f'https://rbc.ru/{number}'))
+    directory = tmp_path / 'compact'
+    assert store.compact(str(directory), chunk_size=2) == 5
+    assert len(list(directory.glob('part-*.parquet'))) == 3
+
+    data = pd.read_parquet(directory)
+    assert sorted(data['original']) == [f'https://rbc.ru/{number}'
+                                        for number in range(5)]
+    assert 'snapshot' not in data.columns
+
+    assert store.compact(str(directory), snapshot=True) == 5
+    data = pd.read_parquet(directory)
+    assert len(list(directory.glob('part-*.parquet'))) == 1
+    assert set(data['snapshot']) == {'<html></html>'}
+
+
+def test_reopened_file_keeps_snapshots(tmp_path):
+    path = str(tmp_path / 'snapshots.db')
+    store = SqliteSnapshotStore(path, 'rbc')
+    store.insert(snapshot('https://rbc.ru/a'))
+    store.close()
+
+    store = SqliteSnapshotStore(path, 'rbc')
+    assert store.count() == 1
+    store.close()
+
+
+def test_shared_store_is_closed_by_last_release(tmp_path):
+    path = str(tmp_path / 'snapshots.db')
+    first = acquire_store(path, 'rbc')
+    second = acquire_store(path, 'rbc')
+    assert first is second
+    release_store(path, 'rbc')
+    assert first.count() == 0
+    release_store(path, 'rbc')
+    assert acquire_store(path, 'rbc') is not first
+    release_store(path, 'rbc')
+
+
+def test_spider_database_filters_stored_originals(tmp_path):
+    database = SqliteSpiderDatabase('rbc', str(tmp_path / 'snapshots.db'))
+    database.store.insert(snapshot('https://rbc.ru/a'))
+    data = WaybackMachineResponseCDX.from_list(
+        [['timestamp', 'original'],
+         ['20190102000000', 'https://rbc.ru/a'],
+         ['20190102000000', 'https://rbc.ru/b']])
+    assert database.filter(data).column('original').tolist() == [
+        'https://rbc.ru/b']
+    database.close()
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from wbm_newspapers.analysis.tokens import read_articles
+
+
+def test_read_articles_missing_text(tmp_path):
+    pd.DataFrame({'url': ['a', 'b'], 'text': ['Текст', None]}) \
+        .to_parquet(tmp_path / 'part-1.parquet')
+    pd.DataFrame({'url': ['c'], 'text': [np.nan]}) \
+        .to_parquet(tmp_path / 'part-2.parquet')
+    pd.DataFrame({'url': ['d'], 'text': pd.Series([pd.NA], dtype='string')}) \
+        .to_parquet(tmp_path / 'part-3.parquet')
+
+    assert list(read_articles(str(tmp_path))) == [
+        ('a', 'Текст'), ('b', ''), ('c', ''), ('d', '')]
+
+
+def test_read_articles_skip(tmp_path):
+    pd.DataFrame({'url': ['a', 'b'], 'text': ['x', 'y']}) \
+        .to_parquet(tmp_path / 'part-1.parquet')
+    assert list(read_articles(str(tmp_path), skip={'a'})) == [('b', 'y')]
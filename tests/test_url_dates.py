@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pandas as pd
+
+from wbm_newspapers.domains.meduza import extract as meduza
+from wbm_newspapers.domains.rbc import extract as rbc
+from wbm_newspapers.extraction.utils import extract_url_dates
+
+RBC_URLS = ['https://www.rbc.ru/politics/05/02/2019/5c59a1e69a79470a9e1b7a67',
+            'https://www.rbc.ru/2019/02/05/article',
+            'https://www.rbc.ru/politics/',
+            'https://www.rbc.ru/politics/31/02/2019/wrong']
+
+MEDUZA_URLS = ['https://meduza.io/news/2019/03/20/novost',
+               'https://meduza.io/feature/2019/13/20/wrong',
+               'https://meduza.io/']
+
+
+def test_first_matching_format():
+    dates = extract_url_dates(pd.Series(RBC_URLS), rbc.URL_DATE_FORMATS)
+    assert dates.dtype == 'datetime64[ns]'
+    assert dates.tolist()[:2] == [pd.Timestamp('2019-02-05'),
+                                  pd.Timestamp('2019-02-05')]
+    assert dates.isna().tolist() == [False, False, True, True]
+
+
+def test_keeps_index():
+    urls = pd.Series(MEDUZA_URLS, index=[10, 20, 30])
+    dates = extract_url_dates(urls, meduza.URL_DATE_FORMATS)
+    assert dates.index.tolist() == [10, 20, 30]
+    assert dates[10] == pd.Timestamp('2019-03-20')
+    assert dates[[20, 30]].isna().all()
+
+
+def test_same_dates_as_single_url_extraction():
+    # Single URL extraction raises on invalid dates.
+    for module, urls in [(rbc, RBC_URLS[:3]), (meduza, MEDUZA_URLS[::2])]:
+        dates = extract_url_dates(pd.Series(urls), module.URL_DATE_FORMATS)
+        for url, date in zip(urls, dates):
+            expected = module.get_url_date_iso(url)
+            if expected is None:
+                assert pd.isna(date), url
+            else:
+                assert isinstance(expected, datetime)
+                assert date == pd.Timestamp(expected), url
+
+
+def test_no_formats():
+    dates = extract_url_dates(pd.Series(RBC_URLS), [])
+    assert dates.isna().all()
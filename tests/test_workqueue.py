@@ -0,0 +1,93 @@
+import pytest
+
+from wbm_newspapers.waybackmachine.spiders import workqueue
+from wbm_newspapers.waybackmachine.spiders.workqueue import DONE, FAILED, \
+    LEASED, PENDING, create_work_queue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(workqueue.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    del clock
+    queue = create_work_queue({'path': str(tmp_path / 'queue.db'),
+                               'lease_seconds': 60,
+                               'max_attempts': 2},
+                              'units')
+    yield queue
+    queue.close()
+
+
+def units(*keys):
+    return [{'key': key, 'url': f'https://rbc.ru/{key}'} for key in keys]
+
+
+def test_publish_skips_known_keys(queue):
+    assert queue.publish(units('a', 'b')) == 2
+    assert queue.publish(units('b', 'c')) == 1
+    assert queue.counts() == {PENDING: 3}
+
+
+def test_lease_and_ack(queue):
+    queue.publish(units('a', 'b', 'c'))
+    leased = queue.lease('worker-1', 2)
+    assert [unit.key for unit in leased] == ['a', 'b']
+    assert leased[0].payload == {'key': 'a', 'url': 'https://rbc.ru/a'}
+    assert leased[0].attempts == 1
+    assert [unit.key for unit in queue.lease('worker-2', 5)] == ['c']
+    assert queue.lease('worker-2', 5) == []
+
+    for unit in leased:
+        queue.ack(unit.id)
+    assert queue.counts() == {DONE: 2, LEASED: 1}
+
+
+def test_expired_lease_is_leased_again(queue, clock):
+    queue.publish(units('a'))
+    queue.lease('worker-1', 1)
+    clock[0] += 30
+    assert queue.lease('worker-2', 1) == []
+
+    clock[0] += 31
+    assert queue.counts() == {PENDING: 1}
+    [unit] = queue.lease('worker-2', 1)
+    assert unit.attempts == 2
+
+    # Last attempt expired.
+    clock[0] += 61
+    assert queue.counts() == {FAILED: 1}
+    assert queue.lease('worker-3', 1) == []
+
+
+def test_fail_retries_until_max_attempts(queue):
+    queue.publish(units('a'))
+    [unit] = queue.lease('worker-1', 1)
+    queue.fail(unit.id, 'timeout')
+    assert queue.counts() == {PENDING: 1}
+
+    [unit] = queue.lease('worker-1', 1)
+    queue.fail(unit.id, 'timeout')
+    assert queue.counts() == {FAILED: 1}
+
+
+def test_fail_without_retry(queue):
+    queue.publish(units('a'))
+    [unit] = queue.lease('worker-1', 1)
+    queue.fail(unit.id, 'ValueError()', retry=False)
+    assert queue.counts() == {FAILED: 1}
+    assert queue.lease('worker-1', 1) == []
+
+
+def test_drained_after_closed(queue):
+    queue.publish(units('a'))
+    assert not queue.is_drained()
+    [unit] = queue.lease('worker-1', 1)
+    queue.set_closed()
+    assert not queue.is_drained()
+    queue.ack(unit.id)
+    assert queue.is_drained()
@@ -1,56 +1,543 @@
-"""Command line tool."""
+"""
+Command line tool.
+
+Only the crawl command loads Scrapy and the spiders, other commands
+use the spider registry and settings files.
+"""
 import argparse
+import logging
+import os
+import sys
+from typing import Any, List, TextIO
 
-from scrapy.crawler import CrawlerProcess
-from scrapy.settings import Settings
+from wbm_newspapers.waybackmachine.spiders.registry import (SPIDERS,
+                                                            get_entry,
+                                                            load_spider)
 
+logger = logging.getLogger(__name__)
+
+PROJECT_SETTINGS = 'wbm_newspapers.waybackmachine.settings'
+
+# Fields of the CDX server plain text output.
+CDX_TEXT_FIELDS = 7
 
-def main():
-    """Main function."""
 
-    args = parse_args()
+def settings_path(args: argparse.Namespace, domain: str) -> str:
+    """Settings file of the domain."""
+    return os.path.join(args.settings_dir, get_entry(domain).settings_file)
 
-    # config = {
-    #     'domains': args.domains,
-    # }
 
-    settings = Settings({
-        # 'USER_AGENT': (
-        #     'Wayback Machine Scraper/{0} '
-        #     '(+https://github.com/sangaline/scrapy-wayback-machine)'
-        # ).format(get_distribution('wayback-machine-scraper').version),
+def crawler_settings(args: argparse.Namespace):
+    """
+    Project settings with one archive.org budget for all crawlers.
+
+    Every crawler may use the whole concurrency, the shared budget
+    limits the rate and the requests in flight of the process and
+    serves domains in turn.
+    """
+    from scrapy.settings import \
+        Settings  # pylint: disable=import-outside-toplevel
+
+    settings = Settings()
+    settings.setmodule(PROJECT_SETTINGS, priority='project')
+    settings.setdict({
         'LOG_LEVEL': 'DEBUG' if args.verbose else 'INFO',
-        'DOWNLOADER_MIDDLEWARES': {
-            'scrapy_wayback_machine.WaybackMachineMiddleware': 5,
-        },
-        'AUTOTHROTTLE_ENABLED': True,
-        'AUTOTHROTTLE_DEBUG': args.verbose,
-        'AUTOTHROTTLE_START_DELAY': 1,
-        # 'AUTOTHROTTLE_TARGET_CONCURRENCY': args.concurrency,
-        # 'WAYBACK_MACHINE_TIME_RANGE': (getattr(args, 'from'), args.to),
-    })
-
-    process = CrawlerProcess(settings)
-    # process.crawl(MirrorSpider, **config)
+        'ARCHIVE_RATE_LIMIT': args.rate,
+        'ARCHIVE_RATE_BURST': args.burst,
+        'ARCHIVE_CONCURRENCY': args.concurrency,
+        'CONCURRENT_REQUESTS': args.concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrency,
+        'DOWNLOAD_DELAY': 0,
+        'AUTOTHROTTLE_ENABLED': False,
+        'LOG_QUEUE_ENABLED': True,
+    }, priority='cmdline')
+    return settings
+
+
+def crawl(args: argparse.Namespace):
+    """Run spiders of several domains in one process."""
+    if args.engine == 'asyncio':
+        if args.mode:
+            sys.exit("Crawl modes are supported by the scrapy engine only")
+        crawl_asyncio(args)
+        return
+
+    from scrapy.crawler import \
+        CrawlerProcess  # pylint: disable=import-outside-toplevel
+
+    process = CrawlerProcess(crawler_settings(args))
+
+    for domain in args.domains:
+        settings_file = settings_path(args, domain)
+        logger.info("Domain '%s' with settings '%s'", domain, settings_file)
+        process.crawl(load_spider(domain),
+                      settings_file=settings_file,
+                      clear=str(args.clear),
+                      mode=args.mode)
+
     process.start()
 
 
-def parse_args():
+def crawl_asyncio(args: argparse.Namespace):
+    """Run asyncio engines of several domains sharing one token bucket."""
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    from wbm_newspapers.waybackmachine.engine import (  # pylint: disable=import-outside-toplevel
+        AsyncEngine, EngineOptions)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    options = EngineOptions(concurrency=args.concurrency,
+                            rate=args.rate,
+                            burst=args.burst,
+                            workers=args.workers,
+                            clear=args.clear)
+    engines = [AsyncEngine(domain, settings_path(args, domain),
+                           options=options)
+               for domain in args.domains]
+    for engine in engines[1:]:
+        engine.bucket = engines[0].bucket
+
+    async def _crawl():
+        return await asyncio.gather(*[engine.crawl() for engine in engines])
+
+    asyncio.run(_crawl())
+
+
+def list_spiders(args: argparse.Namespace):
+    """Print registered domains."""
+    for domain, entry in SPIDERS.items():
+        print(f"{domain:<10} {entry.name:<16} {settings_path(args, domain)}")
+
+
+def validate(args: argparse.Namespace):
+    """Check settings files of the domains."""
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    from wbm_newspapers.waybackmachine.spiders.config import (  # pylint: disable=import-outside-toplevel
+        read_settings_file, validate_settings)
+
+    n_errors = 0
+    for domain in args.domains or list(SPIDERS):
+        path = ''
+        try:
+            path = settings_path(args, domain)
+            errors = validate_settings(read_settings_file(path))
+        except (KeyError, OSError, ValueError, yaml.YAMLError) as error:
+            errors = [str(error)]
+        n_errors += len(errors)
+        print(f"{domain}: {path}: {'OK' if not errors else 'FAILED'}")
+        for error in errors:
+            print(f"    {error}")
+
+    if n_errors > 0:
+        sys.exit(1)
+
+
+def dry_run(args: argparse.Namespace):
+    """
+    Apply the domain filter to URLs or CDX text lines.
+
+    Lines with CDX server plain text output are also filtered by
+    statuscode and mimetype.
+    """
+    from wbm_newspapers.waybackmachine.spiders.config import \
+        read_settings_file  # pylint: disable=import-outside-toplevel
+    from wbm_newspapers.waybackmachine.spiders.filters import \
+        DefaultFilter  # pylint: disable=import-outside-toplevel
+
+    settings = read_settings_file(settings_path(args, args.domain))
+    url_filter = DefaultFilter(**settings['filter'])
+
+    stream: TextIO = sys.stdin
+    if args.input != '-':
+        stream = open(args.input, 'r', encoding='utf-8')  # pylint: disable=consider-using-with
+
+    n_kept = n_skipped = 0
+    with stream:
+        for line in stream:
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) == CDX_TEXT_FIELDS:
+                url, mimetype, statuscode = fields[2], fields[3], fields[4]
+                kept = (url_filter.filter_url(url)
+                        and url_filter.filter_statuscode(statuscode)
+                        and url_filter.filter_mimetype(mimetype))
+            else:
+                url = fields[0]
+                kept = url_filter.filter_url(url)
+
+            if kept:
+                n_kept += 1
+            else:
+                n_skipped += 1
+            if args.show == 'all' or (args.show == 'kept') == kept:
+                print(f"{'+' if kept else '-'} {url}")
+
+    print(f"kept {n_kept}, skipped {n_skipped}", file=sys.stderr)
+
+
+def export(args: argparse.Namespace):
+    """Export spider collections to partitioned Parquet."""
+    from wbm_newspapers.waybackmachine.export import (  # pylint: disable=import-outside-toplevel
+        ExportOptions, export_collection)
+    from wbm_newspapers.waybackmachine.spiders.config import (  # pylint: disable=import-outside-toplevel
+        DB_HOST, DB_NAME, read_settings_file)
+    from wbm_newspapers.waybackmachine.spiders.db import (  # pylint: disable=import-outside-toplevel
+        acquire_client, release_client)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    options = ExportOptions(batch_size=args.batch_size,
+                            snapshot=args.snapshot,
+                            full=args.full,
+                            overlap=args.overlap)
+    for domain in args.domains:
+        settings = read_settings_file(settings_path(args, domain))
+        db_settings = settings.get('db') or {}
+        address = (db_settings.get('host', DB_HOST),
+                   db_settings.get('database', DB_NAME))
+        client = acquire_client(*address)
+        try:
+            n_documents = export_collection(
+                client.db[get_entry(domain).name],
+                domain,
+                os.path.expanduser(args.output),
+                options)
+        finally:
+            release_client(*address)
+        print(f"{domain}: {n_documents} documents exported")
+
+
+def tokens(args: argparse.Namespace):
+    """Count tokens of stored articles which have no counts yet."""
+    from wbm_newspapers.analysis.tokens import (  # pylint: disable=import-outside-toplevel
+        TokenCountStore, count_tokens, read_articles, token_pool)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    store = TokenCountStore(os.path.expanduser(args.output))
+    articles = read_articles(os.path.expanduser(args.input), store.keys())
+    n_articles = 0
+    with token_pool(args.workers, args.language) as pool:
+        for keys, counts in count_tokens(pool, articles, args.batch_size):
+            store.append(keys, counts)
+            n_articles += len(keys)
+            logger.info("Counted tokens of %d articles", n_articles)
+    print(f"{n_articles} articles, {len(store.vocabulary)} terms")
+
+
+def index(args: argparse.Namespace):
+    """Add articles of Parquet files to the inverted index."""
+    import glob  # pylint: disable=import-outside-toplevel
+
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    from wbm_newspapers.analysis.index import (  # pylint: disable=import-outside-toplevel
+        InvertedIndex, item_document)
+
+    logging.basicConfig(level=logging.INFO)
+    inverted_index = InvertedIndex(os.path.expanduser(args.index),
+                                   segment_size=args.segment_size)
+    files = sorted(glob.glob(os.path.join(os.path.expanduser(args.input),
+                                          '**', '*.parquet'),
+                             recursive=True))
+    n_articles = n_added = 0
+    for filename in files:
+        data = pd.read_parquet(filename)
+        data = data.astype(object).where(data.notna(), None)
+        for item in data.to_dict('records'):
+            n_added += inverted_index.add(item_document(item))
+        n_articles += len(data)
+    inverted_index.close(args.max_segments)
+    print(f"{n_added} of {n_articles} articles indexed, "
+          f"{n_articles - n_added} indexed before")
+
+
+def search(args: argparse.Namespace):
+    """Query the inverted index."""
+    from datetime import date  # pylint: disable=import-outside-toplevel
+
+    from wbm_newspapers.analysis.index import \
+        InvertedIndex  # pylint: disable=import-outside-toplevel
+
+    inverted_index = InvertedIndex(os.path.expanduser(args.index))
+    date_from = None if args.date_from is None \
+        else date.fromisoformat(args.date_from)
+    date_to = None if args.date_to is None \
+        else date.fromisoformat(args.date_to)
+    if args.by_domain:
+        counts = inverted_index.count_by_domain(args.query, date_from, date_to)
+        for domain, count in sorted(counts.items(), key=lambda x: -x[1]):
+            print(f"{count:>8} {domain}")
+        return
+
+    for hit in inverted_index.search(args.query,
+                                     domains=args.domains,
+                                     date_from=date_from,
+                                     date_to=date_to,
+                                     limit=args.limit):
+        print(f"{hit.score:8.3f} {str(hit.date or ''):<10} {hit.domain:<16} "
+              f"{hit.key}")
+
+
+def aggregates(args: argparse.Namespace):
+    """Add articles of Parquet files to the materialized aggregates."""
+    import glob  # pylint: disable=import-outside-toplevel
+
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    from wbm_newspapers.analysis.aggregates import \
+        AggregateStore  # pylint: disable=import-outside-toplevel
+
+    logging.basicConfig(level=logging.INFO)
+    store = AggregateStore(os.path.expanduser(args.output),
+                           batch_size=args.batch_size)
+    files = sorted(glob.glob(os.path.join(os.path.expanduser(args.input),
+                                          '**', '*.parquet'),
+                             recursive=True))
+    n_articles = n_added = 0
+    for filename in files:
+        data = pd.read_parquet(filename)
+        data = data.astype(object).where(data.notna(), None)
+        for item in data.to_dict('records'):
+            n_added += store.add(item)
+        n_articles += len(data)
+    store.close()
+    print(f"{n_added} of {n_articles} articles added")
+
+
+def dashboard(args: argparse.Namespace):
+    """Serve the table dashboard of the aggregates."""
+    from wbm_newspapers.dashboards.table.server import \
+        TableServer  # pylint: disable=import-outside-toplevel
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    path = os.path.expanduser(args.aggregates)
+    if not os.path.exists(path):
+        sys.exit(f"Aggregates file '{path}' does not exist")
+    with TableServer(path, args.host, args.port) as server:
+        print(f"Serving '{path}' on http://{args.host}:{args.port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv: List[str] = None):
+    """Main function."""
+    args = parse_args(argv)
+    args.func(args)
+
+
+def add_analysis_parsers(subparsers: Any,
+                         formatter: type,
+                         common: argparse.ArgumentParser):
+    """
+    Commands over stored articles: export, tokens, index, search,
+    aggregates and dashboard.
+    """
+    export_parser = subparsers.add_parser(
+        'export', formatter_class=formatter, parents=[common], help=(
+            'Append new documents of domain collections to Parquet files '
+            'partitioned by domain and month.'
+        ))
+    export_parser.set_defaults(func=export)
+    export_parser.add_argument('domains', metavar='DOMAIN', nargs='+',
+                               choices=list(SPIDERS))
+    export_parser.add_argument('--output', default='~/wbm_data/data/export',
+                               help='Dataset directory.')
+    export_parser.add_argument('--batch-size', type=int, default=10000,
+                               help='Documents read and written at once.')
+    export_parser.add_argument('--snapshot', action='store_true', help=(
+        'Export raw pages too.'
+    ))
+    export_parser.add_argument('--full', action='store_true', help=(
+        'Export all documents again instead of appending new ones.'
+    ))
+    export_parser.add_argument('--overlap', type=float, default=600.0, help=(
+        'Seconds before the last exported document read again, documents '
+        'inserted later with client made smaller ids are appended too.'
+    ))
+    export_parser.add_argument('-v', '--verbose', action='store_true', help=(
+        'Turn on debug logging.'
+    ))
+
+    tokens_parser = subparsers.add_parser(
+        'tokens', formatter_class=formatter, help=(
+            'Save token count vectors of articles in Parquet files '
+            'of export or storage compaction, requires nltk.'
+        ))
+    tokens_parser.set_defaults(func=tokens)
+    tokens_parser.add_argument('input', metavar='INPUT', help=(
+        'Directory with Parquet files, like ~/wbm_data/data/export/domain=rbc.'
+    ))
+    tokens_parser.add_argument('output', metavar='OUTPUT', help=(
+        'Token counts directory, new articles are appended.'
+    ))
+    tokens_parser.add_argument('--workers', type=int, help=(
+        'Tokenizing processes, CPU count by default.'
+    ))
+    tokens_parser.add_argument('--batch-size', type=int, default=500,
+                               help='Articles tokenized by a worker at once.')
+    tokens_parser.add_argument('--language', default='russian', help=(
+        'Stemmer and stopwords language.'
+    ))
+    tokens_parser.add_argument('-v', '--verbose', action='store_true', help=(
+        'Turn on debug logging.'
+    ))
+
+    index_parser = subparsers.add_parser(
+        'index', formatter_class=formatter, help=(
+            'Add articles of Parquet files of export or storage compaction '
+            'to the inverted index.'
+        ))
+    index_parser.set_defaults(func=index)
+    index_parser.add_argument('input', metavar='INPUT', help=(
+        'Directory with Parquet files.'
+    ))
+    index_parser.add_argument('--index', default='~/wbm_data/data/index',
+                              help='Index directory.')
+    index_parser.add_argument('--segment-size', type=int, default=10000,
+                              help='Articles written as one segment.')
+    index_parser.add_argument('--max-segments', type=int, default=10,
+                              help='Segments are merged above this number.')
+
+    search_parser = subparsers.add_parser(
+        'search', formatter_class=formatter, help=(
+            'Articles ranked by BM25 or article counts by domain.'
+        ))
+    search_parser.set_defaults(func=search)
+    search_parser.add_argument('query', metavar='QUERY')
+    search_parser.add_argument('--index', default='~/wbm_data/data/index',
+                               help='Index directory.')
+    search_parser.add_argument('--domain', dest='domains', action='append',
+                               help='Article domain, may be repeated.')
+    search_parser.add_argument('--from', dest='date_from', help=(
+        'First article date, YYYY-MM-DD.'
+    ))
+    search_parser.add_argument('--to', dest='date_to', help=(
+        'Last article date, YYYY-MM-DD.'
+    ))
+    search_parser.add_argument('--limit', type=int, default=10,
+                               help='Number of articles.')
+    search_parser.add_argument('--by-domain', action='store_true', help=(
+        'Count articles with all query terms by domain.'
+    ))
+
+    aggregates_parser = subparsers.add_parser(
+        'aggregates', formatter_class=formatter, help=(
+            'Add articles of Parquet files to per day aggregates, '
+            'articles counted before are skipped.'
+        ))
+    aggregates_parser.set_defaults(func=aggregates)
+    aggregates_parser.add_argument('input', metavar='INPUT', help=(
+        'Directory with Parquet files.'
+    ))
+    aggregates_parser.add_argument(
+        '--output', default='~/wbm_data/data/aggregates.sqlite',
+        help='Aggregates database.')
+    aggregates_parser.add_argument('--batch-size', type=int, default=500,
+                                   help='Articles added in one transaction.')
+
+    dashboard_parser = subparsers.add_parser(
+        'dashboard', formatter_class=formatter, help=(
+            'Serve paginated tables of the aggregates over HTTP.'
+        ))
+    dashboard_parser.set_defaults(func=dashboard)
+    dashboard_parser.add_argument(
+        '--aggregates', default='~/wbm_data/data/aggregates.sqlite',
+        help='Aggregates database.')
+    dashboard_parser.add_argument('--host', default='127.0.0.1',
+                                  help='Listening address.')
+    dashboard_parser.add_argument('--port', type=int, default=8050,
+                                  help='Listening port.')
+    dashboard_parser.add_argument('-v', '--verbose', action='store_true',
+                                  help='Log requests.')
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
     """Argument parsing."""
 
     formatter = argparse.ArgumentDefaultsHelpFormatter
     parser = argparse.ArgumentParser(formatter_class=formatter, description=(
-        'Mirror all Wayback Machine snapshots of one or more domains '
-        'within a specified time range.'
+        'Scrape newspaper snapshots from the Wayback Machine.'
     ))
-
-    parser.add_argument('domains', metavar='DOMAIN', nargs='+', help=(
-        'Specify the domain(s) to scrape. '
-        'Can also be a full URL to specify starting points for the crawler.'
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--settings-dir', default='settings', help=(
+        'Directory with spider settings files.'
     ))
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    crawl_parser = subparsers.add_parser(
+        'crawl', formatter_class=formatter, parents=[common], help=(
+            'Crawl one or more domains in one process.'
+        ))
+    crawl_parser.set_defaults(func=crawl)
 
-    parser.add_argument('-v', '--verbose', action='store_true', help=(
+    crawl_parser.add_argument('domains', metavar='DOMAIN', nargs='+',
+                              choices=list(SPIDERS), help=(
+                                  'Domains to scrape: '
+                                  f'{", ".join(SPIDERS)}.'
+                              ))
+    crawl_parser.add_argument('--clear', action='store_true', help=(
+        'Drop collections of the domains before crawling.'
+    ))
+    crawl_parser.add_argument('--rate', type=float, default=3.0, help=(
+        'archive.org requests per second for all domains together.'
+    ))
+    crawl_parser.add_argument('--burst', type=float, default=3.0, help=(
+        'archive.org requests allowed at once after idle time.'
+    ))
+    crawl_parser.add_argument('--concurrency', type=int, default=8, help=(
+        'archive.org requests in flight for all domains together.'
+    ))
+    crawl_parser.add_argument('--engine', default='scrapy',
+                              choices=['scrapy', 'asyncio'], help=(
+                                  'Fetch engine, asyncio requires aiohttp.'
+                              ))
+    crawl_parser.add_argument('--mode', default='',
+                              choices=['', 'coordinator', 'worker'], help=(
+                                  'Publish snapshots to the work queue '
+                                  '(coordinator) or download snapshots '
+                                  'from it (worker), both by default.'
+                              ))
+    crawl_parser.add_argument('--workers', type=int, help=(
+        'Extraction processes of the asyncio engine, CPU count by default.'
+    ))
+    crawl_parser.add_argument('-v', '--verbose', action='store_true', help=(
         'Turn on debug logging.'
     ))
 
-    return parser.parse_args()
+    list_parser = subparsers.add_parser('list', parents=[common], help=(
+        'List registered domains and their settings files.'
+    ))
+    list_parser.set_defaults(func=list_spiders)
+
+    validate_parser = subparsers.add_parser(
+        'validate', parents=[common], help=(
+            'Check settings files, all domains by default.'
+        ))
+    validate_parser.set_defaults(func=validate)
+    validate_parser.add_argument('domains', metavar='DOMAIN', nargs='*')
+
+    dry_run_parser = subparsers.add_parser(
+        'dry-run', formatter_class=formatter, parents=[common], help=(
+            'Filter URLs or CDX text lines with the domain settings.'
+        ))
+    dry_run_parser.set_defaults(func=dry_run)
+    dry_run_parser.add_argument('domain', metavar='DOMAIN',
+                                choices=list(SPIDERS))
+    dry_run_parser.add_argument('--input', default='-', help=(
+        'File with one URL or CDX line per line, standard input by default.'
+    ))
+    dry_run_parser.add_argument('--show', default='all',
+                                choices=['all', 'kept', 'skipped'], help=(
+                                    'Lines to print.'
+                                ))
+
+    add_analysis_parsers(subparsers, formatter, common)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main()
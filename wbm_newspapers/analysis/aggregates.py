@@ -0,0 +1,303 @@
+"""
+Materialized time-series aggregates of stored articles.
+
+Counts are kept in a SQLite file and updated incrementally, by
+`AggregatesPipeline` during crawls or by the `aggregates` command over
+Parquet files, so dashboards read small tables instead of scanning
+article collections:
+
+- `domain_day`: articles and words per domain and article date,
+- `section_day`: articles per domain, first URL path section
+  (`get_url_path_section`) and date,
+- `term_day`: term occurrences and articles with the term per date.
+
+Articles are counted once by their original URL, keys of counted
+articles are kept in the `articles` table.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import (Any, Callable, Dict, List, NamedTuple, Optional, Set,
+                    Tuple)
+
+from wbm_newspapers.analysis.index import (EPOCH, NO_DATE, item_document,
+                                           simple_analyzer)
+from wbm_newspapers.extraction.utils import get_url_path_section
+from wbm_newspapers.sqlite import connect
+
+logger = logging.getLogger(__name__)
+
+
+class TableSpec(NamedTuple):
+    """Aggregate table with key and count columns."""
+
+    keys: Tuple[str, ...]
+    values: Tuple[str, ...]
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        """All columns."""
+        return self.keys + self.values
+
+
+TABLES: Dict[str, TableSpec] = {
+    'domain_day': TableSpec(('domain', 'day'), ('articles', 'words')),
+    'section_day': TableSpec(('domain', 'section', 'day'), ('articles',)),
+    'term_day': TableSpec(('term', 'day'), ('count', 'articles')),
+}
+
+# Indexes of dashboard queries besides primary keys.
+_INDEXES = (
+    ('domain_day_day', 'domain_day', ('day',)),
+    ('section_day_day', 'section_day', ('day', 'articles')),
+    ('term_day_day', 'term_day', ('day', 'count')),
+)
+
+
+def day_string(day: int) -> str:
+    """ISO date of days since epoch, empty string for unknown dates."""
+    if day == NO_DATE:
+        return ''
+    return (EPOCH + timedelta(days=day)).isoformat()
+
+
+def url_section(url: str) -> str:
+    """First path section of the URL, empty for the root path."""
+    try:
+        return get_url_path_section(url)
+    except IndexError:
+        return ''
+
+
+def create_tables(connection: sqlite3.Connection):
+    """Create aggregate tables and indexes."""
+    connection.execute("CREATE TABLE IF NOT EXISTS articles "
+                       "(key TEXT PRIMARY KEY) WITHOUT ROWID")
+    for name, spec in TABLES.items():
+        columns = ', '.join([f"{key} TEXT NOT NULL" for key in spec.keys]
+                            + [f"{value} INTEGER NOT NULL DEFAULT 0"
+                               for value in spec.values])
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} ({columns}, "
+            f"PRIMARY KEY ({', '.join(spec.keys)})) WITHOUT ROWID")
+    for name, table, columns in _INDEXES:
+        connection.execute(f"CREATE INDEX IF NOT EXISTS {name} "
+                           f"ON {table} ({', '.join(columns)})")
+
+
+class AggregateStore:
+    """Writer of aggregate tables."""
+
+    def __init__(self,
+                 path: str,
+                 batch_size: int = 500,
+                 analyzer: Callable[[str], List[str]] = simple_analyzer,
+                 min_term_length: int = 3):
+        """
+        Parameters
+        ----------
+        path : str
+            Database file.
+        batch_size : int, optional
+            Articles added in one transaction, by default 500.
+        analyzer : Callable[[str], List[str]], optional
+            Text to terms, by default `simple_analyzer`.
+        min_term_length : int, optional
+            Shorter terms and numbers are not counted, by default 3.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.batch_size = batch_size
+        self.analyzer = analyzer
+        self.min_term_length = min_term_length
+        self._pending: Dict[str, Dict[Tuple[str, ...], Counter]] = {
+            name: defaultdict(Counter) for name in TABLES}
+        self._pending_keys: Set[str] = set()
+        self._lock = threading.RLock()
+        self._connection = connect(path)
+        create_tables(self._connection)
+
+    def add(self, item: Dict[str, Any]) -> bool:
+        """
+        Account article item, like a stored snapshot.
+
+        Returns
+        -------
+        bool
+            False if the article was counted before.
+        """
+        key = str(item.get('original') or item.get('url'))
+        document = item_document(item)
+        day = day_string(document.day)
+        terms = [term for term in self.analyzer(document.text)
+                 if len(term) >= self.min_term_length and not term.isdigit()]
+
+        with self._lock:
+            if key in self._pending_keys or self._is_counted(key):
+                return False
+            self._pending_keys.add(key)
+            self._pending['domain_day'][(document.domain, day)] += \
+                Counter(articles=1, words=len(terms))
+            self._pending['section_day'][
+                (document.domain, url_section(key), day)] += \
+                Counter(articles=1)
+            term_counts = self._pending['term_day']
+            for term, count in Counter(terms).items():
+                term_counts[(term, day)] += Counter(count=count, articles=1)
+            if len(self._pending_keys) >= self.batch_size:
+                self.flush()
+        return True
+
+    def _is_counted(self, key: str) -> bool:
+        row = self._connection.execute(
+            "SELECT 1 FROM articles WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def flush(self):
+        """Add pending counts to the tables in one transaction."""
+        with self._lock:
+            if not self._pending_keys:
+                return
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO articles (key) VALUES (?)",
+                [(key,) for key in self._pending_keys])
+            for name, spec in TABLES.items():
+                self._connection.executemany(
+                    self._upsert_statement(name, spec),
+                    [keys + tuple(counts[value] for value in spec.values)
+                     for keys, counts in self._pending[name].items()])
+            self._connection.execute("COMMIT")
+            logger.debug("Aggregates of %d articles written",
+                         len(self._pending_keys))
+            self._pending = {name: defaultdict(Counter) for name in TABLES}
+            self._pending_keys = set()
+
+    @staticmethod
+    def _upsert_statement(name: str, spec: TableSpec) -> str:
+        updates = ', '.join(f"{value} = {value} + excluded.{value}"
+                            for value in spec.values)
+        return (f"INSERT INTO {name} ({', '.join(spec.columns)}) "
+                f"VALUES ({', '.join('?' * len(spec.columns))}) "
+                f"ON CONFLICT ({', '.join(spec.keys)}) DO UPDATE SET "
+                f"{updates}")
+
+    def close(self):
+        """Write pending counts and close the file."""
+        self.flush()
+        self._connection.close()
+
+
+class PageQuery(NamedTuple):
+    """Page of an aggregate table."""
+
+    table: str = 'domain_day'
+    filters: Optional[Dict[str, str]] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    sort: str = 'day'
+    descending: bool = True
+    page: int = 1
+    per_page: int = 50
+
+
+class Page(NamedTuple):
+    """Rows of a page with the number of all matching rows."""
+
+    columns: Tuple[str, ...]
+    rows: List[Tuple[Any, ...]]
+    total: int
+    query: PageQuery
+
+    @property
+    def n_pages(self) -> int:
+        """Number of pages."""
+        return max(1, -(-self.total // self.query.per_page))
+
+
+def read_page(connection: sqlite3.Connection, query: PageQuery) -> Page:
+    """
+    Filter, sort and paginate an aggregate table in SQL.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        Aggregates database.
+    query : PageQuery
+        Table, equality filters on key columns, date range, sort column
+        and 1-based page number.
+
+    Raises
+    ------
+    ValueError
+        Unknown table, filter or sort column.
+    """
+    spec = TABLES.get(query.table)
+    if spec is None:
+        raise ValueError(f"unknown table '{query.table}'")
+    if query.sort not in spec.columns:
+        raise ValueError(f"unknown sort column '{query.sort}'")
+
+    conditions, params = [], []
+    for column, value in (query.filters or {}).items():
+        if column not in spec.keys:
+            raise ValueError(f"unknown filter column '{column}'")
+        conditions.append(f"{column} = ?")
+        params.append(value)
+    if query.date_from:
+        conditions.append("day >= ?")
+        params.append(query.date_from)
+    if query.date_to:
+        conditions.append("day <= ?")
+        params.append(query.date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    total = connection.execute(f"SELECT COUNT(*) FROM {query.table} {where}",
+                               params).fetchone()[0]
+    direction = 'DESC' if query.descending else 'ASC'
+    # Key columns make the order stable between pages.
+    order = ', '.join([f"{query.sort} {direction}"]
+                      + [key for key in spec.keys if key != query.sort])
+    rows = connection.execute(
+        f"SELECT {', '.join(spec.columns)} FROM {query.table} {where} "
+        f"ORDER BY {order} LIMIT ? OFFSET ?",
+        params + [query.per_page,
+                  (max(query.page, 1) - 1) * query.per_page]).fetchall()
+    return Page(spec.columns, rows, total, query)
+
+
+_aggregates: Dict[str, AggregateStore] = {}
+_aggregate_refs: Dict[str, int] = {}
+_aggregates_lock = threading.Lock()
+
+
+def acquire_aggregates(path: str, batch_size: int = 500) -> AggregateStore:
+    """
+    Aggregate store shared by pipelines of the process.
+    Every call must be paired with `release_aggregates`.
+    """
+    key = os.path.abspath(path)
+    with _aggregates_lock:
+        if key not in _aggregates:
+            _aggregates[key] = AggregateStore(path, batch_size)
+            _aggregate_refs[key] = 0
+            logger.info("Aggregates '%s' opened", path)
+        _aggregate_refs[key] += 1
+        return _aggregates[key]
+
+
+def release_aggregates(path: str):
+    """Release shared aggregate store, the last release closes it."""
+    key = os.path.abspath(path)
+    with _aggregates_lock:
+        if key not in _aggregates:
+            return
+        _aggregate_refs[key] -= 1
+        if _aggregate_refs[key] <= 0:
+            _aggregates.pop(key).close()
+            _aggregate_refs.pop(key)
+            logger.info("Aggregates '%s' closed", path)
@@ -0,0 +1,587 @@
+"""
+On-disk inverted index of article titles and texts.
+
+The index is a directory of immutable segments listed in
+`segments.json`. A segment keeps a sorted term dictionary with postings
+offsets, postings (document and term frequency) and document arrays
+(key, domain, date, length) as `.npy` files, readers memory-map them.
+New articles are buffered by the writer and flushed as new segments,
+segments are merged by a streaming k-way merge of term dictionaries.
+Keys of indexed documents are kept in a SQLite file of the directory,
+documents with a known key are not indexed again.
+
+Queries are ranked with BM25 over all segments and may be restricted
+by domain and article date.
+"""
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import urllib.parse
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, Set, Tuple)
+
+import numpy as np
+
+from wbm_newspapers.sqlite import connect
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'segments.json'
+
+KEYS_FILE = 'keys.db'
+
+TOKEN_PATTERN = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)*|\d+")
+
+EPOCH = date(1970, 1, 1)
+
+# Date of documents without a date.
+NO_DATE = -1
+
+# Longer terms are not indexed, terms and keys are stored as fixed
+# width UTF-8 byte strings.
+MAX_TERM_LENGTH = 64
+
+_ARRAYS = ('terms', 'offsets', 'postings_docs', 'postings_tf',
+           'doc_keys', 'doc_domains', 'doc_dates', 'doc_lengths')
+
+
+def simple_analyzer(text: str) -> List[str]:
+    """Lowercase words and numbers."""
+    return TOKEN_PATTERN.findall(text.lower().replace('ё', 'е'))
+
+
+def to_day(value: Any) -> int:
+    """Days since epoch of a date, ISO string or capture timestamp."""
+    if value is None or value == '':
+        return NO_DATE
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return (value - EPOCH).days
+    text = str(value)
+    try:
+        if text.isdigit() and len(text) >= 8:
+            return (datetime.strptime(text[:8], '%Y%m%d').date() - EPOCH).days
+        return (datetime.fromisoformat(text[:10]).date() - EPOCH).days
+    except ValueError:
+        return NO_DATE
+
+
+def url_domain(url: str) -> str:
+    """Host of the URL without 'www.'."""
+    host = urllib.parse.urlparse(url if '//' in url else '//' + url).hostname
+    host = host or ''
+    return host[4:] if host.startswith('www.') else host
+
+
+class Document(NamedTuple):
+    """Indexed article."""
+
+    key: str
+    domain: str
+    day: int
+    text: str
+
+
+class Hit(NamedTuple):
+    """Ranked article."""
+
+    key: str
+    domain: str
+    date: Optional[date]
+    score: float
+
+
+class Segment:
+    """Memory-mapped segment."""
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            Segment directory.
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r',
+                  encoding='utf-8') as fobj:
+            self.meta = json.load(fobj)
+        self.arrays = {name: np.load(os.path.join(path, f'{name}.npy'),
+                                     mmap_mode='r')
+                       for name in _ARRAYS}
+
+    @property
+    def n_docs(self) -> int:
+        """Number of documents."""
+        return int(self.meta['n_docs'])
+
+    @property
+    def domains(self) -> List[str]:
+        """Domain names by code."""
+        return self.meta['domains']
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Documents and term frequencies of the term."""
+        terms = self.arrays['terms']
+        term_bytes = term.encode('utf-8')
+        index = int(np.searchsorted(terms, term_bytes))
+        if index >= len(terms) or terms[index] != term_bytes:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, empty
+        start, end = self.arrays['offsets'][index:index + 2]
+        return (self.arrays['postings_docs'][start:end],
+                self.arrays['postings_tf'][start:end])
+
+
+def write_segment(path: str,
+                  postings: Iterator[Tuple[bytes, np.ndarray, np.ndarray]],
+                  n_postings: int,
+                  docs: Dict[str, Any]):
+    """
+    Write a segment from postings in term order.
+
+    Parameters
+    ----------
+    path : str
+        Segment directory.
+    postings : Iterator[Tuple[bytes, np.ndarray, np.ndarray]]
+        UTF-8 term, documents and term frequencies, sorted by term.
+    n_postings : int
+        Total number of postings.
+    docs : Dict[str, Any]
+        Arrays 'doc_keys', 'doc_domains', 'doc_dates', 'doc_lengths'
+        and 'domains' list.
+    """
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    postings_docs = np.lib.format.open_memmap(
+        os.path.join(tmp_path, 'postings_docs.npy'), mode='w+',
+        dtype=np.int32, shape=(n_postings,))
+    postings_tf = np.lib.format.open_memmap(
+        os.path.join(tmp_path, 'postings_tf.npy'), mode='w+',
+        dtype=np.int32, shape=(n_postings,))
+    terms, offsets = [], [0]
+    for term, term_docs, term_tf in postings:
+        start = offsets[-1]
+        postings_docs[start:start + len(term_docs)] = term_docs
+        postings_tf[start:start + len(term_docs)] = term_tf
+        terms.append(term)
+        offsets.append(start + len(term_docs))
+    postings_docs.flush()
+    postings_tf.flush()
+    del postings_docs, postings_tf
+
+    np.save(os.path.join(tmp_path, 'terms.npy'), np.array(terms, dtype=bytes))
+    np.save(os.path.join(tmp_path, 'offsets.npy'),
+            np.array(offsets, dtype=np.int64))
+    for name in ['doc_keys', 'doc_domains', 'doc_dates', 'doc_lengths']:
+        np.save(os.path.join(tmp_path, f'{name}.npy'), docs[name])
+    with open(os.path.join(tmp_path, 'meta.json'), 'w',
+              encoding='utf-8') as fobj:
+        json.dump({'n_docs': len(docs['doc_keys']),
+                   'total_length': int(np.sum(docs['doc_lengths'])),
+                   'domains': docs['domains']}, fobj)
+    os.replace(tmp_path, path)
+
+
+def _term_heads(number: int,
+                segment: Segment) -> Iterator[Tuple[bytes, int, int]]:
+    for index, term in enumerate(segment.arrays['terms']):
+        yield bytes(term), number, index
+
+
+class InvertedIndex:  # pylint: disable=too-many-instance-attributes
+    """Segmented index directory, reader and writer of one process."""
+
+    def __init__(self,
+                 directory: str,
+                 analyzer: Callable[[str], List[str]] = simple_analyzer,
+                 segment_size: int = 10000):
+        """
+        Parameters
+        ----------
+        directory : str
+            Index directory.
+        analyzer : Callable[[str], List[str]], optional
+            Text to terms, the same for indexing and queries,
+            by default `simple_analyzer`.
+        segment_size : int, optional
+            Buffered documents flushed as a segment, by default 10000.
+        """
+        self.directory = directory
+        self.analyzer = analyzer
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._buffer: List[Tuple[Document, Counter]] = []
+        self._buffer_keys: Set[str] = set()
+        self._manifest = self._read_manifest()
+        self._segments = {name: Segment(os.path.join(directory, name))
+                          for name in self._manifest['segments']}
+        self._keys = connect(os.path.join(directory, KEYS_FILE))
+        self._keys.execute("CREATE TABLE IF NOT EXISTS keys "
+                           "(key TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._keys.execute("CREATE TABLE IF NOT EXISTS segments "
+                           "(name TEXT PRIMARY KEY) WITHOUT ROWID")
+        # Segments written before their keys, like by an interrupted
+        # process or before keys were kept.
+        self._record_keys(self._manifest['segments'], [])
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return {'segments': [], 'next': 0}
+        with open(path, 'r', encoding='utf-8') as fobj:
+            return json.load(fobj)
+
+    def _write_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + '.tmp', 'w', encoding='utf-8') as fobj:
+            json.dump(self._manifest, fobj)
+        os.replace(path + '.tmp', path)
+
+    def _new_segment_name(self) -> str:
+        name = f"seg-{self._manifest['next']:06d}"
+        self._manifest['next'] += 1
+        return name
+
+    @property
+    def segments(self) -> List[Segment]:
+        """Segments in the order of writing."""
+        return [self._segments[name] for name in self._manifest['segments']]
+
+    def add(self, document: Document) -> bool:
+        """
+        Buffer document, a full buffer is flushed.
+
+        Returns
+        -------
+        bool
+            False if a document with the key was indexed before.
+        """
+        if self.is_indexed(document.key):
+            return False
+        terms = Counter(term for term in self.analyzer(document.text)
+                        if len(term) <= MAX_TERM_LENGTH)
+        with self._lock:
+            if self.is_indexed(document.key):
+                return False
+            self._buffer.append((document._replace(text=''), terms))
+            self._buffer_keys.add(document.key)
+            if len(self._buffer) >= self.segment_size:
+                self.flush()
+        return True
+
+    def is_indexed(self, key: str) -> bool:
+        """Document with the key is indexed or buffered."""
+        with self._lock:
+            if key in self._buffer_keys:
+                return True
+            row = self._keys.execute("SELECT 1 FROM keys WHERE key = ?",
+                                     (key,)).fetchone()
+        return row is not None
+
+    def _record_keys(self, names: List[str], removed: List[str]):
+        """Add keys of segments not recorded yet, forget removed ones."""
+        recorded = {row[0] for row in self._keys.execute(
+            "SELECT name FROM segments")}
+        self._keys.execute("BEGIN IMMEDIATE")
+        for name in names:
+            if name in recorded:
+                continue
+            self._keys.executemany(
+                "INSERT OR IGNORE INTO keys (key) VALUES (?)",
+                [(bytes(key).decode('utf-8'),)
+                 for key in self._segments[name].arrays['doc_keys']])
+            self._keys.execute("INSERT INTO segments (name) VALUES (?)",
+                               (name,))
+        self._keys.executemany("DELETE FROM segments WHERE name = ?",
+                               [(name,) for name in removed])
+        self._keys.execute("COMMIT")
+
+    def flush(self):
+        """Write buffered documents as a new segment."""
+        with self._lock:
+            if not self._buffer:
+                return
+            buffer, self._buffer = self._buffer, []
+            domains = sorted({document.domain for document, _ in buffer})
+            codes = {domain: code for code, domain in enumerate(domains)}
+            term_postings: Dict[bytes, List[Tuple[int, int]]] = \
+                defaultdict(list)
+            for doc, (_, terms) in enumerate(buffer):
+                for term, count in terms.items():
+                    term_postings[term.encode('utf-8')].append((doc, count))
+
+            def postings():
+                for term in sorted(term_postings):
+                    pairs = np.array(term_postings[term], dtype=np.int32)
+                    yield term, pairs[:, 0], pairs[:, 1]
+
+            name = self._new_segment_name()
+            write_segment(
+                os.path.join(self.directory, name),
+                postings(),
+                sum(len(pairs) for pairs in term_postings.values()),
+                {'doc_keys': np.array([doc.key.encode('utf-8')
+                                       for doc, _ in buffer], dtype=bytes),
+                 'doc_domains': np.array([codes[doc.domain]
+                                          for doc, _ in buffer],
+                                         dtype=np.int16),
+                 'doc_dates': np.array([doc.day for doc, _ in buffer],
+                                       dtype=np.int32),
+                 'doc_lengths': np.array([sum(terms.values())
+                                          for _, terms in buffer],
+                                         dtype=np.int32),
+                 'domains': domains})
+            self._add_segments([name], [])
+            self._record_keys([name], [])
+            self._buffer_keys = set()
+            logger.info("Index segment '%s' with %d documents written",
+                        name, len(buffer))
+
+    def _add_segments(self, names: List[str], removed: List[str]):
+        for name in names:
+            self._segments[name] = Segment(os.path.join(self.directory,
+                                                        name))
+        self._manifest['segments'] = [
+            name for name in self._manifest['segments']
+            if name not in removed] + names
+        self._write_manifest()
+        for name in removed:
+            self._segments.pop(name, None)
+            shutil.rmtree(os.path.join(self.directory, name),
+                          ignore_errors=True)
+
+    def merge(self, max_segments: int = 1):
+        """Merge segments into one if there are more than `max_segments`."""
+        with self._lock:
+            segments = self.segments
+            if len(segments) <= max(max_segments, 1):
+                return
+            domains = sorted({domain for segment in segments
+                              for domain in segment.domains})
+            codes = {domain: code for code, domain in enumerate(domains)}
+            bases = np.cumsum([0] + [segment.n_docs
+                                     for segment in segments[:-1]])
+
+            def postings():
+                heads = heapq.merge(*[_term_heads(number, segment)
+                                      for number, segment
+                                      in enumerate(segments)])
+                current, parts = None, []
+                for term, number, index in heads:
+                    if term != current and parts:
+                        yield (current,) + self._concat(parts)
+                        parts = []
+                    current = term
+                    segment = segments[number]
+                    start, end = segment.arrays['offsets'][index:index + 2]
+                    parts.append(
+                        (segment.arrays['postings_docs'][start:end]
+                         + bases[number],
+                         segment.arrays['postings_tf'][start:end]))
+                if parts:
+                    yield (current,) + self._concat(parts)
+
+            docs = {
+                'doc_keys': np.concatenate(
+                    [segment.arrays['doc_keys'] for segment in segments]),
+                'doc_domains': np.concatenate([
+                    np.array([codes[domain] for domain in segment.domains],
+                             dtype=np.int16)[segment.arrays['doc_domains']]
+                    for segment in segments]),
+                'doc_dates': np.concatenate(
+                    [segment.arrays['doc_dates'] for segment in segments]),
+                'doc_lengths': np.concatenate(
+                    [segment.arrays['doc_lengths'] for segment in segments]),
+                'domains': domains}
+            name = self._new_segment_name()
+            write_segment(os.path.join(self.directory, name),
+                          postings(),
+                          sum(len(segment.arrays['postings_docs'])
+                              for segment in segments),
+                          docs)
+            removed = [segment.path.rsplit(os.sep, 1)[-1]
+                       for segment in segments]
+            self._add_segments([name], removed)
+            self._record_keys([name], removed)
+            logger.info("%d index segments merged into '%s'",
+                        len(segments), name)
+
+    @staticmethod
+    def _concat(parts: List[Tuple[np.ndarray, np.ndarray]]) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        return (np.concatenate([docs for docs, _ in parts]),
+                np.concatenate([tf for _, tf in parts]))
+
+    def search(self,  # pylint: disable=too-many-arguments,too-many-locals
+               query: str,
+               *,
+               domains: Optional[Iterable[str]] = None,
+               date_from: Optional[date] = None,
+               date_to: Optional[date] = None,
+               limit: int = 10,
+               k1: float = 1.2,
+               b: float = 0.75) -> List[Hit]:
+        """
+        Articles ranked by BM25.
+
+        Parameters
+        ----------
+        query : str
+            Query text, analyzed like documents.
+        domains : Optional[Iterable[str]], optional
+            Domains of articles, by default all.
+        date_from : Optional[date], optional
+            First article date, by default None.
+        date_to : Optional[date], optional
+            Last article date, by default None.
+        limit : int, optional
+            Number of hits, by default 10.
+        k1 : float, optional
+            BM25 term frequency saturation, by default 1.2.
+        b : float, optional
+            BM25 length normalization, by default 0.75.
+        """
+        terms = sorted(set(self.analyzer(query)))
+        segments = self.segments
+        n_docs = sum(segment.n_docs for segment in segments)
+        if not terms or n_docs == 0:
+            return []
+        avg_length = sum(segment.meta['total_length']
+                         for segment in segments) / n_docs
+        postings = [{term: segment.postings(term) for term in terms}
+                    for segment in segments]
+        idf = {}
+        for term in terms:
+            df = sum(len(segment_postings[term][0])
+                     for segment_postings in postings)
+            idf[term] = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+        hits: List[Hit] = []
+        for segment, segment_postings in zip(segments, postings):
+            scores = np.zeros(segment.n_docs, dtype=np.float64)
+            lengths = segment.arrays['doc_lengths']
+            for term, (docs, tf) in segment_postings.items():
+                if len(docs) == 0:
+                    continue
+                tf = tf.astype(np.float64)
+                norm = k1 * (1 - b + b * lengths[docs] / avg_length)
+                scores[docs] += idf[term] * tf * (k1 + 1) / (tf + norm)
+            candidates = np.flatnonzero(scores)
+            candidates = candidates[self._select(segment, candidates,
+                                                 domains, date_from, date_to)]
+            if len(candidates) > limit:
+                top = np.argpartition(-scores[candidates], limit)[:limit]
+                candidates = candidates[top]
+            hits.extend(self._hit(segment, doc, scores[doc])
+                        for doc in candidates)
+
+        hits.sort(key=lambda hit: -hit.score)
+        return hits[:limit]
+
+    def count_by_domain(self,
+                        query: str,
+                        date_from: Optional[date] = None,
+                        date_to: Optional[date] = None) -> Dict[str, int]:
+        """Number of articles with all query terms by domain."""
+        terms = sorted(set(self.analyzer(query)))
+        counts: Counter = Counter()
+        if not terms:
+            return {}
+        for segment in self.segments:
+            docs = None
+            for term in terms:
+                term_docs = np.asarray(segment.postings(term)[0])
+                docs = term_docs if docs is None else np.intersect1d(
+                    docs, term_docs, assume_unique=True)
+            docs = docs[self._select(segment, docs, None, date_from, date_to)]
+            codes = np.asarray(segment.arrays['doc_domains'])[docs]
+            for code, count in zip(*np.unique(codes, return_counts=True)):
+                counts[segment.domains[code]] += int(count)
+        return dict(counts)
+
+    @staticmethod
+    def _select(segment: Segment,
+                docs: np.ndarray,
+                domains: Optional[Iterable[str]],
+                date_from: Optional[date],
+                date_to: Optional[date]) -> np.ndarray:
+        where = np.ones(len(docs), dtype=bool)
+        if domains is not None:
+            codes = [code for code, domain in enumerate(segment.domains)
+                     if domain in set(domains)]
+            where &= np.isin(segment.arrays['doc_domains'][docs], codes)
+        dates = segment.arrays['doc_dates'][docs]
+        if date_from is not None:
+            where &= dates >= to_day(date_from)
+        if date_to is not None:
+            where &= (dates <= to_day(date_to)) & (dates != NO_DATE)
+        return where
+
+    @staticmethod
+    def _hit(segment: Segment, doc: int, score: float) -> Hit:
+        day = int(segment.arrays['doc_dates'][doc])
+        return Hit(segment.arrays['doc_keys'][doc].decode('utf-8'),
+                   segment.domains[int(segment.arrays['doc_domains'][doc])],
+                   None if day == NO_DATE else date.fromordinal(
+                       EPOCH.toordinal() + day),
+                   float(score))
+
+    def close(self, max_segments: int = 10):
+        """Flush buffered documents and merge too many segments."""
+        self.flush()
+        self.merge(max_segments)
+        self._keys.close()
+
+
+def item_document(item: Dict[str, Any]) -> Document:
+    """Document of a stored article item."""
+    day = to_day(item.get('url_date'))
+    if day == NO_DATE:
+        day = to_day(item.get('timestamp'))
+    return Document(str(item.get('url')),
+                    url_domain(str(item.get('original') or '')),
+                    day,
+                    f"{item.get('title') or ''}\n{item.get('text') or ''}")
+
+
+_indexes: Dict[str, InvertedIndex] = {}
+_index_refs: Dict[str, int] = {}
+_indexes_lock = threading.Lock()
+
+
+def acquire_index(directory: str, segment_size: int = 10000) -> InvertedIndex:
+    """
+    Index shared by pipelines of the process, one writer per directory.
+    Every call must be paired with `release_index`.
+    """
+    key = os.path.abspath(directory)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = InvertedIndex(directory,
+                                          segment_size=segment_size)
+            _index_refs[key] = 0
+        _index_refs[key] += 1
+        return _indexes[key]
+
+
+def release_index(directory: str, max_segments: int = 10):
+    """Release shared index, the last release flushes and merges it."""
+    key = os.path.abspath(directory)
+    with _indexes_lock:
+        if key not in _indexes:
+            return
+        _index_refs[key] -= 1
+        if _index_refs[key] <= 0:
+            _indexes.pop(key).close(max_segments)
+            _index_refs.pop(key)
@@ -0,0 +1,158 @@
+"""
+Near-duplicate detection of article texts with SimHash.
+
+A text signature is the 64-bit SimHash of its word shingles, texts
+differing in a few words have signatures within a small Hamming
+distance. Signatures are split into `distance + 1` bands, two
+signatures within the distance share at least one band exactly, so the
+in-memory LSH index looks up candidates by band values and checks
+their distance. Keys and signatures are saved to a `.npz` file and
+loaded again by the next run.
+"""
+import hashlib
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from wbm_newspapers.analysis.index import simple_analyzer
+
+logger = logging.getLogger(__name__)
+
+BITS = 64
+
+
+def shingles(tokens: List[str], size: int = 3) -> List[str]:
+    """Word n-grams of tokens, the whole text if it is shorter."""
+    if len(tokens) <= size:
+        return [' '.join(tokens)]
+    return [' '.join(tokens[start:start + size])
+            for start in range(len(tokens) - size + 1)]
+
+
+def simhash(features: List[str]) -> int:
+    """64-bit SimHash of features."""
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(feature.encode('utf-8'),
+                                        digest_size=8).digest(), 'little')
+         for feature in features], dtype='<u8')
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8),
+                         axis=1, bitorder='little')
+    weights = 2 * bits.sum(axis=0, dtype=np.int64) - len(features)
+    packed = np.packbits(weights > 0, bitorder='little')
+    return int(packed.view('<u8')[0])
+
+
+def hamming(first: int, second: int) -> int:
+    """Number of different bits."""
+    return bin(first ^ second).count('1')
+
+
+class SimHashIndex:  # pylint: disable=too-many-instance-attributes
+    """LSH index of SimHash signatures persisted to a file."""
+
+    def __init__(self,
+                 path: str,
+                 distance: int = 3,
+                 min_tokens: int = 30,
+                 analyzer: Callable[[str], List[str]] = simple_analyzer):
+        """
+        Parameters
+        ----------
+        path : str
+            Index file, `.npz`.
+        distance : int, optional
+            Largest Hamming distance of near-duplicates, by default 3.
+        min_tokens : int, optional
+            Shorter texts are not checked, their signatures are not
+            reliable, by default 30.
+        analyzer : Callable[[str], List[str]], optional
+            Text to tokens, by default `simple_analyzer`.
+        """
+        self.path = path
+        self.distance = distance
+        self.min_tokens = min_tokens
+        self.analyzer = analyzer
+        self.keys: List[str] = []
+        self.signatures: List[int] = []
+        self._saved = 0
+        n_bands = distance + 1
+        bounds = [BITS * band // n_bands for band in range(n_bands + 1)]
+        self._bands = [(start, (1 << (end - start)) - 1)
+                       for start, end in zip(bounds, bounds[1:])]
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+        for key, signature in self._read():
+            self._add(key, signature)
+        self._saved = len(self.keys)
+        if self.keys:
+            logger.info("SimHash index '%s' with %d signatures loaded",
+                        path, len(self.keys))
+
+    def _read(self) -> List[Tuple[str, int]]:
+        if not os.path.exists(self.path):
+            return []
+        with np.load(self.path) as npz:
+            keys, signatures = npz['keys'], npz['signatures']
+        return [(str(key), int(signature))
+                for key, signature in zip(keys, signatures)]
+
+    def signature(self, text: str) -> Optional[int]:
+        """Signature of the text, None for short texts."""
+        tokens = self.analyzer(text or '')
+        if len(tokens) < self.min_tokens:
+            return None
+        return simhash(shingles(tokens))
+
+    def find(self, signature: int) -> Optional[str]:
+        """Key of the nearest indexed signature within the distance."""
+        best, best_distance = None, self.distance + 1
+        for (start, mask), buckets in zip(self._bands, self._buckets):
+            for position in buckets.get((signature >> start) & mask, []):
+                distance = hamming(signature, self.signatures[position])
+                if distance < best_distance:
+                    best, best_distance = position, distance
+        return None if best is None else self.keys[best]
+
+    def _add(self, key: str, signature: int):
+        position = len(self.keys)
+        self.keys.append(key)
+        self.signatures.append(signature)
+        for (start, mask), buckets in zip(self._bands, self._buckets):
+            buckets.setdefault((signature >> start) & mask,
+                               []).append(position)
+
+    def check(self, key: str, text: str) -> Optional[str]:
+        """
+        Key of an indexed near-duplicate of the text, the text is
+        indexed if it has none.
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        duplicate = self.find(signature)
+        if duplicate is None:
+            self._add(key, signature)
+        return duplicate
+
+    def save(self):
+        """
+        Write signatures atomically, signatures saved meanwhile by
+        other processes are kept.
+        """
+        if len(self.keys) == self._saved:
+            return
+        entries = dict(self._read())
+        entries.update(zip(self.keys[self._saved:],
+                           self.signatures[self._saved:]))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path,
+                 keys=np.array(list(entries), dtype=str),
+                 signatures=np.array(list(entries.values()), dtype='<u8'))
+        os.replace(tmp_path, self.path)
+        self._saved = len(self.keys)
+        logger.info("SimHash index '%s' with %d signatures saved",
+                    self.path, len(entries))
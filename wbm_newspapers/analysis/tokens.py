@@ -0,0 +1,299 @@
+"""
+Token count vectors of article texts.
+
+Texts are tokenized, normalized and lemmatized with NLTK in a process
+pool. Counts are saved as sparse CSR shards (`counts-NNNNN.npz` with
+keys, indptr, indices and data arrays) with one append-only vocabulary
+(`vocab.json`), so analyses load precomputed features instead of
+tokenizing texts again.
+
+NLTK has no Russian lemmatizer, Cyrillic words are reduced with the
+Snowball stemmer, Latin words with the WordNet lemmatizer when its data
+is installed. nltk is imported in the worker processes.
+"""
+import glob
+import json
+import logging
+import os
+import re
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = r"[^\W\d_]+(?:-[^\W\d_]+)*"
+
+_LATIN = re.compile(r"[a-z]")
+
+
+class TokenNormalizer:  # pylint: disable=too-few-public-methods
+    """Tokenize, normalize and lemmatize text."""
+
+    def __init__(self,
+                 language: str = 'russian',
+                 min_length: int = 2,
+                 stopwords: bool = True):
+        """
+        Parameters
+        ----------
+        language : str, optional
+            Snowball stemmer and stopwords language, by default 'russian'.
+        min_length : int, optional
+            Shorter tokens are skipped, by default 2.
+        stopwords : bool, optional
+            Skip NLTK stopwords of the language and English,
+            by default True.
+        """
+        from nltk.stem import \
+            SnowballStemmer  # pylint: disable=import-outside-toplevel
+        from nltk.tokenize import \
+            RegexpTokenizer  # pylint: disable=import-outside-toplevel
+
+        self.min_length = min_length
+        self._tokenizer = RegexpTokenizer(WORD_PATTERN)
+        self._stemmer = SnowballStemmer(language)
+        self._lemmatizer = self._load_lemmatizer()
+        self._stopwords = set()
+        if stopwords:
+            self._stopwords = self._load_stopwords([language, 'english'])
+
+    @staticmethod
+    def _load_lemmatizer():
+        from nltk.stem import \
+            WordNetLemmatizer  # pylint: disable=import-outside-toplevel
+
+        lemmatizer = WordNetLemmatizer()
+        try:
+            lemmatizer.lemmatize('tests')
+        except LookupError:
+            logger.warning("WordNet data is not installed, "
+                           "Latin words are not lemmatized")
+            return None
+        return lemmatizer
+
+    @staticmethod
+    def _load_stopwords(languages: List[str]) -> set:
+        from nltk.corpus import \
+            stopwords  # pylint: disable=import-outside-toplevel
+
+        words = set()
+        for language in languages:
+            try:
+                words.update(stopwords.words(language))
+            except (LookupError, OSError):
+                logger.warning("NLTK stopwords of '%s' are not installed",
+                               language)
+        return words
+
+    def __call__(self, text: str) -> List[str]:
+        tokens = []
+        for token in self._tokenizer.tokenize(text.lower().replace('ё', 'е')):
+            if len(token) < self.min_length or token in self._stopwords:
+                continue
+            if _LATIN.match(token):
+                if self._lemmatizer is not None:
+                    token = self._lemmatizer.lemmatize(token)
+            else:
+                token = self._stemmer.stem(token)
+            tokens.append(token)
+        return tokens
+
+
+# Normalizer of the worker process.
+_WORKER: Dict[str, TokenNormalizer] = {}
+
+
+def _init_worker(language: str):
+    _WORKER['normalizer'] = TokenNormalizer(language)
+
+
+def count_batch(texts: List[str]) -> List[Dict[str, int]]:
+    """Token counts of texts, called in pool workers."""
+    normalizer = _WORKER['normalizer']
+    return [dict(Counter(normalizer(text or ''))) for text in texts]
+
+
+def token_pool(workers: Optional[int] = None,
+               language: str = 'russian') -> ProcessPoolExecutor:
+    """Process pool with normalizers."""
+    return ProcessPoolExecutor(max_workers=workers,
+                               initializer=_init_worker,
+                               initargs=(language,))
+
+
+def count_tokens(pool: Executor,
+                 articles: Iterable[Tuple[str, str]],
+                 batch_size: int = 500,
+                 in_flight: int = 8) \
+        -> Iterator[Tuple[List[str], List[Dict[str, int]]]]:
+    """
+    Token counts of articles by batches, in order.
+
+    Parameters
+    ----------
+    pool : Executor
+        Pool of `token_pool`.
+    articles : Iterable[Tuple[str, str]]
+        Pairs of article key and text.
+    batch_size : int, optional
+        Articles sent to a worker at once, by default 500.
+    in_flight : int, optional
+        Batches submitted and not yet returned, by default 8.
+    """
+    def batches():
+        keys, texts = [], []
+        for key, text in articles:
+            keys.append(key)
+            texts.append(text)
+            if len(keys) >= batch_size:
+                yield keys, texts
+                keys, texts = [], []
+        if keys:
+            yield keys, texts
+
+    pending = []
+    for keys, texts in batches():
+        pending.append((keys, pool.submit(count_batch, texts)))
+        if len(pending) >= in_flight:
+            keys, future = pending.pop(0)
+            yield keys, future.result()
+    for keys, future in pending:
+        yield keys, future.result()
+
+
+class TokenCounts(NamedTuple):
+    """Token count matrix in CSR arrays, rows are articles."""
+
+    keys: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+    vocabulary: List[str]
+
+    def row(self, index: int) -> Dict[str, int]:
+        """Token counts of the article."""
+        start, end = self.indptr[index], self.indptr[index + 1]
+        return {self.vocabulary[term]: int(count) for term, count
+                in zip(self.indices[start:end], self.data[start:end])}
+
+    def to_scipy(self):
+        """`scipy.sparse.csr_matrix`, requires scipy (`sparse` extra)."""
+        from scipy import sparse  # pylint: disable=import-outside-toplevel
+        return sparse.csr_matrix((self.data, self.indices, self.indptr),
+                                 shape=(len(self.keys), len(self.vocabulary)))
+
+
+def _read_shard(path: str) -> Dict[str, np.ndarray]:
+    with np.load(path) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+class TokenCountStore:
+    """Directory with count shards and the vocabulary."""
+
+    VOCABULARY = 'vocab.json'
+
+    def __init__(self, directory: str):
+        """
+        Parameters
+        ----------
+        directory : str
+            Store directory.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.vocabulary: List[str] = []
+        path = os.path.join(directory, self.VOCABULARY)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as fobj:
+                self.vocabulary = json.load(fobj)
+        self._ids = {term: index for index, term
+                     in enumerate(self.vocabulary)}
+
+    def shards(self) -> List[str]:
+        """Shard files in order."""
+        return sorted(glob.glob(os.path.join(self.directory,
+                                             "counts-*.npz")))
+
+    def keys(self) -> set:
+        """Keys of stored articles."""
+        keys: set = set()
+        for shard in self.shards():
+            keys.update(str(key) for key in _read_shard(shard)['keys'])
+        return keys
+
+    def append(self, keys: List[str], counts: List[Dict[str, int]]):
+        """Save counts of articles as a new shard."""
+        if not keys:
+            return
+        indptr = [0]
+        indices: List[int] = []
+        data: List[int] = []
+        for article in counts:
+            for term in sorted(article, key=self._term_id):
+                indices.append(self._ids[term])
+                data.append(article[term])
+            indptr.append(len(indices))
+
+        # Vocabulary first, shards refer to its terms.
+        path = os.path.join(self.directory, self.VOCABULARY)
+        with open(path + '.tmp', 'w', encoding='utf-8') as fobj:
+            json.dump(self.vocabulary, fobj, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+        shards = self.shards()
+        number = 0
+        if shards:
+            number = int(os.path.basename(shards[-1])[7:12]) + 1
+        np.savez_compressed(
+            os.path.join(self.directory, f"counts-{number:05d}.npz"),
+            keys=np.array(keys, dtype=str),
+            indptr=np.array(indptr, dtype=np.int64),
+            indices=np.array(indices, dtype=np.int32),
+            data=np.array(data, dtype=np.int32))
+        logger.debug("Shard %d with %d articles saved", number, len(keys))
+
+    def _term_id(self, term: str) -> int:
+        index = self._ids.get(term)
+        if index is None:
+            index = len(self.vocabulary)
+            self.vocabulary.append(term)
+            self._ids[term] = index
+        return index
+
+    def load(self) -> TokenCounts:
+        """All shards as one matrix."""
+        keys, indptr, indices, data = [], [np.zeros(1, np.int64)], [], []
+        offset = 0
+        for shard in self.shards():
+            arrays = _read_shard(shard)
+            keys.append(arrays['keys'])
+            indptr.append(arrays['indptr'][1:] + offset)
+            indices.append(arrays['indices'])
+            data.append(arrays['data'])
+            offset += int(arrays['indptr'][-1])
+        return TokenCounts(
+            np.concatenate(keys) if keys else np.array([], dtype=str),
+            np.concatenate(indptr),
+            np.concatenate(indices) if indices else np.array([], np.int32),
+            np.concatenate(data) if data else np.array([], np.int32),
+            list(self.vocabulary))
+
+
+def read_articles(directory: str,
+                  skip: Optional[set] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Pairs of URL and text from Parquet files of the directory,
+    like exported or compacted snapshots, one file at a time.
+    """
+    files = sorted(glob.glob(os.path.join(directory, '**', '*.parquet'),
+                             recursive=True))
+    for filename in files:
+        data = pd.read_parquet(filename, columns=['url', 'text'])
+        for url, text in zip(data['url'].astype(str), data['text']):
+            if skip is None or url not in skip:
+                yield url, '' if pd.isna(text) else str(text)
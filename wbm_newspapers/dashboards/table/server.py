@@ -0,0 +1,179 @@
+"""
+Table dashboard of materialized aggregates.
+
+A standard library HTTP server renders one page of an aggregate table
+per request, filtering, sorting and pagination are done in SQL, so a
+page costs the same whatever the number of stored articles. The same
+pages are served as JSON under `/api`.
+
+Query parameters: `table`, key column filters (`domain`, `section`,
+`term`), `from` and `to` dates, `sort`, `order` (asc or desc), `page`
+and `per_page`.
+"""
+import html
+import json
+import logging
+import sqlite3
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from wbm_newspapers.analysis.aggregates import (TABLES, Page, PageQuery,
+                                                read_page)
+
+logger = logging.getLogger(__name__)
+
+MAX_PER_PAGE = 500
+
+
+def parse_query(query_string: str) -> PageQuery:
+    """Page query of URL query parameters."""
+    params = {key: values[-1] for key, values
+              in urllib.parse.parse_qs(query_string).items()}
+    table = params.get('table', 'domain_day')
+    spec = TABLES.get(table, TABLES['domain_day'])
+    filters = {key: params[key] for key in spec.keys
+               if key != 'day' and params.get(key)}
+    return PageQuery(
+        table=table,
+        filters=filters,
+        date_from=params.get('from') or None,
+        date_to=params.get('to') or None,
+        sort=params.get('sort', 'day'),
+        descending=params.get('order', 'desc') != 'asc',
+        page=max(int(params.get('page', 1)), 1),
+        per_page=min(max(int(params.get('per_page', 50)), 1), MAX_PER_PAGE))
+
+
+def page_url(query: PageQuery, **changes) -> str:
+    """Relative URL of the query with changed fields."""
+    query = query._replace(**changes)
+    params = dict(query.filters or {})
+    params.update({'table': query.table,
+                   'sort': query.sort,
+                   'order': 'desc' if query.descending else 'asc',
+                   'page': query.page,
+                   'per_page': query.per_page})
+    if query.date_from:
+        params['from'] = query.date_from
+    if query.date_to:
+        params['to'] = query.date_to
+    return '?' + urllib.parse.urlencode(params)
+
+
+def render_page(page: Page) -> str:
+    """HTML document of the page."""
+    query = page.query
+    escape = html.escape
+    tables = ' | '.join(
+        f'<a href="{escape(page_url(PageQuery(table=name)))}">{name}</a>'
+        for name in TABLES)
+    fields = [f'<input type="hidden" name="table" value="{query.table}">']
+    for key in TABLES[query.table].keys:
+        name, value = key, (query.filters or {}).get(key, '')
+        if key == 'day':
+            fields.append(
+                '<input name="from" placeholder="from YYYY-MM-DD" '
+                f'value="{escape(query.date_from or "")}">'
+                '<input name="to" placeholder="to YYYY-MM-DD" '
+                f'value="{escape(query.date_to or "")}">')
+            continue
+        fields.append(f'<input name="{name}" placeholder="{name}" '
+                      f'value="{escape(value)}">')
+
+    header = []
+    for column in page.columns:
+        descending = not (column == query.sort and query.descending)
+        url = page_url(query, sort=column, descending=descending, page=1)
+        header.append(f'<th><a href="{escape(url)}">{column}</a></th>')
+    rows = [''.join(f'<td>{escape(str(value))}</td>' for value in row)
+            for row in page.rows]
+
+    links: List[str] = []
+    if query.page > 1:
+        url = page_url(query, page=query.page - 1)
+        links.append(f'<a href="{escape(url)}">&larr; previous</a>')
+    links.append(f'page {query.page} of {page.n_pages}, '
+                 f'{page.total} rows')
+    if query.page < page.n_pages:
+        url = page_url(query, page=query.page + 1)
+        links.append(f'<a href="{escape(url)}">next &rarr;</a>')
+
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<title>{query.table}</title></head><body>'
+        f'<p>{tables}</p>'
+        f'<form method="get">{"".join(fields)}'
+        '<button type="submit">filter</button></form>'
+        f'<table border="1" cellpadding="4"><tr>{"".join(header)}</tr>'
+        + ''.join(f'<tr>{row}</tr>' for row in rows)
+        + f'</table><p>{" ".join(links)}</p></body></html>')
+
+
+def page_json(page: Page) -> Dict:
+    """JSON object of the page."""
+    return {'table': page.query.table,
+            'columns': list(page.columns),
+            'rows': [list(row) for row in page.rows],
+            'total': page.total,
+            'page': page.query.page,
+            'pages': page.n_pages}
+
+
+class TableHandler(BaseHTTPRequestHandler):
+    """Request handler reading aggregates of the server `path`."""
+
+    server: 'TableServer'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve an HTML or JSON page."""
+        url = urllib.parse.urlsplit(self.path)
+        if url.path not in ('/', '/api'):
+            self.send_error(404)
+            return
+        try:
+            query = parse_query(url.query)
+            connection = sqlite3.connect(
+                f"file:{urllib.parse.quote(self.server.path)}?mode=ro",
+                uri=True)
+            try:
+                page = read_page(connection, query)
+            finally:
+                connection.close()
+        except (ValueError, sqlite3.Error) as error:
+            self.send_error(400, str(error))
+            return
+
+        if url.path == '/api':
+            body = json.dumps(page_json(page), ensure_ascii=False)
+            content_type = 'application/json'
+        else:
+            body = render_page(page)
+            content_type = 'text/html'
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class TableServer(ThreadingHTTPServer):
+    """HTTP server of an aggregates file."""
+
+    def __init__(self, path: str, host: str = '127.0.0.1', port: int = 8050):
+        """
+        Parameters
+        ----------
+        path : str
+            Aggregates database, opened read only by requests.
+        host : str, optional
+            Listening address, by default '127.0.0.1'.
+        port : int, optional
+            Listening port, by default 8050.
+        """
+        self.path = path
+        super().__init__((host, port), TableHandler)
@@ -1,7 +1,9 @@
 """Extract from meduza site."""
 import datetime
+import functools
 import re
-from typing import List, Optional
+from typing import List, Optional, Type
+
 from bs4 import BeautifulSoup
 
 from wbm_newspapers.extraction.extraction import BaseExtractor
@@ -11,26 +13,18 @@ from wbm_newspapers.extraction.utils import text_tags_class_pattern
 class MeduzaExtractor(BaseExtractor):
     """Meduza extractor."""
 
-    def __init__(self, soup: BeautifulSoup, url: str):
-        super().__init__(soup, url)
-
-        self.extractor: BaseExtractor
-
-        if self.is_feature(url):
-            self.extractor = MeduzaExtractorFeature(soup, url)
-        elif self.is_cards(url):
-            self.extractor = MeduzaExtractorCards(soup, url)
-        elif self.is_short(url):
-            self.extractor = MeduzaExtractorShort(soup, url)
-        elif self.is_news(url):
-            self.extractor = MeduzaExtractorNews(soup, url)
-        elif self.is_shapito(url):
-            self.extractor = MeduzaExtractorShapito(soup, url)
-        elif self.is_slides(url):
-            self.extractor = MeduzaExtractorSlides(soup, url)
-        else:
+    def __init__(self,
+                 soup: BeautifulSoup,
+                 url: str,
+                 url_date: Optional[datetime.datetime] = None):
+        super().__init__(soup, url, url_date)
+
+        extractor_class = get_section_extractor(url)
+        if extractor_class is None:
             raise ValueError(f"No extractor for '{url}'")
 
+        self.extractor: BaseExtractor = extractor_class(soup, url, url_date)
+
     @staticmethod
     def generate_pattern(name: str) -> re.Pattern:
         """Generates pattern for meduza section detection."""
@@ -108,6 +102,8 @@ class MeduzaExtractorSlides(BaseExtractor):
         return []
 
     def get_datetime(self) -> Optional[datetime.datetime]:
+        if self.url_date is not None:
+            return self.url_date
         return get_url_date_iso(self.url)
 
     def get_header_datetime(self) -> str:
@@ -134,6 +130,8 @@ class MeduzaExtractorShapito(BaseExtractor):
         return []
 
     def get_datetime(self) -> Optional[datetime.datetime]:
+        if self.url_date is not None:
+            return self.url_date
         return get_url_date_iso(self.url)
 
     def get_header_datetime(self) -> str:
@@ -158,6 +156,8 @@ class MeduzaExtractorNews(BaseExtractor):
         return []
 
     def get_datetime(self) -> Optional[datetime.datetime]:
+        if self.url_date is not None:
+            return self.url_date
         return get_url_date_iso(self.url)
 
     def get_header_datetime(self) -> str:
@@ -182,6 +182,8 @@ class MeduzaExtractorFeature(BaseExtractor):
         return []
 
     def get_datetime(self) -> Optional[datetime.datetime]:
+        if self.url_date is not None:
+            return self.url_date
         return get_url_date_iso(self.url)
 
     def get_header_datetime(self) -> str:
@@ -204,6 +206,8 @@ class MeduzaExtractorShort(BaseExtractor):
         return []
 
     def get_datetime(self) -> Optional[datetime.datetime]:
+        if self.url_date is not None:
+            return self.url_date
         return get_url_date_iso(self.url)
 
     def get_header_datetime(self) -> str:
@@ -226,6 +230,8 @@ class MeduzaExtractorCards(BaseExtractor):
         return []
 
     def get_datetime(self) -> Optional[datetime.datetime]:
+        if self.url_date is not None:
+            return self.url_date
         return get_url_date_iso(self.url)
 
     def get_header_datetime(self) -> str:
@@ -235,11 +241,40 @@ class MeduzaExtractorCards(BaseExtractor):
         return ""
 
 
+URL_DATE_FORMATS = [(r"/\d{4}/\d{2}/\d{2}/", r'/%Y/%m/%d/')]
+
+
 def get_url_date_iso(url: str) -> Optional[datetime.datetime]:
     """Try to get ISO date from URL."""
     result = None
-    match = re.search(r"/\d{4}/\d{2}/\d{2}/", url)
-    if match is not None:
-        data = match.group()
-        result = datetime.datetime.strptime(data, r'/%Y/%m/%d/')
+    for pat, date in URL_DATE_FORMATS:
+        match = re.search(pat, url)
+        if match is not None:
+            data = match.group()
+            result = datetime.datetime.strptime(data, date)
+            break
     return result
+
+
+SECTION_EXTRACTORS = [
+    ("feature", MeduzaExtractorFeature),
+    ("cards", MeduzaExtractorCards),
+    ("short", MeduzaExtractorShort),
+    ("news", MeduzaExtractorNews),
+    ("shapito", MeduzaExtractorShapito),
+    ("slides", MeduzaExtractorSlides),
+]
+
+_SECTION_PATTERNS = [
+    (MeduzaExtractor.generate_pattern(section), extractor)
+    for section, extractor in SECTION_EXTRACTORS
+]
+
+
+@functools.lru_cache(maxsize=100000)
+def get_section_extractor(url: str) -> Optional[Type[BaseExtractor]]:
+    """Extractor class for the meduza section of the URL."""
+    for pattern, extractor in _SECTION_PATTERNS:
+        if pattern.fullmatch(url) is not None:
+            return extractor
+    return None
@@ -53,6 +53,8 @@ class RbcExtractor(BaseExtractor):
         return []
 
     def get_datetime(self) -> Optional[datetime]:
+        if self.url_date is not None:
+            return self.url_date
         return get_url_date_iso(self.url)
 
     def get_header_datetime(self) -> str:
@@ -66,11 +68,14 @@ class RbcExtractor(BaseExtractor):
                                        "div")
 
 
+URL_DATE_FORMATS = [(r"/\d{4}/\d{2}/\d{2}/", r'/%Y/%m/%d/'),
+                    (r"/\d{2}/\d{2}/\d{4}/", r'/%d/%m/%Y/')]
+
+
 def get_url_date_iso(url: str) -> Optional[datetime]:
     """Try to get ISO date from URL."""
     result = None
-    for pat, date in [(r"/\d{4}/\d{2}/\d{2}/", r'/%Y/%m/%d/'),
-                      (r"/\d{2}/\d{2}/\d{4}/", r'/%d/%m/%Y/')]:
+    for pat, date in URL_DATE_FORMATS:
         match = re.search(pat, url)
         if match is not None:
             data = match.group()
@@ -15,16 +15,40 @@ from wbm_newspapers.extraction.utils import normalize_string
 class BaseExtractor(metaclass=abc.ABCMeta):
     """Basic snapshot extraction."""
 
-    def __init__(self, soup: BeautifulSoup, url: str):
+    # Increment when extracted fields change, cached results of other
+    # versions are not used.
+    version = 1
+
+    def __init__(self,
+                 soup: BeautifulSoup,
+                 url: str,
+                 url_date: Optional[datetime.datetime] = None):
+        """
+        Parameters
+        ----------
+        soup : BeautifulSoup
+            Snapshot.
+        url : str
+            Original URL.
+        url_date : Optional[datetime.datetime], optional
+            Article date already extracted from the URL, by default None
+            meaning the extractor parses URL itself.
+        """
         preprocess = self.preprocess_pipeline()
         self._soup = preprocess(soup)
         self._url = url
+        self._url_date = url_date
 
     @property
     def url(self) -> str:
         """Get url."""
         return self._url
 
+    @property
+    def url_date(self) -> Optional[datetime.datetime]:
+        """Precomputed article date from URL."""
+        return self._url_date
+
     @property
     def soup(self) -> BeautifulSoup:
         """Return beautiful soup object."""
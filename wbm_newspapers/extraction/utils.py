@@ -1,7 +1,7 @@
 """Utility functions."""
 import re
 import urllib
-from typing import List, Optional, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
 import pandas as pd
 from bs4 import BeautifulSoup
@@ -30,6 +30,33 @@ def path_stat(urls: pd.Series) -> pd.Series:
     return sections.value_counts()
 
 
+def extract_url_dates(urls: pd.Series,
+                      formats: Sequence[Tuple[str, str]]) -> pd.Series:
+    """
+    Vectorized article date extraction from URLs.
+
+    Parameters
+    ----------
+    urls : pd.Series
+        URLs.
+    formats : Sequence[Tuple[str, str]]
+        Pairs of regular expression and `strptime` format of the date
+        in URL. The first matching pair is used.
+
+    Returns
+    -------
+    pd.Series
+        datetime64 series, NaT where URL has no date.
+    """
+    urls = urls.astype(str)
+    dates = pd.Series(pd.NaT, index=urls.index, dtype='datetime64[ns]')
+    for pattern, date_format in formats:
+        matched = urls.str.extract(f"({pattern})", expand=False)
+        parsed = pd.to_datetime(matched, format=date_format, errors='coerce')
+        dates = dates.fillna(parsed)
+    return dates
+
+
 def text_tags_class_pattern(soup: BeautifulSoup,
                             class_pattern: str,
                             tag_name: Union[str, List[str]]) \
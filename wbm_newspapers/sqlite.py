@@ -0,0 +1,18 @@
+"""
+SQLite connections shared by the crawler and the analysis.
+
+Snapshot storage, the extraction cache and article aggregates keep
+their tables in SQLite files written and read by several threads.
+"""
+import sqlite3
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Connection in WAL mode with explicit transactions, shared by threads."""
+    connection = sqlite3.connect(path,
+                                 timeout=30,
+                                 isolation_level=None,
+                                 check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
@@ -0,0 +1,420 @@
+"""
+Asyncio fetch engine, an alternative to Scrapy for bulk backfills.
+
+The engine drives the same spider callbacks as Scrapy does: CDX pages
+are parsed by the spider in one thread, so its selection state and
+caches are never used concurrently, snapshots are extracted by copies
+of the spider in a process pool, items go through the storage
+pipelines. Copies of the spider send their stats increments back with
+every item and are closed when the pool shuts down. Worker processes
+are spawned, not forked, so they do not inherit the database clients,
+SQLite connections and threads of the engine process. Requests share
+one aiohttp connection pool with keep-alive, a concurrency limit and
+a token bucket.
+
+aiohttp is an optional dependency, it is imported when the engine runs.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import scrapy
+from scrapy.exceptions import DropItem, IgnoreRequest
+from scrapy.http import HtmlResponse, TextResponse
+from twisted.python.failure import Failure
+
+from wbm_newspapers.waybackmachine.items import \
+    WaybackMachineGeneralArticleItem
+from wbm_newspapers.waybackmachine.spiders.base import SpiderWaybackMachineBase
+from wbm_newspapers.waybackmachine.spiders.registry import load_spider
+from wbm_newspapers.waybackmachine.throttle import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class EngineOptions(NamedTuple):
+    """Engine limits."""
+
+    concurrency: int = 16
+    rate: float = 3.0
+    burst: float = 3.0
+    workers: Optional[int] = None
+    retries: int = 3
+    timeout: float = 180.0
+    clear: bool = False
+
+
+class EngineStats:
+    """Counters with the Scrapy stats collector interface."""
+
+    def __init__(self):
+        self._stats: Dict[str, Any] = {}
+
+    def get_value(self, key: str, default: Any = None) -> Any:
+        """Get value."""
+        return self._stats.get(key, default)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """All values."""
+        return self._stats
+
+    def set_value(self, key: str, value: Any):
+        """Set value."""
+        self._stats[key] = value
+
+    def inc_value(self, key: str, count: float = 1, start: float = 0):
+        """Increment value."""
+        self._stats[key] = self._stats.get(key, start) + count
+
+    def max_value(self, key: str, value: float):
+        """Keep the maximum value."""
+        self._stats[key] = max(self._stats.get(key, value), value)
+
+
+class _FetchedPage(NamedTuple):
+    url: str
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+    latency: float
+
+
+class _StatsDelta:
+    """Stats increments and maxima of a worker since the last item."""
+
+    def __init__(self):
+        self.counts: Dict[str, float] = {}
+        self.maxima: Dict[str, float] = {}
+
+    def inc_value(self, key: str, count: float = 1, start: float = 0):
+        """Increment value."""
+        self.counts[key] = self.counts.get(key, start) + count
+
+    def max_value(self, key: str, value: float):
+        """Keep the maximum value."""
+        self.maxima[key] = max(self.maxima.get(key, value), value)
+
+    def take(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """Increments and maxima, cleared."""
+        delta = self.counts, self.maxima
+        self.counts, self.maxima = {}, {}
+        return delta
+
+
+# Spider copy of the extraction worker process and its stats.
+_WORKER: Dict[str, Any] = {}
+
+
+def _init_worker(domain: str, settings_file: str):
+    spider_class = load_spider(domain)
+    worker_class = type(spider_class.__name__,
+                        (spider_class,),
+                        {'create_database': lambda self: None})
+    spider = worker_class(settings_file=settings_file)
+    _WORKER['stats'] = _StatsDelta()
+    spider.metrics.bind(_WORKER['stats'])
+    _WORKER['spider'] = spider
+    # Run by the worker process when the pool shuts down.
+    multiprocessing.util.Finalize(None, _close_worker, exitpriority=10)
+
+
+def _close_worker():
+    spider = _WORKER.pop('spider', None)
+    if spider is not None:
+        spider.closed('finished')
+
+
+def _extract(page: _FetchedPage,
+             cb_kwargs: Dict[str, Any]) \
+        -> Tuple[Optional[Dict[str, Any]],
+                 Tuple[Dict[str, float], Dict[str, float]]]:
+    request = scrapy.Request(page.url,
+                             meta={'download_latency': page.latency})
+    response = HtmlResponse(page.url,
+                            status=page.status,
+                            headers=page.headers,
+                            body=page.body,
+                            request=request)
+    item = _WORKER['spider'].parse(response, **cb_kwargs)
+    return (None if item is None else dict(item)), _WORKER['stats'].take()
+
+
+class _Executors(NamedTuple):
+    extract: concurrent.futures.Executor
+    storage: concurrent.futures.Executor
+    spider: concurrent.futures.Executor
+
+
+class AsyncEngine:  # pylint: disable=too-many-instance-attributes
+    """Crawl one domain with asyncio and aiohttp."""
+
+    def __init__(self,
+                 domain: str,
+                 settings_file: str,
+                 pipelines: Optional[List[Any]] = None,
+                 options: EngineOptions = EngineOptions()):
+        """
+        Parameters
+        ----------
+        domain : str
+            Registered domain name.
+        settings_file : str
+            Spider settings file.
+        pipelines : Optional[List[Any]], optional
+            Storage pipelines with Scrapy pipeline methods,
+            by default None meaning MongoDB and SQLite writers.
+        options : EngineOptions, optional
+            Engine limits.
+        """
+        self.domain = domain
+        self.settings_file = settings_file
+        self.options = options
+        self.stats = EngineStats()
+        self.spider: SpiderWaybackMachineBase = load_spider(domain)(
+            settings_file=settings_file, clear=str(options.clear))
+        self.spider.metrics.bind(self.stats)
+        if pipelines is None:
+            from wbm_newspapers.waybackmachine.pipelines import (  # pylint: disable=import-outside-toplevel
+                MongodbWriterPipeline, SqliteWriterPipeline)
+            pipelines = [MongodbWriterPipeline(), SqliteWriterPipeline()]
+        self.pipelines = pipelines
+        # Engines of one process may share the bucket.
+        self.bucket = TokenBucket(options.rate, options.burst)
+        self._seen: set = set()
+
+    def run(self) -> Dict[str, Any]:
+        """Crawl and return stats."""
+        return asyncio.run(self.crawl())
+
+    async def crawl(self) -> Dict[str, Any]:
+        """Crawl the domain."""
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for request in self.spider.start_requests():
+            self._schedule(queue, request)
+
+        for pipeline in self.pipelines:
+            if hasattr(pipeline, 'open_spider'):
+                pipeline.open_spider(self.spider)
+
+        self.stats.set_value('start_time', time.time())
+        connector = aiohttp.TCPConnector(limit=self.options.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.options.timeout)
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.options.workers or os.cpu_count(),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.domain, self.settings_file)) as pool, \
+                concurrent.futures.ThreadPoolExecutor(1) as storage, \
+                concurrent.futures.ThreadPoolExecutor(1) as spider:
+            async with aiohttp.ClientSession(connector=connector,
+                                             timeout=timeout) as session:
+                await self._run_workers(session, queue,
+                                        _Executors(pool, storage, spider))
+
+        self.stats.set_value('finish_time', time.time())
+        return self.stats.get_stats()
+
+    async def _run_workers(self,
+                           session: Any,
+                           queue: asyncio.Queue,
+                           executors: _Executors):
+        loop = asyncio.get_running_loop()
+        workers = [loop.create_task(self._work(session, queue, executors))
+                   for _ in range(self.options.concurrency)]
+        reason = 'finished'
+        try:
+            await queue.join()
+            # Rows held back for CDX pages which did not arrive.
+            requests = await loop.run_in_executor(
+                executors.spider, self.spider.flush_selection)
+            while requests:
+                for request in requests:
+                    self._schedule(queue, request)
+                await queue.join()
+                requests = await loop.run_in_executor(
+                    executors.spider, self.spider.flush_selection)
+        except asyncio.CancelledError:
+            reason = 'cancelled'
+            raise
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._close(reason)
+
+    def _close(self, reason: str):
+        for pipeline in self.pipelines:
+            if hasattr(pipeline, 'close_spider'):
+                pipeline.close_spider(self.spider)
+        self.spider.closed(reason)
+        logger.info("Engine for '%s' %s: %s",
+                    self.domain, reason, self.stats.get_stats())
+
+    def _schedule(self, queue: asyncio.Queue, request: scrapy.Request):
+        if request.url in self._seen:
+            self.stats.inc_value('dupefilter/filtered')
+            return
+        self._seen.add(request.url)
+        queue.put_nowait(request)
+        self.stats.max_value('scheduler/max_queued', queue.qsize())
+
+    async def _work(self,
+                    session: Any,
+                    queue: asyncio.Queue,
+                    executors: _Executors):
+        while True:
+            request = await queue.get()
+            try:
+                await self._process(session, queue, request, executors)
+            except Exception:  # pylint: disable=broad-except
+                self.stats.inc_value('engine/errors')
+                logger.exception("Request '%s' failed", request.url)
+            finally:
+                queue.task_done()
+
+    async def _process(self,
+                       session: Any,
+                       queue: asyncio.Queue,
+                       request: scrapy.Request,
+                       executors: _Executors):
+        page = await self._fetch(session, request.url,
+                                 request.meta.get('download_maxsize', 0))
+        is_snapshot = request.callback == self.spider.parse  # pylint: disable=comparison-with-callable
+        if page is None:
+            if not is_snapshot and request.errback is not None:
+                failure = Failure(IgnoreRequest(
+                    f"Fetching '{request.url}' failed"))
+                failure.request = request
+                await self._call_spider(
+                    queue, executors,
+                    lambda: list(request.errback(failure) or []))
+            return
+        loop = asyncio.get_running_loop()
+
+        if is_snapshot:
+            try:
+                data, delta = await loop.run_in_executor(
+                    executors.extract, _extract, page, request.cb_kwargs)
+            except ValueError as error:
+                self.stats.inc_value('snapshots/failed')
+                logger.debug("Extraction of '%s' failed: %s",
+                             page.url, error)
+                return
+            self._merge_stats(delta)
+            if data is None:
+                return
+            item = WaybackMachineGeneralArticleItem(**data)
+            await loop.run_in_executor(executors.storage, self._store, item)
+            return
+
+        # CDX pages are parsed by the spider itself, it keeps the state
+        # of filters, selection and pagination.
+        response = TextResponse(page.url,
+                                status=page.status,
+                                headers=page.headers,
+                                body=page.body,
+                                request=request.replace(
+                                    meta={**request.meta,
+                                          'download_latency': page.latency}))
+        await self._call_spider(
+            queue, executors,
+            lambda: list(request.callback(response, **request.cb_kwargs)))
+
+    async def _call_spider(self,
+                           queue: asyncio.Queue,
+                           executors: _Executors,
+                           callback: Any):
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(executors.spider, callback)
+        for result in results:
+            if isinstance(result, scrapy.Request):
+                self._schedule(queue, result)
+
+    def _merge_stats(self,
+                     delta: Tuple[Dict[str, float], Dict[str, float]]):
+        counts, maxima = delta
+        for key, value in counts.items():
+            self.stats.inc_value(key, value)
+        for key, value in maxima.items():
+            self.stats.max_value(key, value)
+
+    def _store(self, item: WaybackMachineGeneralArticleItem):
+        try:
+            for pipeline in self.pipelines:
+                item = pipeline.process_item(item, self.spider)
+        except DropItem as error:
+            self.stats.inc_value('item_dropped_count')
+            logger.debug("Item '%s' dropped: %s", item.get('url'), error)
+            return
+        self.stats.inc_value('item_scraped_count')
+
+    async def _throttle(self):
+        while not self.bucket.try_acquire():
+            await asyncio.sleep(self.bucket.delay())
+
+    @staticmethod
+    async def _read_body(response: Any, maxsize: int) -> Optional[bytes]:
+        # Like download_maxsize of Scrapy: None if the declared or the
+        # received size exceeds maxsize.
+        if not maxsize:
+            return await response.read()
+        if (response.content_length or 0) > maxsize:
+            return None
+        chunks, size = [], 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > maxsize:
+                return None
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    async def _fetch(self,
+                     session: Any,
+                     url: str,
+                     maxsize: int = 0) -> Optional[_FetchedPage]:
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        for attempt in range(self.options.retries + 1):
+            await self._throttle()
+            self.stats.inc_value('downloader/request_count')
+            start = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    body = await self._read_body(response, maxsize)
+                    status = response.status
+                    headers = {'Content-Type':
+                               response.headers.get('Content-Type', '')}
+                    final_url = str(response.url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                self.stats.inc_value('downloader/exception_count')
+                logger.debug("Fetching '%s' failed: %r", url, error)
+            else:
+                self.stats.inc_value('downloader/response_count')
+                self.stats.inc_value(
+                    f'downloader/response_status_count/{status}')
+                if body is None:
+                    self.spider.record_skip(url, 'download_size',
+                                            max_bytes=maxsize)
+                    return None
+                if status not in RETRY_STATUSES:
+                    if status >= 400:
+                        return None
+                    return _FetchedPage(final_url, status, headers, body,
+                                        time.perf_counter() - start)
+
+            if attempt < self.options.retries:
+                self.stats.inc_value('retry/count')
+                await asyncio.sleep(2 ** attempt)
+
+        self.stats.inc_value('retry/max_reached')
+        logger.warning("Gave up fetching '%s'", url)
+        return None
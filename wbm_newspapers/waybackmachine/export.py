@@ -0,0 +1,220 @@
+"""
+Export of spider collections to partitioned Parquet.
+
+Documents are read with batched cursors in `_id` order, each batch is
+written as one Parquet file per capture month under
+`<output>/domain=<domain>/month=<YYYY-MM>/`, so memory does not grow
+with the collection. The greatest exported `_id` is kept in a state
+file and the next export appends only documents inserted after it.
+
+ObjectIds are made by clients, so a document can be inserted later
+with a smaller `_id` than the exported ones. The next export reads the
+documents again from a time window before the greatest `_id` and skips
+the ones exported already, the state keeps the `_id` of documents of
+the window.
+"""
+import json
+import logging
+import os
+import shutil
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, \
+    Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = '_export_state.json'
+
+# Columns with many repeated values, written with dictionary encoding.
+DICTIONARY_COLUMNS = ('url', 'original', 'path')
+
+
+def read_state(output: str) -> Dict[str, Any]:
+    """Exported `_id` checkpoints by collection."""
+    path = os.path.join(output, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as fobj:
+        return json.load(fobj)
+
+
+def write_state(output: str, state: Dict[str, Any]):
+    """Replace the state file atomically."""
+    path = os.path.join(output, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as fobj:
+        json.dump(state, fobj, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def iter_batches(collection: Any,
+                 after: Any = None,
+                 batch_size: int = 10000,
+                 snapshot: bool = False) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Documents of the collection in `_id` order by batches.
+
+    Parameters
+    ----------
+    collection : Any
+        pymongo collection.
+    after : Any, optional
+        Documents with greater `_id` are read, by default None.
+    batch_size : int, optional
+        Documents of a batch and of a cursor round trip,
+        by default 10000.
+    snapshot : bool, optional
+        Read raw pages, by default False.
+    """
+    query = {} if after is None else {'_id': {'$gt': after}}
+    projection = None if snapshot else {'snapshot': False}
+    cursor = collection.find(query, projection,
+                             sort=[('_id', 1)],
+                             batch_size=batch_size)
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _to_string(value: Any) -> Optional[str]:
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    return str(value)
+
+
+def to_frame(documents: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Data frame of documents with string ids and dictionary URLs."""
+    data = pd.DataFrame(documents)
+    # Object columns are written as strings, so files of batches with
+    # only missing values have the same schema. Fields missing in some
+    # documents are NaN, they are written as nulls.
+    for column in data.columns:
+        if data[column].dtype == object:
+            data[column] = data[column].map(_to_string).astype('string')
+    for column in DICTIONARY_COLUMNS:
+        if column in data.columns:
+            data[column] = data[column].astype('category')
+    timestamps = pd.to_datetime(data.get('timestamp', pd.Series(dtype=str)),
+                                format='%Y%m%d%H%M%S',
+                                errors='coerce')
+    data['month'] = timestamps.dt.strftime('%Y-%m').fillna('unknown')
+    return data
+
+
+class ExportOptions(NamedTuple):
+    """Export options."""
+
+    batch_size: int = 10000
+    snapshot: bool = False
+    full: bool = False
+    # Seconds before the greatest exported `_id` read again.
+    overlap: float = 600.0
+
+
+def read_checkpoint(state: Dict[str, Any],
+                    name: str) -> Tuple[Optional[str], Set[str]]:
+    """
+    Greatest exported `_id` of the collection and exported `_id` of the
+    overlap window.
+
+    State files of earlier versions have only the last `_id`.
+    """
+    checkpoint = state.get(name)
+    if checkpoint is None or isinstance(checkpoint, str):
+        return checkpoint, set()
+    return checkpoint['last_id'], set(checkpoint['recent'])
+
+
+def make_checkpoint(last_id: Any,
+                    exported: Set[str],
+                    overlap: float) -> Dict[str, Any]:
+    """State of the collection keeping `_id` of the overlap window."""
+    from bson import ObjectId  # pylint: disable=import-outside-toplevel
+
+    since = last_id.generation_time - timedelta(seconds=overlap)
+    recent = [id_ for id_ in exported
+              if ObjectId(id_).generation_time >= since]
+    return {'last_id': str(last_id), 'recent': sorted(recent)}
+
+
+def write_batch(data: pd.DataFrame, output: str, domain: str):
+    """Write batch as one file per month named by the first `_id`."""
+    part = data['_id'].iloc[0]
+    for month, month_data in data.groupby('month', sort=False):
+        directory = os.path.join(output, f'domain={domain}', f'month={month}')
+        os.makedirs(directory, exist_ok=True)
+        month_data.drop(columns='month').to_parquet(
+            os.path.join(directory, f'part-{part}.parquet'), index=False)
+
+
+def export_collection(collection: Any,
+                      domain: str,
+                      output: str,
+                      options: ExportOptions = ExportOptions()) -> int:
+    """
+    Append documents inserted since the last export to Parquet files.
+
+    Parameters
+    ----------
+    collection : Any
+        pymongo collection of the spider.
+    domain : str
+        Domain partition name.
+    output : str
+        Dataset directory.
+    options : ExportOptions, optional
+        Batch size, raw pages export, full export replacing exported
+        files of the domain and the overlap window in seconds.
+
+    Returns
+    -------
+    int
+        Number of exported documents.
+    """
+    from bson import ObjectId  # pylint: disable=import-outside-toplevel
+
+    os.makedirs(output, exist_ok=True)
+    state = read_state(output)
+    last_id, exported = None, set()
+    if options.full:
+        shutil.rmtree(os.path.join(output, f'domain={domain}'),
+                      ignore_errors=True)
+    else:
+        last_id, exported = read_checkpoint(state, collection.name)
+    logger.info("Export of '%s' after %s", collection.name, last_id)
+
+    after = None
+    if last_id is not None:
+        last_id = ObjectId(last_id)
+        after = last_id
+        if exported:
+            after = ObjectId.from_datetime(
+                last_id.generation_time - timedelta(seconds=options.overlap))
+
+    n_documents = 0
+    for batch in iter_batches(collection, after, options.batch_size,
+                              options.snapshot):
+        batch = [document for document in batch
+                 if str(document['_id']) not in exported]
+        if not batch:
+            continue
+        data = to_frame(batch)
+        write_batch(data, output, domain)
+        n_documents += len(data)
+        exported.update(data['_id'].tolist())
+        if last_id is None or batch[-1]['_id'] > last_id:
+            last_id = batch[-1]['_id']
+        state[collection.name] = make_checkpoint(last_id, exported,
+                                                 options.overlap)
+        exported = set(state[collection.name]['recent'])
+        write_state(output, state)
+        logger.info("Exported %d documents of '%s'",
+                    n_documents, collection.name)
+
+    return n_documents
@@ -0,0 +1,422 @@
+"""
+Define here the extensions
+
+See documentation in:
+https://docs.scrapy.org/en/latest/topics/extensions.html
+"""
+import datetime
+import logging
+import os
+import threading
+import tracemalloc
+from typing import Dict, List, Optional
+
+import scrapy
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.statscollectors import StatsCollector
+from twisted.internet import task
+
+from wbm_newspapers.waybackmachine.logs import (RateLimitFilter,
+                                                start_queued_logging,
+                                                stop_queued_logging)
+from wbm_newspapers.waybackmachine.metrics import (Histogram, StageMetrics,
+                                                   rss_bytes)
+
+logger = logging.getLogger(__name__)
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _histogram_lines(name: str,
+                     labels: str,
+                     histogram: Histogram) -> List[str]:
+    lines = []
+    for bound, count in histogram.cumulative():
+        le_value = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append(f'{name}_bucket{{{labels},le="{le_value}"}} {count}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+class PrometheusTextfileExport:
+    """
+    Periodically write spider stats and stage metrics to a file
+    in Prometheus text format.
+
+    The file can be served by the node exporter textfile collector or
+    any static HTTP server. Enabled by PROMETHEUS_TEXTFILE setting with
+    the output path, PROMETHEUS_TEXTFILE_INTERVAL sets the period
+    in seconds. Every spider writes its own file with the spider name
+    appended to the file name, `metrics.prom` becomes
+    `metrics_spider_rbc.prom`, so crawlers of one process do not
+    overwrite each other.
+    """
+
+    def __init__(self,
+                 stats: StatsCollector,
+                 path: str,
+                 interval: float = 30.0):
+        """
+        Parameters
+        ----------
+        stats : StatsCollector
+            Crawler stats.
+        path : str
+            Output file name template.
+        interval : float, optional
+            Export period in seconds, by default 30.0.
+        """
+        self.stats = stats
+        self.path = path
+        self.interval = interval
+        self._tasks: Dict[str, task.LoopingCall] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) \
+            -> 'PrometheusTextfileExport':
+        """Instantiate from crawler."""
+        path = crawler.settings.get('PROMETHEUS_TEXTFILE')
+        if not path:
+            raise NotConfigured
+        interval = crawler.settings.getfloat('PROMETHEUS_TEXTFILE_INTERVAL',
+                                             30.0)
+        extension = cls(crawler.stats, os.path.expanduser(path), interval)
+        crawler.signals.connect(extension.spider_opened,
+                                signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed,
+                                signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider: scrapy.Spider):
+        """Start periodic export."""
+        loop = task.LoopingCall(self.export, spider)
+        loop.start(self.interval, now=False)
+        self._tasks[spider.name] = loop
+
+    def spider_closed(self, spider: scrapy.Spider):
+        """Stop periodic export and write final values."""
+        loop = self._tasks.pop(spider.name, None)
+        if loop is not None and loop.running:
+            loop.stop()
+        self.export(spider)
+
+    def spider_path(self, spider: scrapy.Spider) -> str:
+        """Metrics file of the spider."""
+        stem, suffix = os.path.splitext(self.path)
+        return f"{stem}_{spider.name}{suffix or '.prom'}"
+
+    def export(self, spider: scrapy.Spider):
+        """Write metrics file."""
+        text = "\n".join(self.render(spider)) + "\n"
+
+        path = self.spider_path(spider)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fobj:
+            fobj.write(text)
+        os.replace(tmp_path, path)
+        logger.debug("Metrics written to '%s'", path)
+
+    def render(self, spider: scrapy.Spider) -> List[str]:
+        """Metrics in Prometheus text format."""
+        spider_label = f'spider="{_label(spider.name)}"'
+        stats = self.stats.get_stats()
+        lines = ['# TYPE wbm_scrapy_stat gauge']
+
+        for key, value in sorted(stats.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f'wbm_scrapy_stat{{{spider_label},'
+                         f'key="{_label(key)}"}} {value}')
+
+        items_per_second = self._items_per_second(stats)
+        if items_per_second is not None:
+            lines.append('# TYPE wbm_items_per_second gauge')
+            lines.append(f'wbm_items_per_second{{{spider_label}}} '
+                         f'{items_per_second}')
+
+        metrics: Optional[StageMetrics] = getattr(spider, 'metrics', None)
+        if metrics is not None:
+            lines.append('# TYPE wbm_stage_seconds histogram')
+            for stage, histogram in sorted(metrics.stages.items()):
+                labels = f'{spider_label},stage="{_label(stage)}"'
+                lines.extend(_histogram_lines('wbm_stage_seconds',
+                                              labels,
+                                              histogram))
+            lines.append('# TYPE wbm_size_bytes histogram')
+            for name, histogram in sorted(metrics.sizes.items()):
+                labels = f'{spider_label},name="{_label(name)}"'
+                lines.extend(_histogram_lines('wbm_size_bytes',
+                                              labels,
+                                              histogram))
+        return lines
+
+    @staticmethod
+    def _items_per_second(stats: Dict) -> Optional[float]:
+        start_time = stats.get('start_time')
+        if start_time is None:
+            return None
+        now = datetime.datetime.now(tz=start_time.tzinfo)
+        elapsed = (now - start_time).total_seconds()
+        if elapsed <= 0:
+            return None
+        return stats.get('item_scraped_count', 0) / elapsed
+
+
+# Extensions of crawlers in one process share tracemalloc, tracing
+# started by a watchdog is stopped when the last watchdog closes.
+_tracing = {'refs': 0, 'owned': False}
+_tracing_lock = threading.Lock()
+
+
+def _acquire_tracemalloc():
+    with _tracing_lock:
+        if _tracing['refs'] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing['owned'] = True
+        _tracing['refs'] += 1
+
+
+def _release_tracemalloc():
+    with _tracing_lock:
+        _tracing['refs'] -= 1
+        if _tracing['refs'] <= 0:
+            _tracing['refs'] = 0
+            if _tracing['owned'] and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            _tracing['owned'] = False
+
+
+class MemoryWatchdog:  # pylint: disable=too-many-instance-attributes
+    """
+    Lower download concurrency when the process memory approaches
+    the limit.
+
+    Resident set size is sampled every MEMORY_WATCHDOG_INTERVAL seconds.
+    While it exceeds MEMORY_WATCHDOG_THROTTLE_RATIO of
+    MEMORY_WATCHDOG_LIMIT_MB the total and per slot download
+    concurrency is halved at every sample down to one request, and the
+    spider lowers the priority of CDX pagination. Crawling never stops,
+    so the crawl finishes even if the interpreter keeps freed memory.
+    Concurrency is doubled back at every sample below
+    MEMORY_WATCHDOG_RESUME_RATIO of the limit. With
+    MEMORY_WATCHDOG_TRACEMALLOC the top allocators are logged
+    on throttling.
+    """
+
+    def __init__(self, crawler: Crawler, limit: int):
+        """
+        Parameters
+        ----------
+        crawler : Crawler
+            Crawler.
+        limit : int
+            Memory limit in bytes.
+        """
+        settings = crawler.settings
+        self.crawler = crawler
+        self.limit = limit
+        self.interval = settings.getfloat('MEMORY_WATCHDOG_INTERVAL', 5.0)
+        self.watermarks = (
+            limit * settings.getfloat('MEMORY_WATCHDOG_THROTTLE_RATIO', 0.9),
+            limit * settings.getfloat('MEMORY_WATCHDOG_RESUME_RATIO', 0.75))
+        self.tracemalloc = settings.getbool('MEMORY_WATCHDOG_TRACEMALLOC')
+        # Concurrency is the original one shifted right by the level.
+        self.level = 0
+        self._concurrency: Dict[str, int] = {}
+        self._task: Optional[task.LoopingCall] = None
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> 'MemoryWatchdog':
+        """Instantiate from crawler."""
+        limit_mb = crawler.settings.getint('MEMORY_WATCHDOG_LIMIT_MB')
+        if limit_mb <= 0:
+            raise NotConfigured
+        extension = cls(crawler, limit_mb * 1024 * 1024)
+        crawler.signals.connect(extension.spider_opened,
+                                signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed,
+                                signal=signals.spider_closed)
+        return extension
+
+    @property
+    def throttled(self) -> bool:
+        """Concurrency is lowered."""
+        return self.level > 0
+
+    def spider_opened(self, spider: scrapy.Spider):
+        """Start memory sampling."""
+        if self.tracemalloc:
+            _acquire_tracemalloc()
+        metrics: Optional[StageMetrics] = getattr(spider, 'metrics', None)
+        if metrics is not None:
+            metrics.track_memory = True
+        self._task = task.LoopingCall(self.check, spider)
+        self._task.start(self.interval, now=True)
+
+    def spider_closed(self, spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """Stop memory sampling."""
+        if self._task is not None and self._task.running:
+            self._task.stop()
+        if self.tracemalloc:
+            _release_tracemalloc()
+
+    def check(self, spider: scrapy.Spider):
+        """Sample memory and lower or restore download concurrency."""
+        rss = rss_bytes()
+        throttle_at, resume_at = self.watermarks
+        stats = self.crawler.stats
+        stats.set_value('memory/rss', rss)
+        stats.max_value('memory/rss_peak', rss)
+
+        if rss >= throttle_at:
+            if not self.throttled:
+                stats.inc_value('memory/throttle_count')
+                logger.warning("Memory %.1f MB is close to the limit "
+                               "%.1f MB. Download concurrency is lowered.",
+                               rss / 2 ** 20, self.limit / 2 ** 20)
+                self._log_allocators()
+            if self._set_level(self.level + 1):
+                logger.warning("Memory %.1f MB, download concurrency %d.",
+                               rss / 2 ** 20, self._total_concurrency())
+        elif rss <= resume_at and self.throttled:
+            self._set_level(self.level - 1)
+            logger.info("Memory %.1f MB dropped, download concurrency %d.",
+                        rss / 2 ** 20, self._total_concurrency())
+        elif self.throttled:
+            # Slots created since the last sample.
+            self._set_level(self.level)
+
+        spider.memory_throttled = self.throttled
+        stats.set_value('memory/concurrency', self._total_concurrency())
+
+    def _set_level(self, level: int) -> bool:
+        """Apply concurrency level, False if it is already the lowest."""
+        downloader = self.crawler.engine.downloader
+        total = self._concurrency.setdefault('',
+                                             downloader.total_concurrency)
+        if level > self.level and total >> self.level <= 1 and all(
+                slot.concurrency <= 1
+                for slot in downloader.slots.values()):
+            return False
+        self.level = max(level, 0)
+        downloader.total_concurrency = max(total >> self.level, 1)
+        for key, slot in downloader.slots.items():
+            original = self._concurrency.setdefault(f'slot:{key}',
+                                                    slot.concurrency)
+            slot.concurrency = max(original >> self.level, 1)
+        return True
+
+    def _total_concurrency(self) -> int:
+        return self.crawler.engine.downloader.total_concurrency
+
+    def _log_allocators(self, top: int = 10):
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot()
+        lines = [str(stat)
+                 for stat in snapshot.statistics('lineno')[:top]]
+        logger.warning("Top memory allocators:\n%s", "\n".join(lines))
+
+
+class QueuedLogging:
+    """
+    Write log records from a background thread.
+
+    Enabled by LOG_QUEUE_ENABLED. Root logger handlers are moved behind
+    a queue while spiders run. LOG_RATE_LIMIT_BURST records of the same
+    message per LOG_RATE_LIMIT_PERIOD seconds are passed, 0 disables
+    rate limiting.
+    """
+
+    def __init__(self, rate_limit: Optional[RateLimitFilter]):
+        self.rate_limit = rate_limit
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> 'QueuedLogging':
+        """Instantiate from crawler."""
+        settings = crawler.settings
+        if not settings.getbool('LOG_QUEUE_ENABLED'):
+            raise NotConfigured
+        rate_limit = None
+        burst = settings.getint('LOG_RATE_LIMIT_BURST', 10)
+        if burst > 0:
+            rate_limit = RateLimitFilter(
+                settings.getfloat('LOG_RATE_LIMIT_PERIOD', 60.0), burst)
+        extension = cls(rate_limit)
+        crawler.signals.connect(extension.spider_opened,
+                                signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed,
+                                signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """Start queued logging."""
+        start_queued_logging(rate_limit=self.rate_limit)
+
+    def spider_closed(self, spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """Flush and stop queued logging."""
+        stop_queued_logging()
+
+
+class ProgressLog:
+    """
+    Log one aggregated progress line every LOG_PROGRESS_INTERVAL seconds
+    instead of per page messages.
+    """
+
+    KEYS = (('cdx/rows_selected', 'selected'),
+            ('snapshots/parse', 'parsed'),
+            ('snapshots/success', 'success'),
+            ('snapshots/failed', 'failed'),
+            ('item_scraped_count', 'items'))
+
+    def __init__(self, stats: StatsCollector, interval: float):
+        self.stats = stats
+        self.interval = interval
+        self._tasks: Dict[str, task.LoopingCall] = {}
+        self._previous: Dict[str, int] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> 'ProgressLog':
+        """Instantiate from crawler."""
+        interval = crawler.settings.getfloat('LOG_PROGRESS_INTERVAL')
+        if interval <= 0:
+            raise NotConfigured
+        extension = cls(crawler.stats, interval)
+        crawler.signals.connect(extension.spider_opened,
+                                signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed,
+                                signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider: scrapy.Spider):
+        """Start periodic progress lines."""
+        loop = task.LoopingCall(self.log, spider)
+        loop.start(self.interval, now=False)
+        self._tasks[spider.name] = loop
+
+    def spider_closed(self, spider: scrapy.Spider):
+        """Stop progress lines and log the final one."""
+        loop = self._tasks.pop(spider.name, None)
+        if loop is not None and loop.running:
+            loop.stop()
+        self.log(spider)
+
+    def log(self, spider: scrapy.Spider):
+        """Log progress of the spider."""
+        stats = self.stats.get_stats()
+        parts = []
+        for key, label in self.KEYS:
+            value = stats.get(key, 0)
+            rate = (value - self._previous.get(key, 0)) * 60 / self.interval
+            self._previous[key] = value
+            parts.append(f"{label} {value} ({rate:.0f}/min)")
+        logger.info("Progress of '%s': %s", spider.name, ", ".join(parts))
@@ -0,0 +1,107 @@
+"""
+Guards against pathological snapshot pages.
+
+Multi-megabyte pages (embedded data, galleries, broken markup) stall
+parsing. Captures with a larger CDX `length` are not requested, other
+downloads are aborted by Scrapy when `Content-Length` or the received
+size exceeds `download_maxsize` of the request, and parsing is cut off
+after a time budget. The size limits are the guard to rely on, the
+time budget only stops Python code between parser calls. Skipped pages
+are appended to a JSON lines file for offline processing.
+"""
+import contextlib
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+from twisted.internet import defer
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Newer Scrapy versions raise their own error on download_maxsize.
+    from scrapy.exceptions import DownloadCancelledError
+    CANCELLED_ERRORS: tuple = (defer.CancelledError, DownloadCancelledError)
+except ImportError:
+    CANCELLED_ERRORS = (defer.CancelledError,)
+
+
+class ParseTimeout(Exception):
+    """Parsing took longer than its budget."""
+
+
+def _raise_timeout(_signum: int, _frame: Any):
+    raise ParseTimeout()
+
+
+@contextlib.contextmanager
+def time_budget(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Raise `ParseTimeout` in the block after `seconds` of wall time.
+
+    The budget uses SIGALRM, it works in the main thread on POSIX
+    systems. In other threads, on other systems or if `seconds` is not
+    set the budget does nothing.
+
+    Python handles signals between bytecode instructions, so a call
+    into the lxml (and BeautifulSoup with lxml) C parser is not
+    interrupted, the timeout is raised only when the call returns. A
+    page which stalls the C parser is stopped by the size guards, the
+    CDX `length` and `download_maxsize` limits, not by the budget.
+    """
+    if (not seconds or not hasattr(signal, 'setitimer')
+            or threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def is_cancelled(failure: Any) -> bool:
+    """Download was aborted, like by `download_maxsize`."""
+    return failure.check(*CANCELLED_ERRORS) is not None
+
+
+class SkipLog:
+    """Skipped pages appended to a JSON lines file."""
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            File, created with the first record.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def record(self, url: str, reason: str, **details: Any):
+        """Append a skipped page with the reason and details."""
+        line = json.dumps({'url': url, 'reason': reason, 'time': time.time(),
+                           **details}, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'a',  # pylint: disable=consider-using-with
+                                  encoding='utf-8', buffering=1)
+            self._file.write(line + '\n')
+        logger.info("Snapshot '%s' skipped: %s %s", url, reason, details)
+
+    def close(self):
+        """Close the file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
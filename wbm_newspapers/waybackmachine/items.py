@@ -20,4 +20,6 @@ class WaybackMachineGeneralArticleItem(scrapy.Item):
     path = scrapy.Field()
     timestamp = scrapy.Field()
     original = scrapy.Field()
+    # URL of the stored near-duplicate article, if any.
+    duplicate_of = scrapy.Field()
     snapshot = scrapy.Field()
@@ -0,0 +1,139 @@
+"""
+Logging off the reactor thread.
+
+Handlers of a logger are moved behind a `QueueHandler`, records are
+written by a `QueueListener` thread, so file and console I/O does not
+block crawling. Repeated messages of the same kind, like per-URL
+warnings, are rate limited before they are queued.
+"""
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class RateLimitFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+    Pass at most `burst` records of the same message template
+    per `period` seconds.
+
+    The first record passed after suppression reports the number of
+    suppressed records. Errors and critical records are never
+    suppressed, only warnings and lower levels are limited.
+    """
+
+    def __init__(self, period: float = 60.0, burst: int = 10):
+        """
+        Parameters
+        ----------
+        period : float, optional
+            Window in seconds, by default 60.0.
+        burst : int, optional
+            Records of one template per window, by default 10.
+        """
+        super().__init__()
+        self.period = period
+        self.burst = burst
+        self._windows: Dict[Tuple[str, int, str], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = int(window[2]) if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                return True
+            else:
+                window[2] += 1
+                return False
+
+        if suppressed > 0:
+            record.msg = (f"{record.getMessage()} "
+                          f"({suppressed} similar messages suppressed)")
+            record.args = None
+        return True
+
+
+class _QueuedLogger:  # pylint: disable=too-few-public-methods
+    """Logger with handlers moved to a listener thread."""
+
+    def __init__(self,
+                 logger: logging.Logger,
+                 rate_limit: Optional[RateLimitFilter]):
+        self.handlers = list(logger.handlers)
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        self.queue_handler = logging.handlers.QueueHandler(records)
+        if rate_limit is not None:
+            self.queue_handler.addFilter(rate_limit)
+        self.listener = logging.handlers.QueueListener(
+            records, *self.handlers, respect_handler_level=True)
+        self.refs = 0
+
+    def start(self, logger: logging.Logger):
+        """Replace handlers with the queue and start writing thread."""
+        self.listener.start()
+        for handler in self.handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(self.queue_handler)
+
+    def stop(self, logger: logging.Logger):
+        """Flush the queue and restore handlers."""
+        logger.removeHandler(self.queue_handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            logger.addHandler(handler)
+
+
+_queued: Dict[str, _QueuedLogger] = {}
+_queued_lock = threading.Lock()
+
+
+def start_queued_logging(name: Optional[str] = None,
+                         rate_limit: Optional[RateLimitFilter] = None):
+    """
+    Route records of the logger through a queue.
+
+    Calls are counted, so crawlers of one process can share the root
+    logger. Every call must be paired with `stop_queued_logging`.
+
+    Parameters
+    ----------
+    name : Optional[str], optional
+        Logger name, by default None meaning the root logger.
+    rate_limit : Optional[RateLimitFilter], optional
+        Filter applied before records are queued, by default None.
+    """
+    logger = logging.getLogger(name)
+    key = logger.name
+    with _queued_lock:
+        if key not in _queued:
+            if not logger.handlers:
+                return
+            queued = _QueuedLogger(logger, rate_limit)
+            queued.start(logger)
+            _queued[key] = queued
+        _queued[key].refs += 1
+
+
+def stop_queued_logging(name: Optional[str] = None):
+    """Release the queue of the logger, the last call flushes it."""
+    logger = logging.getLogger(name)
+    key = logger.name
+    with _queued_lock:
+        queued = _queued.get(key)
+        if queued is None:
+            return
+        queued.refs -= 1
+        if queued.refs <= 0:
+            queued.stop(logger)
+            del _queued[key]
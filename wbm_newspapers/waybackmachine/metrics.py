@@ -0,0 +1,133 @@
+"""Per-stage latency and size metrics of the spiders."""
+import bisect
+import contextlib
+import os
+import resource
+import sys
+import time
+from typing import (Any, Callable, ContextManager, Dict, Iterator, Optional,
+                    Sequence, Tuple)
+
+from scrapy.statscollectors import StatsCollector
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+SIZE_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+
+
+def rss_bytes() -> int:
+    """
+    Resident set size of the process.
+
+    Current value on Linux, peak value on other platforms.
+    """
+    try:
+        with open('/proc/self/statm', 'r', encoding='utf-8') as fobj:
+            pages = int(fobj.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux and bytes on macOS.
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Histogram:
+    """Cumulative histogram in Prometheus style."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Parameters
+        ----------
+        buckets : Sequence[float], optional
+            Upper bounds of buckets, by default LATENCY_BUCKETS.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Add value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[float, int]]:
+        """Pairs of upper bound and cumulative count, last is +Inf."""
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class StageMetrics:
+    """
+    Timing histograms and counters of spider stages.
+
+    Values are kept in memory for the Prometheus export and mirrored
+    to the Scrapy stats as 'stage/<name>/count', 'stage/<name>/seconds'
+    and 'stage/<name>/max' once the stats are bound.
+
+    If memory tracking is on, peak resident memory after every stage
+    is reported as 'memory/peak/<name>'.
+    """
+
+    def __init__(self, stats: Optional[StatsCollector] = None):
+        self._stats = stats
+        self.stages: Dict[str, Histogram] = {}
+        self.sizes: Dict[str, Histogram] = {}
+        self.track_memory = False
+
+    def bind(self, stats: StatsCollector):
+        """Bind crawler stats."""
+        self._stats = stats
+
+    def observe(self, stage: str, seconds: float):
+        """Add stage duration."""
+        if stage not in self.stages:
+            self.stages[stage] = Histogram(LATENCY_BUCKETS)
+        self.stages[stage].observe(seconds)
+        if self._stats is not None:
+            self._stats.inc_value(f'stage/{stage}/count')
+            self._stats.inc_value(f'stage/{stage}/seconds', seconds, start=0.)
+            self._stats.max_value(f'stage/{stage}/max', seconds)
+
+    def observe_size(self, name: str, size: int):
+        """Add size in bytes."""
+        if name not in self.sizes:
+            self.sizes[name] = Histogram(SIZE_BUCKETS)
+        self.sizes[name].observe(size)
+        if self._stats is not None:
+            self._stats.inc_value(f'size/{name}/count')
+            self._stats.inc_value(f'size/{name}/bytes', size)
+            self._stats.max_value(f'size/{name}/max', size)
+
+    def inc(self, key: str, count: int = 1):
+        """Increment counter in the stats."""
+        if self._stats is not None:
+            self._stats.inc_value(key, count)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        """Measure duration of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+            if self.track_memory and self._stats is not None:
+                self._stats.max_value(f'memory/peak/{stage}', rss_bytes())
+
+    def timed(self, stage: str, func: Callable, *args, **kwargs) -> Any:
+        """Call function and measure its duration."""
+        with self.timer(stage):
+            return func(*args, **kwargs)
+
+
+def stage_timer(spider: Any, stage: str) -> ContextManager:
+    """Timer of the spider stage, does nothing if spider has no metrics."""
+    metrics: Optional[StageMetrics] = getattr(spider, 'metrics', None)
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.timer(stage)
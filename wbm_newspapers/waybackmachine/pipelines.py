@@ -8,14 +8,30 @@ useful for handling different item types with a single interface
 import logging
 import os
 import shutil
-from typing import Any
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
 
 import scrapy
 from itemadapter import ItemAdapter
-from wbm_snapshot.db.client import DbClient, SnapshotCollectionClient
+from scrapy.exceptions import DropItem
+from wbm_snapshot.db.client import SnapshotCollectionClient
 from wbm_snapshot.snapshot import Snapshot
 
+from wbm_newspapers.analysis.aggregates import (acquire_aggregates,
+                                                release_aggregates)
+from wbm_newspapers.analysis.index import (acquire_index, item_document,
+                                           release_index)
+from wbm_newspapers.analysis.simhash import SimHashIndex
+from wbm_newspapers.analysis.tokens import (TokenCountStore, count_batch,
+                                            token_pool)
+from wbm_newspapers.waybackmachine.metrics import stage_timer
 from wbm_newspapers.waybackmachine.spiders.base import SpiderWaybackMachineBase
+from wbm_newspapers.waybackmachine.spiders.db import (acquire_client,
+                                                     release_client)
+from wbm_newspapers.waybackmachine.spiders.schema import (
+    ensure_indexes, install_query_monitor, report_queries)
+from wbm_newspapers.waybackmachine.spiders.sqlite_db import (acquire_store,
+                                                            release_store)
 from wbm_newspapers.waybackmachine.utils import url2path
 
 logger = logging.getLogger(__name__)
@@ -96,8 +112,10 @@ class JsonWriterPipeline:
 
         snapshot = Snapshot.from_dict(data, snapshot=adapter_dict['snapshot'])
 
-        outdir = path_from_url(data['url'], output_dir)
-        snapshot.save(outdir)
+        with stage_timer(spider, 'pipeline_write/json'):
+            outdir = path_from_url(data['url'], output_dir)
+            snapshot.save(outdir)
+        return item
 
 
 class MongodbWriterPipeline:
@@ -108,24 +126,40 @@ class MongodbWriterPipeline:
 
     def __init__(self):
         self.client = None
+        self.address = (self.CONNECTION, self.DATABASE)
 
     def open_spider(self, spider: SpiderWaybackMachineBase):
         """Open spider."""
-        self.client = DbClient(connection=self.CONNECTION,
-                               database=self.DATABASE)
+        if spider.storage_settings()['backend'] != 'mongodb':
+            return
+        db_settings = spider.special_settings().get('db', {})
+        self.address = (db_settings.get('host', self.CONNECTION),
+                        db_settings.get('database', self.DATABASE))
+        install_query_monitor(db_settings.get('slow_query_ms', 100))
+        self.client = acquire_client(*self.address)
 
         if spider.clear_database is True:
             self.client.db.drop_collection(spider.name)
             logger.info("Collection '%s' was dropped %s",
                         spider.name, spider.clear_database)
 
+        if db_settings.get('indexes', True):
+            ensure_indexes(self.client.db[spider.name])
+
     def close_spider(self, spider: scrapy.Spider):
         """Close spider."""
-        self.client.client.close()
-        logger.info("Connection for spider '%s' was closed", spider.name)
+        if self.client is None:
+            return
+        reported = report_queries(self.client.db[spider.name])
+        logger.info("Slow or unindexed query shapes of '%s': %d",
+                    spider.name, len(reported))
+        release_client(*self.address)
+        logger.info("Connection for spider '%s' was released", spider.name)
 
     def process_item(self, item: Any, spider: scrapy.Spider):
         """Process item and save to database."""
+        if self.client is None:
+            return item
         snapshot_db = SnapshotCollectionClient(self.client, spider.name)
 
         adapter_dict = ItemAdapter(item).asdict()
@@ -136,4 +170,302 @@ class MongodbWriterPipeline:
         }
 
         snapshot = Snapshot.from_dict(data, snapshot=adapter_dict['snapshot'])
-        snapshot_db.insert(snapshot, unique=True)
+        with stage_timer(spider, 'pipeline_write/mongodb'):
+            snapshot_db.insert(snapshot, unique=True)
+        return item
+
+
+class SqliteWriterPipeline:
+    """
+    Write items to the embedded SQLite store of spiders with
+    'sqlite' storage backend and compact it to Parquet on close.
+    """
+
+    def __init__(self):
+        self.store = None
+        self.storage = {}
+
+    def open_spider(self, spider: SpiderWaybackMachineBase):
+        """Open spider."""
+        self.storage = spider.storage_settings()
+        if self.storage['backend'] != 'sqlite':
+            return
+        self.store = acquire_store(self.storage['path'],
+                                   spider.name,
+                                   self.storage.get('batch_size', 500))
+
+        if spider.clear_database is True:
+            self.store.drop()
+            logger.info("Table '%s' was dropped %s",
+                        spider.name, spider.clear_database)
+
+    def close_spider(self, spider: scrapy.Spider):
+        """Close spider."""
+        if self.store is None:
+            return
+        if self.storage.get('compact', True):
+            with stage_timer(spider, 'pipeline_close/compact'):
+                self.store.compact(self.storage['parquet'],
+                                   self.storage.get('snapshot', False))
+        release_store(self.storage['path'], spider.name)
+        self.store = None
+
+    def process_item(self, item: Any, spider: scrapy.Spider):
+        """Process item and queue it for writing."""
+        if self.store is None:
+            return item
+        with stage_timer(spider, 'pipeline_write/sqlite'):
+            self.store.insert(ItemAdapter(item).asdict())
+        return item
+
+
+class TokenCountsPipeline:  # pylint: disable=too-many-instance-attributes
+    """
+    Count tokens of item texts in a process pool and save
+    count vectors to `<TOKENS_DIR>/<spider name>`.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 workers: Optional[int] = None,
+                 batch_size: int = 500,
+                 language: str = 'russian'):
+        """
+        Parameters
+        ----------
+        directory : str
+            Root directory of token count stores.
+        workers : Optional[int], optional
+            Pool processes, by default None meaning CPU count.
+        batch_size : int, optional
+            Items counted by a worker at once, by default 500.
+        language : str, optional
+            Stemmer and stopwords language, by default 'russian'.
+        """
+        self.directory = directory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.language = language
+        self.store: Optional[TokenCountStore] = None
+        self._pool = None
+        self._batch: Tuple[List[str], List[str]] = ([], [])
+        self._pending: List[Tuple[List[str], Future]] = []
+
+    @classmethod
+    def from_crawler(cls,
+                     crawler: scrapy.crawler.Crawler) -> 'TokenCountsPipeline':
+        """Instantiate from crawler."""
+        return cls(
+            directory=crawler.settings.get('TOKENS_DIR'),
+            workers=crawler.settings.getint('TOKENS_WORKERS') or None,
+            batch_size=crawler.settings.getint('TOKENS_BATCH_SIZE', 500),
+            language=crawler.settings.get('TOKENS_LANGUAGE', 'russian'))
+
+    def open_spider(self, spider: scrapy.Spider):
+        """Open spider."""
+        self.store = TokenCountStore(os.path.join(self.directory,
+                                                  spider.name))
+        self._pool = token_pool(self.workers, self.language)
+
+    def close_spider(self, spider: scrapy.Spider):
+        """Count remaining items and stop the pool."""
+        self._submit()
+        with stage_timer(spider, 'pipeline_close/tokens'):
+            self._save(wait=True)
+        self._pool.shutdown()
+        logger.info("Token counts of '%s': %d terms",
+                    spider.name, len(self.store.vocabulary))
+
+    def process_item(self, item: Any, spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """Queue item text for counting."""
+        adapter = ItemAdapter(item)
+        self._batch[0].append(adapter.get('url'))
+        self._batch[1].append(adapter.get('text') or '')
+        if len(self._batch[0]) >= self.batch_size:
+            self._submit()
+        self._save(wait=False)
+        return item
+
+    def _submit(self):
+        keys, texts = self._batch
+        if keys:
+            self._pending.append((keys, self._pool.submit(count_batch,
+                                                          texts)))
+            self._batch = ([], [])
+
+    def _save(self, wait: bool):
+        # Shards are saved in submission order.
+        while self._pending and (wait or self._pending[0][1].done()):
+            keys, future = self._pending.pop(0)
+            counts: List[Dict[str, int]] = future.result()
+            self.store.append(keys, counts)
+
+
+class InvertedIndexPipeline:
+    """Add stored items to the inverted index in `INDEX_DIR`."""
+
+    def __init__(self,
+                 directory: str,
+                 segment_size: int = 10000,
+                 max_segments: int = 10):
+        """
+        Parameters
+        ----------
+        directory : str
+            Index directory shared by all spiders.
+        segment_size : int, optional
+            Items written as one segment, by default 10000.
+        max_segments : int, optional
+            Segments are merged on close above this number, by default 10.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.index = None
+
+    @classmethod
+    def from_crawler(
+            cls,
+            crawler: scrapy.crawler.Crawler) -> 'InvertedIndexPipeline':
+        """Instantiate from crawler."""
+        return cls(
+            directory=crawler.settings.get('INDEX_DIR'),
+            segment_size=crawler.settings.getint('INDEX_SEGMENT_SIZE', 10000),
+            max_segments=crawler.settings.getint('INDEX_MAX_SEGMENTS', 10))
+
+    def open_spider(self, spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """Open spider."""
+        self.index = acquire_index(self.directory, self.segment_size)
+
+    def close_spider(self, spider: scrapy.Spider):
+        """Close spider, the last spider flushes the index."""
+        with stage_timer(spider, 'pipeline_close/index'):
+            release_index(self.directory, self.max_segments)
+
+    def process_item(self, item: Any, spider: scrapy.Spider):
+        """Add item to the index."""
+        with stage_timer(spider, 'pipeline_write/index'):
+            self.index.add(item_document(ItemAdapter(item).asdict()))
+        return item
+
+
+class AggregatesPipeline:
+    """
+    Update materialized aggregates in `AGGREGATES_PATH` with stored
+    items, read by the table dashboard.
+    """
+
+    def __init__(self, path: str, batch_size: int = 500):
+        """
+        Parameters
+        ----------
+        path : str
+            Aggregates database shared by all spiders.
+        batch_size : int, optional
+            Items added in one transaction, by default 500.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.aggregates = None
+
+    @classmethod
+    def from_crawler(cls,
+                     crawler: scrapy.crawler.Crawler) -> 'AggregatesPipeline':
+        """Instantiate from crawler."""
+        return cls(
+            path=crawler.settings.get('AGGREGATES_PATH'),
+            batch_size=crawler.settings.getint('AGGREGATES_BATCH_SIZE', 500))
+
+    def open_spider(self, spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """Open spider."""
+        self.aggregates = acquire_aggregates(self.path, self.batch_size)
+
+    def close_spider(self, spider: scrapy.Spider):
+        """Close spider, the last spider writes pending counts."""
+        with stage_timer(spider, 'pipeline_close/aggregates'):
+            release_aggregates(self.path)
+
+    def process_item(self, item: Any, spider: scrapy.Spider):
+        """Add item to the aggregates."""
+        with stage_timer(spider, 'pipeline_write/aggregates'):
+            self.aggregates.add(ItemAdapter(item).asdict())
+        return item
+
+
+class NearDuplicatePipeline:
+    """
+    Detect near-duplicate article texts with SimHash before items are
+    stored, duplicates are linked by `duplicate_of` or dropped.
+
+    The LSH index of every spider is saved to
+    `<DUPLICATES_DIR>/<spider name>.npz` and loaded by the next run.
+    """
+
+    ACTIONS = ('link', 'drop')
+
+    def __init__(self,
+                 directory: str,
+                 distance: int = 3,
+                 min_tokens: int = 30,
+                 action: str = 'link'):
+        """
+        Parameters
+        ----------
+        directory : str
+            Directory of index files.
+        distance : int, optional
+            Largest Hamming distance of duplicate signatures,
+            by default 3.
+        min_tokens : int, optional
+            Shorter texts are not checked, by default 30.
+        action : str, optional
+            'link' sets `duplicate_of` of duplicates, 'drop' drops them,
+            by default 'link'.
+        """
+        if action not in self.ACTIONS:
+            raise ValueError(f"unknown duplicates action '{action}'")
+        self.directory = directory
+        self.distance = distance
+        self.min_tokens = min_tokens
+        self.action = action
+        self.index: Optional[SimHashIndex] = None
+        self.n_duplicates = 0
+
+    @classmethod
+    def from_crawler(
+            cls,
+            crawler: scrapy.crawler.Crawler) -> 'NearDuplicatePipeline':
+        """Instantiate from crawler."""
+        return cls(
+            directory=crawler.settings.get('DUPLICATES_DIR'),
+            distance=crawler.settings.getint('DUPLICATES_DISTANCE', 3),
+            min_tokens=crawler.settings.getint('DUPLICATES_MIN_TOKENS', 30),
+            action=crawler.settings.get('DUPLICATES_ACTION', 'link'))
+
+    def open_spider(self, spider: scrapy.Spider):
+        """Open spider and load its index."""
+        self.index = SimHashIndex(
+            os.path.join(self.directory, f'{spider.name}.npz'),
+            distance=self.distance,
+            min_tokens=self.min_tokens)
+
+    def close_spider(self, spider: scrapy.Spider):
+        """Save index."""
+        with stage_timer(spider, 'pipeline_close/duplicates'):
+            self.index.save()
+        logger.info("Near-duplicate articles of '%s': %d",
+                    spider.name, self.n_duplicates)
+
+    def process_item(self, item: Any, spider: scrapy.Spider):
+        """Link or drop item if its text is a near-duplicate."""
+        adapter = ItemAdapter(item)
+        with stage_timer(spider, 'pipeline_check/duplicates'):
+            duplicate = self.index.check(str(adapter.get('url')),
+                                         adapter.get('text') or '')
+        if duplicate is None:
+            return item
+        self.n_duplicates += 1
+        if self.action == 'drop':
+            raise DropItem(f"near-duplicate of {duplicate}")
+        adapter['duplicate_of'] = duplicate
+        return item
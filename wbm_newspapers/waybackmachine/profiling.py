@@ -0,0 +1,117 @@
+"""Profiling of every N-th spider callback call."""
+import cProfile
+import io
+import logging
+import os
+import pstats
+from typing import Any, Callable, Dict, Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackProfiler:
+    """
+    Profile every N-th call of spider callbacks with cProfile.
+
+    Profiles of sampled calls are merged per callback name and can be
+    dumped with a report of the hottest functions.
+    """
+
+    def __init__(self,
+                 every: int = 100,
+                 top: int = 30,
+                 sort: str = 'cumulative'):
+        """
+        Parameters
+        ----------
+        every : int, optional
+            Profile every N-th call, by default 100.
+        top : int, optional
+            Number of functions in the report, by default 30.
+        sort : str, optional
+            pstats sort key of the report, by default 'cumulative'.
+        """
+        if every < 1:
+            raise ValueError(f"Profiling period must be positive: {every}")
+        self.every = every
+        self.top = top
+        self.sort = sort
+        self._calls: Dict[str, int] = {}
+        self._stats: Dict[str, pstats.Stats] = {}
+
+    def _is_sampled(self, name: str) -> bool:
+        count = self._calls.get(name, 0)
+        self._calls[name] = count + 1
+        return count % self.every == 0
+
+    def _add(self, name: str, profile: cProfile.Profile):
+        if name in self._stats:
+            self._stats[name].add(profile)
+        else:
+            self._stats[name] = pstats.Stats(profile)
+
+    def call(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """Call function and profile it if the call is sampled."""
+        if not self._is_sampled(name):
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            self._add(name, profile)
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterator:
+        """
+        Iterate and profile the iteration if the call is sampled.
+
+        Profiler is enabled only while the next value is produced.
+        """
+        if not self._is_sampled(name):
+            yield from iterable
+            return
+
+        profile = cProfile.Profile()
+        iterator = iter(iterable)
+        try:
+            while True:
+                profile.enable()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    profile.disable()
+                yield value
+        finally:
+            self._add(name, profile)
+
+    def report(self, name: str) -> str:
+        """Report of the hottest functions of the callback."""
+        stream = io.StringIO()
+        stats = self._stats[name]
+        stats.stream = stream
+        stats.sort_stats(self.sort).print_stats(self.top)
+        return stream.getvalue()
+
+    def dump(self, directory: str):
+        """Write merged profiles and reports to the directory."""
+        if len(self._stats) == 0:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        for name, stats in self._stats.items():
+            profile_file = os.path.join(directory, f"{name}.prof")
+            stats.dump_stats(profile_file)
+
+            report = self.report(name)
+            report_file = os.path.join(directory, f"{name}_top.txt")
+            with open(report_file, 'w', encoding='utf-8') as fobj:
+                fobj.write(report)
+
+            logger.info("Profile of '%s' (%d of %d calls) saved to '%s':\n%s",
+                        name,
+                        (self._calls[name] - 1) // self.every + 1,
+                        self._calls[name],
+                        profile_file,
+                        report)
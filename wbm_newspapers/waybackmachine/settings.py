@@ -12,8 +12,8 @@ import os
 
 BOT_NAME = 'waybackmachine'
 
-SPIDER_MODULES = ['waybackmachine.spiders']
-NEWSPIDER_MODULE = 'waybackmachine.spiders'
+SPIDER_MODULES = ['wbm_newspapers.waybackmachine.spiders']
+NEWSPIDER_MODULE = 'wbm_newspapers.waybackmachine.spiders'
 
 
 # Crawl responsibly by identifying yourself
@@ -55,21 +55,62 @@ DOWNLOAD_DELAY = 0.3
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    'waybackmachine.middlewares.WaybackmachineDownloaderMiddleware': 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+    # 'waybackmachine.middlewares.WaybackmachineDownloaderMiddleware': 543,
+    # Free slot after RetryMiddleware (550), before MetaRefreshMiddleware
+    # (580) and HttpCompressionMiddleware (590).
+    'wbm_newspapers.waybackmachine.throttle.ArchiveBudgetMiddleware': 570,
+}
+
+# Rate and concurrency budget of archive.org requests shared by all
+# crawlers of the process, disabled if the rate is 0
+ARCHIVE_RATE_LIMIT = 0
+ARCHIVE_RATE_BURST = 1
+ARCHIVE_CONCURRENCY = 8
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-# }
+EXTENSIONS = {
+    # 'scrapy.extensions.telnet.TelnetConsole': None,
+    'wbm_newspapers.waybackmachine.extensions.PrometheusTextfileExport': 500,
+    'wbm_newspapers.waybackmachine.extensions.MemoryWatchdog': 510,
+    'wbm_newspapers.waybackmachine.extensions.QueuedLogging': 520,
+    'wbm_newspapers.waybackmachine.extensions.ProgressLog': 530,
+}
+
+# Stats and stage metrics in Prometheus text format, one file per spider
+# named <stem>_<spider name>.prom, export is disabled if the path is empty
+PROMETHEUS_TEXTFILE = ''
+PROMETHEUS_TEXTFILE_INTERVAL = 30
+
+# Lower download concurrency near the memory limit, watchdog is
+# disabled if 0
+MEMORY_WATCHDOG_LIMIT_MB = 0
+MEMORY_WATCHDOG_INTERVAL = 5
+MEMORY_WATCHDOG_THROTTLE_RATIO = 0.9
+MEMORY_WATCHDOG_RESUME_RATIO = 0.75
+MEMORY_WATCHDOG_TRACEMALLOC = False
+
+# Write log records from a background thread, records with the same
+# message are limited to LOG_RATE_LIMIT_BURST per LOG_RATE_LIMIT_PERIOD
+# (errors are never limited)
+LOG_QUEUE_ENABLED = False
+LOG_RATE_LIMIT_PERIOD = 60
+LOG_RATE_LIMIT_BURST = 10
+
+# Aggregated progress line period in seconds, disabled if 0
+LOG_PROGRESS_INTERVAL = 60
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
-    'waybackmachine.pipelines.MongodbWriterPipeline': 300,
-    # 'waybackmachine.pipelines.JsonWriterPipeline': 300,
+    # 'wbm_newspapers.waybackmachine.pipelines.NearDuplicatePipeline': 200,
+    'wbm_newspapers.waybackmachine.pipelines.MongodbWriterPipeline': 300,
+    'wbm_newspapers.waybackmachine.pipelines.SqliteWriterPipeline': 310,
+    # 'wbm_newspapers.waybackmachine.pipelines.JsonWriterPipeline': 300,
+    # 'wbm_newspapers.waybackmachine.pipelines.InvertedIndexPipeline': 320,
+    # 'wbm_newspapers.waybackmachine.pipelines.AggregatesPipeline': 330,
+    # 'wbm_newspapers.waybackmachine.pipelines.TokenCountsPipeline': 400,
 }
 
 # Enable and configure the AutoThrottle extension (disabled by default)
@@ -96,3 +137,25 @@ ITEM_PIPELINES = {
 #HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
 
 data_dir = os.path.expanduser("~/wbm_data/data")
+
+# Token count vectors of TokenCountsPipeline, requires nltk.
+TOKENS_DIR = os.path.join(data_dir, 'tokens')
+TOKENS_WORKERS = 0
+TOKENS_BATCH_SIZE = 500
+TOKENS_LANGUAGE = 'russian'
+
+# Inverted index of InvertedIndexPipeline.
+INDEX_DIR = os.path.join(data_dir, 'index')
+INDEX_SEGMENT_SIZE = 10000
+INDEX_MAX_SEGMENTS = 10
+
+# Materialized aggregates of AggregatesPipeline and the table dashboard.
+AGGREGATES_PATH = os.path.join(data_dir, 'aggregates.sqlite')
+AGGREGATES_BATCH_SIZE = 500
+
+# SimHash indexes of NearDuplicatePipeline, duplicates are linked by
+# 'duplicate_of' or dropped.
+DUPLICATES_DIR = os.path.join(data_dir, 'duplicates')
+DUPLICATES_DISTANCE = 3
+DUPLICATES_MIN_TOKENS = 30
+DUPLICATES_ACTION = 'link'
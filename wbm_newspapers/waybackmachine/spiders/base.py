@@ -1,102 +1,91 @@
 """Wayback Machine CDX spider."""
 import abc
 import logging
-import re
+import os
+import socket
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Pattern
+from typing import (Any, Dict, Iterable, List, Optional, Tuple, Type,
+                    Union)
 
+import pandas as pd
 import scrapy
-import yaml
 from bs4 import BeautifulSoup
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import DontCloseSpider
 from waybackmachine_cdx import WaybackMachineCDX
 
 from wbm_newspapers.extraction.extraction import BaseExtractor
+from wbm_newspapers.extraction.utils import extract_url_dates
 from wbm_newspapers.waybackmachine import settings
+from wbm_newspapers.waybackmachine.guards import (ParseTimeout, SkipLog,
+                                                  is_cancelled, time_budget)
 from wbm_newspapers.waybackmachine.items import \
     WaybackMachineGeneralArticleItem
-from wbm_newspapers.waybackmachine.spiders.db import SpiderDatabase
+from wbm_newspapers.waybackmachine.logs import (start_queued_logging,
+                                                stop_queued_logging)
+from wbm_newspapers.waybackmachine.metrics import StageMetrics
+from wbm_newspapers.waybackmachine.profiling import CallbackProfiler
+from wbm_newspapers.waybackmachine.spiders.cache import CdxCache, Partition
+from wbm_newspapers.waybackmachine.spiders.config import (
+    read_settings_file, validate_settings)
+from wbm_newspapers.waybackmachine.spiders.db import (SpiderDatabase,
+                                                     acquire_client,
+                                                     release_client)
+from wbm_newspapers.waybackmachine.spiders.discovery import \
+    FrontPageDiscovery
+from wbm_newspapers.waybackmachine.spiders.extraction_cache import (
+    ExtractedFields, ExtractionCache, body_digest)
+from wbm_newspapers.waybackmachine.spiders.filters import DefaultFilter
 from wbm_newspapers.waybackmachine.spiders.response import \
     WaybackMachineResponseCDX
+from wbm_newspapers.waybackmachine.spiders.select import SnapshotSelector
+from wbm_newspapers.waybackmachine.spiders.sqlite_db import \
+    SqliteSpiderDatabase
+from wbm_newspapers.waybackmachine.spiders.workqueue import (
+    WorkQueue, create_work_queue)
 
 logger = logging.getLogger(__name__)
 
 
-class DefaultFilter:
-    """Filter."""
-
-    def __init__(self,
-                 include_url: Optional[List[str]] = None,
-                 exclude_url: Optional[List[str]] = None,
-                 exclude_statuscodes: Optional[List[str]] = None,
-                 include_mimetypes: Optional[List[str]] = None):
-
-        include_url_ = None
-        exclude_url_ = None
-
-        if include_url is not None:
-            include_url_ = [re.compile(exp) for exp in include_url]
-
-        if exclude_url is not None:
-            exclude_url_ = [re.compile(exp) for exp in exclude_url]
-
-        if exclude_statuscodes is None:
-            exclude_statuscodes = ['404']
-
-        self._exclude_url = exclude_url_
-        self._include_url = include_url_
-
-        self._exclude_statuscodes = exclude_statuscodes
-        self._include_mimetypes = include_mimetypes
-
-    @staticmethod
-    def _is_in_list(value: str, exp_list: List[Pattern]) -> bool:
-        result = any(exp.fullmatch(value) is not None for exp in exp_list)
-        return result
-
-    def filter_statuscode(self, statuscode: str) -> bool:
-        """Filter statuscodes"""
-        return statuscode not in self._exclude_statuscodes
-
-    def filter_url(self, url: str) -> bool:
-        """"Filter by URL"""
-
-        if self._include_url is None or len(self._include_url) == 0:
-            inc = True
-        else:
-            inc = self._is_in_list(url, self._include_url)
-
-        if self._exclude_url is None or len(self._exclude_url) == 0:
-            not_exc = True
-        else:
-            not_exc = not self._is_in_list(url, self._exclude_url)
+class SpiderWaybackMachineBase(scrapy.Spider, metaclass=abc.ABCMeta):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """Basic Wayback Machine domain scraper."""
 
-        return inc and not_exc
+    DB_HOST = 'mongodb://localhost'
+    DB_NAME = 'anynews_wbm'
 
-    def filter_mimetype(self, mimetype: str) -> bool:
-        """Mimetypes filtering"""
-        if self._include_mimetypes is None:
-            inc = True
-        else:
-            inc = mimetype in self._include_mimetypes
-        return inc
+    url_date_formats: List[Tuple[str, str]] = []
 
+    # Messages of the spider module are also written to this file,
+    # relative paths are in the 'logs' directory of the data directory.
+    log_file: Optional[str] = None
 
-class SpiderWaybackMachineBase(scrapy.Spider, metaclass=abc.ABCMeta):
-    """Basic Wayback Machine domain scraper."""
+    # Set by the memory watchdog extension, CDX pages are requested
+    # after the queued snapshots while memory is low.
+    memory_throttled = False
+    CDX_THROTTLED_PRIORITY = -100
 
-    DB_HOST = 'mongodb://localhost'
-    DB_NAME = 'anynews_wbm'
+    # Crawl modes: the coordinator publishes snapshots of CDX responses
+    # to the work queue, workers download leased snapshots.
+    MODES = ('', 'coordinator', 'worker')
 
-    counter = {'parse': 0, 'success': 0, 'failed': 0}
+    # Errors of extraction from a downloaded snapshot, another attempt
+    # fails the same way, so the work unit is failed without retry.
+    # Download errors and other errors, like storage ones, are retried.
+    EXTRACTION_ERRORS = (ValueError, LookupError, AttributeError, TypeError)
 
     def __init__(self,
                  *args,
                  settings_file: str,
                  clear: str = 'False',
+                 mode: str = '',
                  **kwargs):
 
         super().__init__(*args, **kwargs)
 
+        self.counter = {'parse': 0, 'success': 0, 'failed': 0}
+        self.metrics = StageMetrics()
+
         self.output_directory = settings.data_dir
         scraper_settings = self.read_setting_file(settings_file)
         cdx_settings = scraper_settings['cdx']
@@ -114,16 +103,203 @@ class SpiderWaybackMachineBase(scrapy.Spider, metaclass=abc.ABCMeta):
         logger.info("Collection will be dropped: %s", clear)
         self._special_settings = scraper_settings
 
-        filter_original = self.special_settings().get('filter_original')
-        enable_mongodb = self.special_settings().get('enable_mongodb', True)
-
-        self._db: Optional[SpiderDatabase] = None
-        if filter_original is not None and filter_original and enable_mongodb:
+        self._db: Optional[Union[SpiderDatabase, SqliteSpiderDatabase]] = None
+        if self.special_settings().get('filter_original'):
+            self._db = self.create_database()
+
+        select_settings = self.special_settings().get('select', {})
+        self._selector = SnapshotSelector(select_settings.get('policy', 'all'))
+        self._collapse = (self._selector.policy == 'earliest'
+                          and select_settings.get('collapse', True))
+
+        self._profiler: Optional[CallbackProfiler] = None
+        profile_settings = self.special_settings().get('profile')
+        if profile_settings is not None:
+            self._profiler = CallbackProfiler(
+                profile_settings.get('every', 100),
+                profile_settings.get('top', 30),
+                profile_settings.get('sort', 'cumulative'))
+
+        self._cdx_cache: Optional[CdxCache] = None
+        cache_settings = self.special_settings().get('cdx_cache')
+        if cache_settings is not None:
+            self._cdx_cache = CdxCache(
+                cache_settings.get('directory',
+                                   os.path.join(self.output_directory,
+                                                'cdx_cache')),
+                cdx_settings['url'],
+                cdx_settings.get('match_type'),
+                cache_settings.get('partition', 'MS'),
+                variant='collapse' if self._collapse else '')
+            logger.info("CDX cache directory: '%s'", self._cdx_cache.root)
+
+        self._extraction_cache = self.create_extraction_cache()
+
+        self._guards: Dict[str, Any] = self.special_settings().get(
+            'guards') or {}
+        self._skip_log = self.create_skip_log()
+        self._discovery = self.create_discovery()
+
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown crawl mode '{mode}'")
+        self.mode = mode
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._queue_address: Optional[Tuple[str, str]] = None
+        self._queue: Optional[WorkQueue] = None
+        if mode:
+            self._queue = self.create_work_queue()
+            if mode == 'coordinator':
+                self._queue.set_closed(False)
+
+    def storage_settings(self) -> Dict[str, Any]:
+        """
+        Storage backend settings with defaults: 'backend' is 'mongodb'
+        or 'sqlite', 'path' of SQLite file and 'parquet' directory.
+        """
+        storage = dict(self.special_settings().get('storage') or {})
+        storage.setdefault('backend', 'mongodb')
+        storage.setdefault('path', os.path.join(self.output_directory,
+                                                'sqlite',
+                                                f'{self.name}.sqlite'))
+        storage.setdefault('parquet', os.path.join(self.output_directory,
+                                                   'parquet', self.name))
+        for key in ['path', 'parquet']:
+            storage[key] = os.path.expanduser(storage[key])
+        return storage
+
+    def create_database(self) \
+            -> Optional[Union[SpiderDatabase, SqliteSpiderDatabase]]:
+        """Database used to filter already stored original URLs."""
+        storage = self.storage_settings()
+        if storage['backend'] == 'sqlite':
+            return SqliteSpiderDatabase(self.name,
+                                        storage['path'],
+                                        storage.get('batch_size', 500))
+        if not self.special_settings().get('enable_mongodb', True):
+            return None
+        db_settings = self.special_settings().get('db', {})
+        return SpiderDatabase(self.name,
+                              db_settings.get('host', self.DB_HOST),
+                              db_settings.get('database', self.DB_NAME),
+                              db_settings.get('indexes', True))
+
+    def create_extraction_cache(self) -> Optional[ExtractionCache]:
+        """Cache of extracted fields if 'extraction_cache' is set."""
+        cache_settings = self.special_settings().get('extraction_cache')
+        if cache_settings is None:
+            return None
+        path = cache_settings.get('path',
+                                  os.path.join(self.output_directory,
+                                               'extraction_cache',
+                                               f'{self.name}.sqlite'))
+        cache = ExtractionCache(os.path.expanduser(path))
+        cache.discard_stale(self.extractor_classes())
+        logger.info("Extraction cache: '%s'", cache.path)
+        return cache
+
+    def create_skip_log(self) -> Optional[SkipLog]:
+        """Log of pages skipped by the 'guards' limits."""
+        if not self._guards:
+            return None
+        path = self._guards.get('skipped',
+                                os.path.join(self.output_directory,
+                                             'skipped', f'{self.name}.jsonl'))
+        return SkipLog(os.path.expanduser(path))
+
+    def create_discovery(self) -> Optional[FrontPageDiscovery]:
+        """Front page link discovery if 'discovery' is set."""
+        discovery = self.special_settings().get('discovery')
+        if discovery is None:
+            return None
+        cdx_settings = self.special_settings()['cdx']
+        dates: Dict[str, Optional[datetime]] = {}
+        for key in ['from_dt', 'to_dt']:
+            value = discovery.get(key, cdx_settings.get(key))
+            if isinstance(value, str):
+                value = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+            dates[key] = value
+        if dates['from_dt'] is None:
+            raise ValueError("Discovery requires 'from_dt'")
+        return FrontPageDiscovery(discovery['pages'],
+                                  dates['from_dt'],
+                                  dates['to_dt'],
+                                  discovery.get('every', '1D'),
+                                  allow=discovery.get('allow'),
+                                  deny=discovery.get('deny'))
+
+    def record_skip(self, url: str, reason: str, **details: Any):
+        """Record page skipped by a guard for offline processing."""
+        self.metrics.inc(f'guards/skipped/{reason}')
+        if self._skip_log is not None:
+            self._skip_log.record(url, reason, **details)
+
+    def create_work_queue(self) -> WorkQueue:
+        """Work queue of the coordinator and worker modes."""
+        queue_settings = self.special_settings().get('queue', {})
+        db = None
+        if queue_settings.get('backend', 'sqlite') == 'mongodb':
             db_settings = self.special_settings().get('db', {})
-            self._db = SpiderDatabase(
-                self.name,
-                db_settings.get('host', self.DB_HOST),
-                db_settings.get('database', self.DB_NAME))
+            self._queue_address = (db_settings.get('host', self.DB_HOST),
+                                   db_settings.get('database', self.DB_NAME))
+            db = acquire_client(*self._queue_address).db
+        elif 'path' not in queue_settings:
+            queue_settings = {**queue_settings,
+                              'path': os.path.join(self.output_directory,
+                                                   'queue.sqlite')}
+        return create_work_queue(queue_settings, f'{self.name}_queue', db)
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_opened,
+                                signal=signals.spider_opened)
+        if spider.mode == 'worker':
+            crawler.signals.connect(spider.spider_idle,
+                                    signal=signals.spider_idle)
+            crawler.signals.connect(spider.work_unit_processed,
+                                    signal=signals.item_scraped)
+        else:
+            crawler.signals.connect(spider.cdx_idle,
+                                    signal=signals.spider_idle)
+            crawler.signals.connect(spider.work_unit_processed,
+                                    signal=signals.item_dropped)
+            crawler.signals.connect(spider.work_unit_error,
+                                    signal=signals.item_error)
+            crawler.signals.connect(spider.work_unit_error,
+                                    signal=signals.spider_error)
+        spider.open_log_file()
+        return spider
+
+    def spider_opened(self, spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """Bind metrics to the crawler stats, set when the crawl starts."""
+        self.metrics.bind(self.crawler.stats)
+
+    def _module_logger(self) -> logging.Logger:
+        return logging.getLogger(type(self).__module__)
+
+    def open_log_file(self):
+        """Attach file handler of `log_file` to the spider module logger."""
+        if self.log_file is None:
+            return
+        path = os.path.join(self.output_directory, 'logs', self.log_file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = logging.FileHandler(path, encoding='utf-8', mode="w")
+        handler.setFormatter(logging.Formatter(
+            "%(name)s:%(levelname)s:%(message)s"))
+        self._module_logger().addHandler(handler)
+        if self.settings.getbool('LOG_QUEUE_ENABLED'):
+            start_queued_logging(type(self).__module__)
+
+    def close_log_file(self):
+        """Detach and close file handlers of the spider module logger."""
+        if self.log_file is None:
+            return
+        stop_queued_logging(type(self).__module__)
+        module_logger = self._module_logger()
+        for handler in list(module_logger.handlers):
+            if isinstance(handler, logging.FileHandler):
+                module_logger.removeHandler(handler)
+                handler.close()
 
     def special_settings(self) -> Dict[str, Any]:
         """Special spider settings from file."""
@@ -133,20 +309,150 @@ class SpiderWaybackMachineBase(scrapy.Spider, metaclass=abc.ABCMeta):
         """Read YAML file with settings and return dict."""
 
         logger.info("read config file for spider '%s': '%s'", self.name, file)
-        with open(file, 'r', encoding='utf-8') as stream:
-            data = yaml.safe_load(stream)
+        data = read_settings_file(file)
+        for error in validate_settings(data):
+            logger.warning("Settings file '%s': %s", file, error)
 
         return data
 
+    async def start(self):
+        """Starting requests of Scrapy 2.13+, same as `start_requests`."""
+        for request in self.start_requests():
+            yield request
+
     def start_requests(self):
         """Starting request."""
 
-        self._cdx.set_output_format('json')
-        self._cdx.set_resume_key(show=True)
+        if self.mode == 'worker':
+            yield from self.lease_requests()
+            return
+
+        if self._discovery is not None:
+            yield from self.discovery_requests()
+            return
 
-        request = scrapy.Request(self._cdx.cdx, self.parse_cdx)
+        if self._cdx_cache is None:
+            self._cdx.set_output_format('json')
+            self._cdx.set_resume_key(show=True)
 
-        yield request
+            request = scrapy.Request(self.cdx_url(self._cdx), self.parse_cdx,
+                                     errback=self.cdx_failed)
+
+            yield request
+            return
+
+        cdx_settings = self.special_settings()['cdx']
+        partitions = self._cdx_cache.partitions(cdx_settings.get('from_dt'),
+                                                cdx_settings.get('to_dt'))
+        for partition in partitions:
+            if self._cdx_cache.is_complete(partition):
+                data = self._cdx_cache.load(partition)
+                yield from self.process_cdx(data, stream=partition)
+            else:
+                cdx = self.partition_cdx(partition)
+                yield scrapy.Request(self.cdx_url(cdx),
+                                     self.parse_cdx,
+                                     errback=self.cdx_failed,
+                                     cb_kwargs={'cdx': cdx,
+                                                'partition': partition})
+
+    def discovery_requests(self) -> Iterable[scrapy.Request]:
+        """Requests of front page captures instead of CDX queries."""
+        logger.info("Discovery of %d pages at %d times",
+                    len(self._discovery.pages), len(self._discovery.times))
+        for page, timestamp in self._discovery.captures():
+            yield scrapy.Request(
+                WaybackMachineResponseCDX.to_archive_url(page, timestamp),
+                self.parse_front_page,
+                cb_kwargs={'page': page, 'timestamp': timestamp})
+
+    def parse_front_page(self,
+                         response: scrapy.http.Response,
+                         page: str,
+                         timestamp: str):
+        """Request new article links of the front page capture."""
+        self._observe_download('front_fetch', 'front_page', response)
+        if not isinstance(response, scrapy.http.TextResponse):
+            logger.warning("Front page '%s' is not text", response.url)
+            return
+        with self.metrics.timer('discovery'):
+            data = self._discovery.to_cdx(response, page, timestamp)
+        self.metrics.inc('discovery/links', data.n_rows)
+        yield from self.process_cdx(data)
+
+    def partition_cdx(self, partition: Partition) -> WaybackMachineCDX:
+        """CDX request object restricted to the partition time range."""
+
+        cdx_settings = dict(self.special_settings()['cdx'])
+        cdx_settings['from_dt'], cdx_settings['to_dt'] = partition
+
+        cdx = WaybackMachineCDX(**cdx_settings)
+        cdx.set_output_format('json')
+        cdx.set_resume_key(show=True)
+        return cdx
+
+    def cdx_url(self, cdx: WaybackMachineCDX) -> str:
+        """
+        CDX request URL.
+
+        Earliest capture selection is done by the CDX server with
+        collapsing by URL key. Status and mimetype filters are sent
+        to the server too, otherwise collapsing can keep a capture
+        which is filtered out later.
+        """
+        url = cdx.cdx
+        if self._collapse:
+            params = ["collapse=urlkey"] + self._filter.cdx_filters()
+            url = url + "&" + "&".join(params)
+        return url
+
+    def url_dates(self, originals: pd.Series) -> pd.Series:
+        """Article dates of original URLs as datetime64 series."""
+        return extract_url_dates(originals, self.url_date_formats)
+
+    def _filter_article_date(self,
+                             data: WaybackMachineResponseCDX) \
+            -> WaybackMachineResponseCDX:
+
+        window = self.special_settings().get('article_date')
+        if window is None:
+            return data
+
+        dates = data.column('url_date')
+        where = pd.Series(True, index=dates.index)
+        if window.get('from_dt') is not None:
+            where &= dates >= pd.Timestamp(window['from_dt'])
+        if window.get('to_dt') is not None:
+            where &= dates <= pd.Timestamp(window['to_dt'])
+        where |= dates.isna() & window.get('keep_undated', True)
+
+        data = data.mask(where.to_numpy(dtype=bool))
+        logger.info("CDX response %d rows after article date filtering.",
+                    data.n_rows)
+        return data
+
+    def _filter_length(self,
+                       data: WaybackMachineResponseCDX) \
+            -> WaybackMachineResponseCDX:
+        # CDX length is the compressed record size, pages passing it are
+        # limited by download_maxsize again.
+        max_bytes = self._guards.get('max_bytes')
+        if not max_bytes or 'length' not in data.columns or data.n_rows == 0:
+            return data
+
+        lengths = pd.to_numeric(data.column('length'), errors='coerce')
+        over = (lengths > max_bytes).to_numpy(dtype=bool)
+        if over.any():
+            skipped = data.mask(over)
+            for original, timestamp, length in zip(
+                    skipped.column('original'), skipped.column('timestamp'),
+                    lengths[over]):
+                self.record_skip(data.to_archive_url(original, timestamp),
+                                 'cdx_length', length=int(length))
+            data = data.mask(~over)
+        logger.info("CDX response %d rows after length filtering.",
+                    data.n_rows)
+        return data
 
     def _filter_cdx_response(self,
                              data: 'WaybackMachineResponseCDX') \
@@ -154,18 +460,15 @@ class SpiderWaybackMachineBase(scrapy.Spider, metaclass=abc.ABCMeta):
 
         logging.info("CDX response %d rows.", data.n_rows)
 
-        data = data.filter(
-            lambda row: self._filter.filter_statuscode(row['statuscode']))
+        data = data.filter_values('statuscode', self._filter.filter_statuscode)
         logging.info("CDX response %d rows after status filtering.",
                      data.n_rows)
 
-        data = data.filter(
-            lambda row: self._filter.filter_mimetype(row['mimetype']))
+        data = data.filter_values('mimetype', self._filter.filter_mimetype)
         logging.info("CDX response %d rows after mimetype filtering.",
                      data.n_rows)
 
-        data = data.filter(
-            lambda row: self._filter.filter_url(row['original']))
+        data = data.filter_values('original', self._filter.filter_url)
         logging.info("CDX response %d rows after URL filtering.",
                      data.n_rows)
 
@@ -176,89 +479,446 @@ class SpiderWaybackMachineBase(scrapy.Spider, metaclass=abc.ABCMeta):
         """Filter urls."""
         if self._db is not None:
             n_rows_before = data.n_rows
-            self._db.filter(data)
+            data = self._db.filter(data)
             logger.info("Spider '%s' filtered %d rows by original URL %d left",
                         self.name, n_rows_before - data.n_rows, data.n_rows)
         return data
 
-    def parse_cdx(self, response: scrapy.http.TextResponse):
+    def parse_cdx(self, response: scrapy.http.TextResponse, **kwargs):
         """Parse cdx responses."""
+        results = self._parse_cdx(response, **kwargs)
+        if self._profiler is not None:
+            results = self._profiler.iterate('parse_cdx', results)
+        return results
 
-        data = WaybackMachineResponseCDX.from_text(response.text)
+    def _parse_cdx(self,
+                   response: scrapy.http.TextResponse,
+                   cdx: Optional[WaybackMachineCDX] = None,
+                   partition: Optional[Partition] = None,
+                   page: int = 0):
 
-        data = self._filter_cdx_response(data)
-        data = self.filter(data)
+        if cdx is None:
+            cdx = self._cdx
 
-        snapshots_iter = SnapshotUrlIterator(data)
-        logger.info("Number of urls to process = %d", len(snapshots_iter))
-        for index, url in enumerate(snapshots_iter):
-            if index % 100 == 0:
-                logger.debug("Progress: %f2.2; Current: %d; All: %d",
-                             index / len(snapshots_iter),
-                             index,
-                             len(snapshots_iter))
-                logger.debug("Counter: %s", self.counter)
-            yield scrapy.Request(url, self.parse)
+        self._observe_download('cdx_fetch', 'cdx_page', response)
+        with self.metrics.timer('cdx_parse'):
+            data = WaybackMachineResponseCDX.from_text(response.text)
+
+        if partition is not None and self._cdx_cache is not None:
+            self._cdx_cache.write_page(partition, page, data)
+            if data.resume_key is None:
+                self._cdx_cache.mark_complete(partition)
 
-        logger.info("Counter: %s", self.counter)
+        yield from self.process_cdx(data,
+                                    stream=partition,
+                                    final=data.resume_key is None)
 
         if data.resume_key is not None:
 
-            self._cdx.set_resume_key(show=True, key=data.resume_key)
-            request = scrapy.Request(self._cdx.cdx, self.parse_cdx)
+            cdx.set_resume_key(show=True, key=data.resume_key)
+            priority = 0
+            if self.memory_throttled:
+                priority = self.CDX_THROTTLED_PRIORITY
+            request = scrapy.Request(self.cdx_url(cdx),
+                                     self.parse_cdx,
+                                     errback=self.cdx_failed,
+                                     priority=priority,
+                                     cb_kwargs={'cdx': cdx,
+                                                'partition': partition,
+                                                'page': page + 1})
 
             yield request
 
         else:
             logger.info("No resume key was provided. Finalizing...")
 
+    def process_cdx(self,
+                    data: WaybackMachineResponseCDX,
+                    stream: Optional[Partition] = None,
+                    final: bool = True):
+        """Filter CDX data and request snapshots."""
+
+        if data.n_rows > 0:
+            with self.metrics.timer('filter'):
+                data = self._filter_cdx_response(data)
+                data = data.assign('url_date',
+                                   self.url_dates(data.column('original')))
+                data = self._filter_article_date(data)
+                data = self._filter_length(data)
+            with self.metrics.timer('db_dedup'):
+                data = self.filter(data)
+        else:
+            logger.info("CDX response is empty.")
+
+        with self.metrics.timer('select'):
+            data = self._selector.select(data, stream=stream, final=final)
+        self.metrics.inc('cdx/rows_selected', data.n_rows)
+        yield from self._request_selected(data)
+
+    def _request_selected(self, data: WaybackMachineResponseCDX):
+        if data.n_rows == 0:
+            return
+
+        snapshots_iter = SnapshotUrlIterator(data)
+        url_dates = [None if pd.isna(url_date) else url_date.to_pydatetime()
+                     for url_date in data.column('url_date')]
+        digests: List[Optional[str]] = [None] * data.n_rows
+        if 'digest' in data.columns:
+            digests = [None if pd.isna(digest) else str(digest)
+                       for digest in data.column('digest')]
+        logger.info("Number of urls to process = %d", len(snapshots_iter))
+        if self.mode == 'coordinator':
+            self.publish(zip(snapshots_iter, url_dates, digests))
+        else:
+            for url, url_date, digest in zip(snapshots_iter, url_dates,
+                                             digests):
+                yield self.snapshot_request(url, url_date, digest)
+
+        logger.debug("Counter: %s", self.counter)
+        self.update_cache_stats()
+
+    def cdx_failed(self, failure: Any):
+        """
+        Errback of CDX requests: rows of the stream held back for
+        the page which will not arrive are selected and requested.
+        """
+        request = failure.request
+        logger.error("CDX request '%s' failed: %r", request.url,
+                     failure.value)
+        self.metrics.inc('cdx/failed')
+        data = self._selector.flush(request.cb_kwargs.get('partition'))
+        if data is not None:
+            self.metrics.inc('cdx/rows_selected', data.n_rows)
+            yield from self._request_selected(data)
+
+    def flush_selection(self) -> List[scrapy.Request]:
+        """
+        Snapshot requests of the rows held back for next CDX pages
+        which did not arrive, published in the coordinator mode.
+        """
+        requests: List[scrapy.Request] = []
+        for stream in self._selector.held_streams:
+            data = self._selector.flush(stream)
+            self.metrics.inc('cdx/rows_selected', data.n_rows)
+            requests.extend(self._request_selected(data))
+        return requests
+
+    def cdx_idle(self, spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """Request held back rows before the spider closes."""
+        requests = self.flush_selection()
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests:
+            raise DontCloseSpider
+
+    def publish(self,
+                snapshots: Iterable[Tuple[str, Optional[datetime],
+                                          Optional[str]]]):
+        """
+        Publish snapshot URLs with article dates and CDX digests
+        to the work queue.
+        """
+        units = [{'key': url,
+                  'url': url,
+                  'url_date': None if url_date is None
+                  else url_date.isoformat(),
+                  'digest': digest}
+                 for url, url_date, digest in snapshots]
+        n_published = self._queue.publish(units)
+        self.metrics.inc('queue/published', n_published)
+        logger.info("Published %d of %d snapshots", n_published, len(units))
+
+    def lease_requests(self) -> List[scrapy.Request]:
+        """Snapshot requests of units leased from the work queue."""
+        batch = self.special_settings().get('queue', {}).get('batch', 100)
+        units = self._queue.lease(self.worker_id, batch)
+        self.metrics.inc('queue/leased', len(units))
+        requests = []
+        for unit in units:
+            url_date = unit.payload.get('url_date')
+            requests.append(self.snapshot_request(
+                unit.payload['url'],
+                None if url_date is None else datetime.fromisoformat(url_date),
+                unit.payload.get('digest'),
+                meta={'work_unit': unit.id}))
+        return requests
+
+    def snapshot_request(self,
+                         url: str,
+                         url_date: Optional[datetime] = None,
+                         digest: Optional[str] = None,
+                         meta: Optional[Dict[str, Any]] = None) \
+            -> scrapy.Request:
+        """
+        Snapshot request with the download size cap of the guards,
+        requests of work units are not filtered as duplicates.
+        """
+        meta = dict(meta or {})
+        errback = None
+        if self._guards.get('max_bytes'):
+            meta['download_maxsize'] = self._guards['max_bytes']
+            errback = self.snapshot_failed
+        if 'work_unit' in meta:
+            errback = self.snapshot_failed
+        return scrapy.Request(url,
+                              self.parse,
+                              errback=errback,
+                              dont_filter='work_unit' in meta,
+                              meta=meta,
+                              cb_kwargs={'url_date': url_date,
+                                         'digest': digest})
+
+    def snapshot_failed(self, failure: Any):
+        """
+        Errback of snapshot requests: pages over the size cap are
+        recorded and their units acknowledged, units of other failures
+        return to the queue.
+        """
+        request = failure.request
+        if request.meta.get('download_maxsize') and is_cancelled(failure):
+            self.record_skip(request.url, 'download_size',
+                             max_bytes=request.meta['download_maxsize'])
+            if 'work_unit' in request.meta:
+                self._queue.ack(request.meta['work_unit'])
+                self.metrics.inc('queue/acked')
+            return
+        if 'work_unit' in request.meta:
+            self.work_unit_failed(failure)
+            return
+        logger.error("Snapshot '%s' failed: %r", request.url, failure.value)
+
+    def spider_idle(self, spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """
+        Lease more units, keep waiting while the coordinator publishes
+        or other workers hold leases, which may expire.
+        """
+        requests = self.lease_requests()
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests or not self._queue.is_drained():
+            raise DontCloseSpider
+
+    def work_unit_processed(self, response: scrapy.http.Response, **_kwargs):
+        """Acknowledge unit of the response."""
+        unit_id = response.meta.get('work_unit')
+        if unit_id is not None:
+            self._queue.ack(unit_id)
+            self.metrics.inc('queue/acked')
+
+    def work_unit_error(self,
+                        failure: Any,
+                        response: scrapy.http.Response,
+                        **_kwargs):
+        """
+        Return unit of the response to the queue, fail it without retry
+        on extraction errors.
+        """
+        unit_id = response.meta.get('work_unit')
+        if unit_id is not None:
+            retry = not isinstance(failure.value, self.EXTRACTION_ERRORS)
+            self._queue.fail(unit_id, repr(failure.value), retry=retry)
+            self.metrics.inc('queue/failed')
+            if not retry:
+                self.metrics.inc('queue/rejected')
+
+    def work_unit_failed(self, failure: Any):
+        """Errback of leased snapshot requests."""
+        self._queue.fail(failure.request.meta['work_unit'],
+                         repr(failure.value))
+        self.metrics.inc('queue/failed')
+        logger.warning("Snapshot '%s' failed: %r",
+                       failure.request.url, failure.value)
+
+    def _observe_download(self,
+                          stage: str,
+                          size_name: str,
+                          response: scrapy.http.Response):
+        latency = response.meta.get('download_latency')
+        if latency is not None:
+            self.metrics.observe(stage, latency)
+        self.metrics.observe_size(size_name, len(response.body))
+
+    def _count(self, key: str):
+        self.counter[key] += 1
+        self.metrics.inc(f'snapshots/{key}')
+
+    def cache_info(self) -> Dict[str, Any]:
+        """Statistics of the caches used by the spider."""
+        return {'filter_url': self._filter.url_cache_info()}
+
+    def update_cache_stats(self):
+        """Write cache statistics to the crawler stats."""
+        crawler = getattr(self, 'crawler', None)
+        if crawler is None or crawler.stats is None:
+            return
+        for name, info in self.cache_info().items():
+            crawler.stats.set_value(f'cache/{name}/hits', info.hits)
+            crawler.stats.set_value(f'cache/{name}/misses', info.misses)
+            crawler.stats.set_value(f'cache/{name}/size', info.currsize)
+
+    def closed(self, reason: str):
+        """Called when the spider closes."""
+        # Held back rows are left when the spider closes before idle,
+        # the coordinator still publishes them.
+        requests = self.flush_selection()
+        if requests:
+            logger.warning("%d held back snapshots were not requested",
+                           len(requests))
+        self.update_cache_stats()
+        if self._db is not None:
+            self._db.close()
+        if self._extraction_cache is not None:
+            self._extraction_cache.close()
+        if self._skip_log is not None:
+            self._skip_log.close()
+        if self._queue is not None:
+            if self.mode == 'coordinator' and reason == 'finished':
+                self._queue.set_closed(True)
+            logger.info("Work queue: %s", self._queue.counts())
+            self._queue.close()
+            if self._queue_address is not None:
+                release_client(*self._queue_address)
+        if self._profiler is not None:
+            directory = self.special_settings()['profile'].get(
+                'directory',
+                os.path.join(self.output_directory, 'profiles', self.name))
+            self._profiler.dump(os.path.expanduser(directory))
+        logger.info("Spider '%s' closed (%s). Caches: %s",
+                    self.name, reason, self.cache_info())
+        self.close_log_file()
+
     @abc.abstractmethod
-    def get_extractor(self, soup: BeautifulSoup, url: str) -> BaseExtractor:
+    def get_extractor(self,
+                      soup: BeautifulSoup,
+                      url: str,
+                      url_date: Optional[datetime] = None) -> BaseExtractor:
         """Parse snapshot"""
 
+    def get_extractor_class(self, url: str) -> Optional[Type[BaseExtractor]]:  # pylint: disable=unused-argument
+        """
+        Extractor class doing the work for the URL, its name and version
+        key cached extraction results. None disables the cache.
+        """
+        return None
+
+    def extractor_classes(self) -> List[Type[BaseExtractor]]:
+        """Extractor classes of the spider, stale cache entries are removed."""
+        return []
+
     def parse(self, response, *args, **kwargs):  # pylint: disable=unused-argument
         """Parse snapshot"""
+        if self._profiler is not None:
+            item = self._profiler.call('parse',
+                                       self._parse_snapshot,
+                                       response,
+                                       **kwargs)
+        else:
+            item = self._parse_snapshot(response, **kwargs)
+        if item is None and self._queue is not None:
+            # Units with items are acknowledged after the pipelines.
+            self.work_unit_processed(response)
+        return item
 
-        self.counter['parse'] += 1
+    def extract_fields(self,
+                       response: scrapy.http.TextResponse,
+                       url: str,
+                       url_date: Optional[datetime] = None) \
+            -> Tuple[ExtractedFields, Optional[datetime]]:
+        """Parse the page and extract fields and article date."""
+        with self.metrics.timer('html_parse'):
+            soup = BeautifulSoup(response.text, features="lxml")
+
+        with self.metrics.timer('extract/preprocess'):
+            extractor = self.get_extractor(soup, url, url_date)
+
+        logger.debug("Processing... '%s'", url)
+
+        fields = ExtractedFields(
+            text=self.metrics.timed('extract/text', extractor.get_text),
+            title=self.metrics.timed('extract/title', extractor.get_title),
+            summary=self.metrics.timed('extract/summary',
+                                       extractor.get_summary),
+            title_date='')
+        if len(fields.text) > 0 and len(fields.title) > 0:
+            url_date = self.metrics.timed('extract/datetime',
+                                          extractor.get_datetime)
+            fields = fields._replace(title_date=self.metrics.timed(
+                'extract/header_datetime', extractor.get_header_datetime))
+        return fields, url_date
+
+    def cached_fields(self,
+                      response: scrapy.http.TextResponse,
+                      url: str,
+                      url_date: Optional[datetime] = None,
+                      digest: Optional[str] = None) \
+            -> Tuple[ExtractedFields, Optional[datetime]]:
+        """
+        Extracted fields from the cache or the page. Cached results
+        skip parsing, the article date comes from the URL then.
+        """
+        extractor_class = None
+        if self._extraction_cache is not None:
+            extractor_class = self.get_extractor_class(url)  # pylint: disable=assignment-from-none
+        if extractor_class is None:
+            return self.extract_fields(response, url, url_date)
+
+        digest = digest or body_digest(response.body)
+        with self.metrics.timer('extract/cache'):
+            fields = self._extraction_cache.get(digest, extractor_class)
+        if fields is not None:
+            self.metrics.inc('extract/cache_hits')
+            return fields, url_date
+
+        self.metrics.inc('extract/cache_misses')
+        fields, url_date = self.extract_fields(response, url, url_date)
+        self._extraction_cache.put(digest, extractor_class, fields)
+        return fields, url_date
+
+    def _parse_snapshot(self,
+                        response: scrapy.http.TextResponse,
+                        url_date: Optional[datetime] = None,
+                        digest: Optional[str] = None):
+
+        self._count('parse')
+        self._observe_download('snapshot_download', 'snapshot', response)
 
-        soup = BeautifulSoup(response.text, features="lxml")
         url_pars = WaybackMachineResponseCDX.from_archive_url(response.url)
         url_original = url_pars['original']
 
-        extractor = self.get_extractor(soup, url_original)
-
-        logger.debug("Processing... '%s'", url_original)
-
-        text = extractor.get_text()
-        title = extractor.get_title()
-        summary = extractor.get_summary()
+        try:
+            with time_budget(self._guards.get('parse_seconds')):
+                fields, url_datetime = self.cached_fields(
+                    response, url_original, url_date, digest)
+        except ParseTimeout:
+            self.record_skip(response.url, 'parse_time',
+                             seconds=self._guards['parse_seconds'],
+                             size=len(response.body))
+            self._count('failed')
+            return None
+        text, title = fields.text, fields.title
 
         if len(text) > 0 and len(title) == 0:
             logger.error("Title length is zero for url '%s'. Text length = %d",
                          response.url, len(text))
-            self.counter['failed'] += 1
+            self._count('failed')
             raise ValueError(
                 f"Title length is zero. Text length = {len(text)}")
 
         if len(text) > 0:
 
-            url_datetime = extractor.get_datetime()
-            if url_datetime is not None:
-                url_date = url_datetime.isoformat()
-            else:
-                url_date = ''
-            title_date = extractor.get_header_datetime()
+            url_date = '' if url_datetime is None else url_datetime.isoformat()
 
             logger.debug("stat: text = %d, title = %d, "
                          "title_date = %d, url_date = %d",
-                         len(text), len(title), len(title_date), len(url_date))
+                         len(text), len(title), len(fields.title_date),
+                         len(url_date))
 
             item = WaybackMachineGeneralArticleItem(
                 text=text,
                 title=title,
-                summary=summary,
+                summary=fields.summary,
                 publish_date='',
-                title_date=title_date,
+                title_date=fields.title_date,
                 url_date=url_date,
                 url=response.url,
                 timestamp=url_pars['timestamp'],
@@ -266,7 +926,7 @@ class SpiderWaybackMachineBase(scrapy.Spider, metaclass=abc.ABCMeta):
                 snapshot=response.text,
                 path="?"
             )
-            self.counter['success'] += 1
+            self._count('success')
         else:
             if title:
                 logger.warning(
@@ -275,7 +935,7 @@ class SpiderWaybackMachineBase(scrapy.Spider, metaclass=abc.ABCMeta):
                     title, response.url)
             logger.info("No text found: '%s'", response.url)
             item = None
-            self.counter['failed'] += 1
+            self._count('failed')
 
         logger.debug("End processing.")
         return item
@@ -287,6 +947,8 @@ class SnapshotUrlIterator:
     def __init__(self, cdx_data: WaybackMachineResponseCDX):
 
         self._data = cdx_data
+        self._timestamps = cdx_data.column('timestamp').tolist()
+        self._originals = cdx_data.column('original').tolist()
         self._index = 0
 
     def __iter__(self):
@@ -298,10 +960,8 @@ class SnapshotUrlIterator:
     def __next__(self):
 
         if self._index < len(self):
-            row = self._data.data.iloc[self._index]
-            snapshot = row.to_dict()
-
-            url = self._data.snapshot_to_archive_url(snapshot)
+            url = self._data.to_archive_url(self._originals[self._index],
+                                            self._timestamps[self._index])
             self._index += 1
         else:
             raise StopIteration
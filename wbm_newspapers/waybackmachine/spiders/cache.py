@@ -0,0 +1,152 @@
+"""Local cache of CDX responses stored as Parquet partitions."""
+import glob
+import logging
+import os
+import re
+import shutil
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from wbm_newspapers.waybackmachine.spiders.response import \
+    WaybackMachineResponseCDX
+
+logger = logging.getLogger(__name__)
+
+Partition = Tuple[datetime, datetime]
+
+
+class CdxCache:
+    """
+    CDX pages cache keyed by domain and time range.
+
+    Every time range (partition) is a directory with one Parquet file
+    per fetched CDX page. Partition is complete and can be served
+    from the cache when all its pages were fetched and it lies
+    entirely in the past.
+    """
+
+    DEFAULT_FROM_DT = datetime(1996, 1, 1)
+    TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+    SUCCESS_FILE = "_SUCCESS"
+
+    def __init__(self,
+                 directory: str,
+                 domain: str,
+                 match_type: Optional[str] = None,
+                 partition: str = 'MS',
+                 variant: str = ''):
+        """
+        Parameters
+        ----------
+        directory : str
+            Cache root directory.
+        domain : str
+            CDX url (domain) the cache is built for.
+        match_type : Optional[str], optional
+            CDX match type, by default None.
+        partition : str, optional
+            Pandas frequency alias of time partitions, by default 'MS'
+            (month start).
+        variant : str, optional
+            Name of the CDX query variant, by default ''.
+        """
+        query = match_type or 'exact'
+        if variant:
+            query = f"{query}-{variant}"
+        self._root = os.path.join(os.path.expanduser(directory),
+                                  self._escape(domain),
+                                  self._escape(query))
+        self._freq = partition
+
+    @property
+    def root(self) -> str:
+        """Cache directory for the domain."""
+        return self._root
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return re.sub(r'[^A-Za-z0-9._-]+', '_', value)
+
+    def partitions(self,
+                   from_dt: Optional[datetime] = None,
+                   to_dt: Optional[datetime] = None) -> List[Partition]:
+        """Split time range into partitions."""
+
+        if from_dt is None:
+            from_dt = self.DEFAULT_FROM_DT
+        if to_dt is None:
+            to_dt = datetime.now().replace(microsecond=0)
+
+        starts = [from_dt] + [
+            start.to_pydatetime()
+            for start in pd.date_range(from_dt, to_dt, freq=self._freq)
+            if from_dt < start <= to_dt
+        ]
+        ends = [start - timedelta(seconds=1) for start in starts[1:]]
+        ends.append(to_dt)
+
+        return list(zip(starts, ends))
+
+    def partition_dir(self, partition: Partition) -> str:
+        """Directory of the partition."""
+        start, end = partition
+        name = (f"{start.strftime(self.TIMESTAMP_FORMAT)}"
+                f"-{end.strftime(self.TIMESTAMP_FORMAT)}")
+        return os.path.join(self.root, name)
+
+    def is_complete(self, partition: Partition) -> bool:
+        """Check all partition pages are in the cache."""
+        success = os.path.join(self.partition_dir(partition),
+                               self.SUCCESS_FILE)
+        return os.path.exists(success)
+
+    def write_page(self,
+                   partition: Partition,
+                   page: int,
+                   data: WaybackMachineResponseCDX):
+        """Write CDX page into the partition."""
+
+        path = self.partition_dir(partition)
+        if page == 0 and os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+
+        filename = os.path.join(path, f"page-{page:05d}.parquet")
+        data.data.reset_index(drop=True).to_parquet(filename, index=False)
+        logger.debug("CDX page %d with %d rows cached: '%s'",
+                     page, data.n_rows, filename)
+
+    def mark_complete(self, partition: Partition):
+        """Mark partition as complete if it can not change anymore."""
+
+        _, end = partition
+        if end >= datetime.now():
+            logger.info("Partition '%s' is not finished yet and "
+                        "will be refreshed next time.",
+                        self.partition_dir(partition))
+            return
+
+        success = os.path.join(self.partition_dir(partition),
+                               self.SUCCESS_FILE)
+        with open(success, 'w', encoding='utf-8'):
+            pass
+
+    def load(self, partition: Partition) -> WaybackMachineResponseCDX:
+        """Load all cached pages of the partition."""
+
+        files = sorted(glob.glob(os.path.join(self.partition_dir(partition),
+                                              "page-*.parquet")))
+        frames = [pd.read_parquet(filename) for filename in files]
+        frames = [frame for frame in frames if len(frame.columns) > 0]
+
+        if len(frames) == 0:
+            data = pd.DataFrame()
+        else:
+            data = pd.concat(frames, ignore_index=True)
+
+        logger.info("CDX partition '%s' loaded from cache: %d rows.",
+                    self.partition_dir(partition), len(data.index))
+        return WaybackMachineResponseCDX(
+            WaybackMachineResponseCDX.compact(data))
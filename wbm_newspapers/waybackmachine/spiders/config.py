@@ -0,0 +1,180 @@
+"""
+Spider settings files.
+
+Only standard library and YAML are imported here, so settings can be
+checked without loading the crawling stack.
+"""
+import re
+from datetime import datetime
+from typing import Any, Dict, List
+
+import yaml
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+DB_HOST = 'mongodb://localhost'
+DB_NAME = 'anynews_wbm'
+
+SELECT_POLICIES = ('all', 'earliest', 'latest', 'closest')
+
+MATCH_TYPES = ('exact', 'prefix', 'host', 'domain')
+
+FILTER_KEYS = ('include_url', 'exclude_url', 'exclude_statuscodes',
+               'include_mimetypes', 'url_cache_size')
+
+SECTIONS = ('cdx', 'filter', 'filter_original', 'enable_mongodb', 'db',
+            'cdx_cache', 'select', 'article_date', 'profile', 'queue',
+            'storage', 'extraction_cache', 'guards', 'discovery')
+
+QUEUE_BACKENDS = ('sqlite', 'mongodb')
+
+STORAGE_BACKENDS = ('mongodb', 'sqlite')
+
+
+def read_settings_file(path: str) -> Dict[str, Any]:
+    """Read YAML file with spider settings."""
+    with open(path, 'r', encoding='utf-8') as stream:
+        return yaml.safe_load(stream)
+
+
+def _check_datetime(errors: List[str], section: Dict, key: str, name: str):
+    if key not in section:
+        return
+    try:
+        datetime.strptime(str(section[key]), DATETIME_FORMAT)
+    except ValueError:
+        errors.append(f"{name}.{key}: '{section[key]}' does not match "
+                      f"'{DATETIME_FORMAT}'")
+
+
+def _check_patterns(errors: List[str], patterns: Any, name: str):
+    if patterns is None:
+        return
+    if not isinstance(patterns, list):
+        errors.append(f"{name}: list of regular expressions expected")
+        return
+    for pattern in patterns:
+        try:
+            re.compile(pattern)
+        except (re.error, TypeError) as error:
+            errors.append(f"{name}: invalid pattern '{pattern}': {error}")
+
+
+def _check_mapping(errors: List[str], data: Dict, key: str) -> Dict:
+    value = data.get(key)
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        errors.append(f"{key}: mapping expected")
+        return {}
+    return value
+
+
+def _check_queue(errors: List[str], queue: Dict):
+    if queue.get('backend', 'sqlite') not in QUEUE_BACKENDS:
+        errors.append(f"queue.backend: one of {', '.join(QUEUE_BACKENDS)} "
+                      "expected")
+    for key in ['lease_seconds', 'batch', 'max_attempts']:
+        if key in queue and (not isinstance(queue[key], (int, float))
+                             or queue[key] <= 0):
+            errors.append(f"queue.{key}: positive number expected")
+
+
+def _check_storage(errors: List[str], storage: Dict):
+    if storage.get('backend', 'mongodb') not in STORAGE_BACKENDS:
+        errors.append("storage.backend: one of "
+                      f"{', '.join(STORAGE_BACKENDS)} expected")
+    if 'batch_size' in storage and (not isinstance(storage['batch_size'], int)
+                                    or storage['batch_size'] < 1):
+        errors.append("storage.batch_size: positive integer expected")
+
+
+def _check_guards(errors: List[str], guards: Dict):
+    if 'max_bytes' in guards and (not isinstance(guards['max_bytes'], int)
+                                  or guards['max_bytes'] < 1):
+        errors.append("guards.max_bytes: positive integer expected")
+    if 'parse_seconds' in guards and (
+            not isinstance(guards['parse_seconds'], (int, float))
+            or guards['parse_seconds'] <= 0):
+        errors.append("guards.parse_seconds: positive number expected")
+
+
+def _check_discovery(errors: List[str], discovery: Dict, cdx: Dict):
+    if not discovery:
+        return
+    pages = discovery.get('pages')
+    if not isinstance(pages, list) or not pages:
+        errors.append("discovery.pages: list of page URLs expected")
+    for key in ['from_dt', 'to_dt']:
+        _check_datetime(errors, discovery, key, 'discovery')
+    if 'from_dt' not in discovery and 'from_dt' not in cdx:
+        errors.append("discovery.from_dt: is required without cdx.from_dt")
+    for key in ['allow', 'deny']:
+        _check_patterns(errors, discovery.get(key), f'discovery.{key}')
+
+
+def validate_settings(data: Any) -> List[str]:
+    """
+    Check spider settings.
+
+    Parameters
+    ----------
+    data : Any
+        Parsed settings file.
+
+    Returns
+    -------
+    List[str]
+        Problems found, empty if the settings are valid.
+    """
+    if not isinstance(data, dict):
+        return ["settings: mapping expected"]
+
+    errors = [f"{key}: unknown section" for key in data
+              if key not in SECTIONS]
+
+    if 'cdx' not in data:
+        errors.append("cdx: section is required")
+    cdx = _check_mapping(errors, data, 'cdx')
+    if cdx and not cdx.get('url'):
+        errors.append("cdx.url: is required")
+    for key in ['from_dt', 'to_dt']:
+        _check_datetime(errors, cdx, key, 'cdx')
+    if 'limits' in cdx and (not isinstance(cdx['limits'], int)
+                            or cdx['limits'] <= 0):
+        errors.append("cdx.limits: positive integer expected")
+    if cdx.get('match_type', 'exact') not in MATCH_TYPES:
+        errors.append(f"cdx.match_type: one of {', '.join(MATCH_TYPES)} "
+                      "expected")
+
+    if 'filter' not in data:
+        errors.append("filter: section is required")
+    filters = _check_mapping(errors, data, 'filter')
+    errors.extend(f"filter.{key}: unknown option" for key in filters
+                  if key not in FILTER_KEYS)
+    for key in ['include_url', 'exclude_url']:
+        _check_patterns(errors, filters.get(key), f'filter.{key}')
+
+    select = _check_mapping(errors, data, 'select')
+    if select.get('policy', 'all') not in SELECT_POLICIES:
+        errors.append(f"select.policy: one of {', '.join(SELECT_POLICIES)} "
+                      "expected")
+
+    article_date = _check_mapping(errors, data, 'article_date')
+    for key in ['from_dt', 'to_dt']:
+        _check_datetime(errors, article_date, key, 'article_date')
+
+    profile = _check_mapping(errors, data, 'profile')
+    if 'every' in profile and (not isinstance(profile['every'], int)
+                               or profile['every'] < 1):
+        errors.append("profile.every: positive integer expected")
+
+    _check_queue(errors, _check_mapping(errors, data, 'queue'))
+    _check_storage(errors, _check_mapping(errors, data, 'storage'))
+    _check_guards(errors, _check_mapping(errors, data, 'guards'))
+    _check_discovery(errors, _check_mapping(errors, data, 'discovery'), cdx)
+
+    for key in ['db', 'cdx_cache', 'extraction_cache']:
+        _check_mapping(errors, data, key)
+
+    return errors
@@ -1,8 +1,55 @@
 """Database interface for spiders."""
-from wbm_snapshot.db.client import DbClient, SnapshotCollectionClient
+import logging
+import threading
+from typing import TYPE_CHECKING, Dict, Tuple
 
 from wbm_newspapers.waybackmachine.spiders.response import \
     WaybackMachineResponseCDX
+from wbm_newspapers.waybackmachine.spiders.schema import (
+    ensure_indexes, install_query_monitor)
+
+if TYPE_CHECKING:
+    from wbm_snapshot.db.client import DbClient, SnapshotCollectionClient
+
+logger = logging.getLogger(__name__)
+
+_clients: Dict[Tuple[str, str], 'DbClient'] = {}
+_client_refs: Dict[Tuple[str, str], int] = {}
+_clients_lock = threading.Lock()
+
+
+def acquire_client(host: str, database: str) -> 'DbClient':
+    """
+    MongoDB client shared by spiders and pipelines of the process.
+
+    One client keeps one connection pool, so crawlers running in the
+    same process do not open a pool each. Every call must be paired
+    with `release_client`.
+    """
+    from wbm_snapshot.db.client import DbClient  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    key = (host, database)
+    with _clients_lock:
+        if key not in _clients:
+            install_query_monitor()
+            _clients[key] = DbClient(connection=host, database=database)
+            _client_refs[key] = 0
+            logger.info("MongoDB client for '%s/%s' created", host, database)
+        _client_refs[key] += 1
+        return _clients[key]
+
+
+def release_client(host: str, database: str):
+    """Release shared client, the last release closes it."""
+    key = (host, database)
+    with _clients_lock:
+        if key not in _clients:
+            return
+        _client_refs[key] -= 1
+        if _client_refs[key] <= 0:
+            _clients.pop(key).client.close()
+            _client_refs.pop(key)
+            logger.info("MongoDB client for '%s/%s' closed", host, database)
 
 
 class SpiderDatabase:
@@ -11,7 +58,8 @@ class SpiderDatabase:
     def __init__(self,
                  name: str,
                  host: str = 'mongodb://localhost',
-                 database: str = 'anynews_wbm'):
+                 database: str = 'anynews_wbm',
+                 indexes: bool = True):
         """
         Parameters
         ----------
@@ -21,29 +69,37 @@ class SpiderDatabase:
             MongoDB host string, by default 'mongodb://localhost'.
         database : str, optional
             MongoDB database name, by default 'anynews_wbm'.
+        indexes : bool, optional
+            Create and verify indexes of the collection, by default True.
         """
-        self._client = DbClient(connection=host,
-                                database=database)
+        from wbm_snapshot.db.client import SnapshotCollectionClient  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+        self._address = (host, database)
+        self._client = acquire_client(host, database)
         self._collection = SnapshotCollectionClient(self.client, name)
+        if indexes:
+            ensure_indexes(self.client.db[name])
 
     @property
-    def client(self) -> DbClient:
+    def client(self) -> 'DbClient':
         """Client object."""
         return self._client
 
     @property
-    def collection(self) -> SnapshotCollectionClient:
+    def collection(self) -> 'SnapshotCollectionClient':
         """Collection object."""
         return self._collection
 
+    def close(self):
+        """Release database client."""
+        release_client(*self._address)
+
     def filter(self,
                data: WaybackMachineResponseCDX) -> WaybackMachineResponseCDX:
         """Filter urls."""
 
         if self.collection is not None:
-            data = data.filter(
-                lambda row: self._filter_original(row['original'])
-            )
+            data = data.filter_values('original', self._filter_original)
         return data
 
     def _filter_original(self, original: str) -> bool:
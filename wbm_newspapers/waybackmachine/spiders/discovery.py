@@ -0,0 +1,124 @@
+"""
+Front page link discovery.
+
+Prefix CDX queries enumerate every asset and page of a site. Discovery
+requests captures of front and section pages at a time step instead,
+Wayback Machine redirects `web/<timestamp>/<page>` to the nearest
+capture. Article links of the page are requested the same way at the
+capture time, so every article is fetched at its capture nearest to the
+time it was on the front page.
+"""
+import logging
+import re
+from datetime import datetime
+from typing import Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import pandas as pd
+import scrapy
+from scrapy.linkextractors import LinkExtractor
+
+from wbm_newspapers.waybackmachine.spiders.response import \
+    WaybackMachineResponseCDX
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+
+# Links of archived pages are rewritten to archive URLs.
+ARCHIVE_PREFIX = re.compile(r'^https?://web\.archive\.org/web/(\d{1,14})'
+                            r'[a-z_]*/')
+
+CDX_HEADER = ['timestamp', 'original', 'statuscode', 'mimetype']
+
+
+def original_url(url: str) -> str:
+    """Original URL of an archive URL, other URLs are not changed."""
+    return ARCHIVE_PREFIX.sub('', url, count=1)
+
+
+def capture_timestamp(url: str) -> Optional[str]:
+    """Timestamp of an archive URL."""
+    match = ARCHIVE_PREFIX.match(url)
+    return None if match is None else match.group(1)
+
+
+def _host(url: str) -> str:
+    host = urlsplit(url).netloc.split(':')[0].lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class FrontPageDiscovery:
+    """Article links of front page captures at a time step."""
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 pages: List[str],
+                 from_dt: datetime,
+                 to_dt: Optional[datetime] = None,
+                 every: str = '1D',
+                 *,
+                 allow: Optional[List[str]] = None,
+                 deny: Optional[List[str]] = None):
+        """
+        Parameters
+        ----------
+        pages : List[str]
+            Front and section page URLs.
+        from_dt : datetime
+            First capture time.
+        to_dt : Optional[datetime], optional
+            Last capture time, by default now.
+        every : str, optional
+            Time step, pandas frequency alias, by default '1D'.
+        allow : Optional[List[str]], optional
+            Regular expressions of article links, by default all links
+            of the page site.
+        deny : Optional[List[str]], optional
+            Regular expressions of excluded links, by default None.
+        """
+        self.pages = pages
+        self.times = pd.date_range(from_dt, to_dt or datetime.now(),
+                                   freq=every)
+        self._extractor = LinkExtractor(allow=allow or (), deny=deny or ())
+        self._seen: Set[str] = set()
+
+    @property
+    def n_discovered(self) -> int:
+        """Number of discovered article URLs."""
+        return len(self._seen)
+
+    def captures(self) -> Iterator[Tuple[str, str]]:
+        """Pages and capture timestamps, one time step after another."""
+        for time in self.times:
+            timestamp = time.strftime(TIMESTAMP_FORMAT)
+            for page in self.pages:
+                yield page, timestamp
+
+    def links(self,
+              response: scrapy.http.TextResponse,
+              page: str) -> List[str]:
+        """Original URLs of new article links of the page site."""
+        host = _host(page)
+        links = []
+        for link in self._extractor.extract_links(response):
+            url = original_url(link.url).split('#', 1)[0]
+            if _host(url) != host or url in self._seen:
+                continue
+            self._seen.add(url)
+            links.append(url)
+        return links
+
+    def to_cdx(self,
+               response: scrapy.http.TextResponse,
+               page: str,
+               timestamp: str) -> WaybackMachineResponseCDX:
+        """
+        New article links as CDX rows with the capture timestamp of the
+        page, requested snapshots are redirected to nearest captures.
+        """
+        timestamp = capture_timestamp(response.url) or timestamp
+        rows = [[timestamp, url, '200', 'text/html']
+                for url in self.links(response, page)]
+        logger.debug("Front page '%s' at %s: %d new links",
+                     page, timestamp, len(rows))
+        return WaybackMachineResponseCDX.from_list([CDX_HEADER] + rows)
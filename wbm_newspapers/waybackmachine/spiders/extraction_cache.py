@@ -0,0 +1,119 @@
+"""
+Cache of extraction results.
+
+Extracted fields of a snapshot are stored by the content digest (CDX
+digest of the capture or a hash of the body), extractor class and
+extractor version. Identical pages of several captures and repeated
+crawls are not parsed again, a new extractor version does not see
+results of older ones.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Iterable, NamedTuple, Optional, Type
+
+from wbm_newspapers.extraction.extraction import BaseExtractor
+from wbm_newspapers.sqlite import connect
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractedFields(NamedTuple):
+    """Fields extracted from the page, article date comes from the URL."""
+
+    text: str
+    title: str
+    summary: str
+    title_date: str
+
+
+def body_digest(body: bytes) -> str:
+    """Digest of a page without CDX digest."""
+    return 'sha1:' + hashlib.sha1(body).hexdigest()
+
+
+def extractor_name(extractor_class: Type[BaseExtractor]) -> str:
+    """Qualified class name."""
+    return f"{extractor_class.__module__}.{extractor_class.__qualname__}"
+
+
+class ExtractionCache:
+    """Extracted fields in a SQLite file."""
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            Database file, shared by processes of the spider.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            "digest TEXT NOT NULL, extractor TEXT NOT NULL, "
+            "version INTEGER NOT NULL, fields TEXT NOT NULL, "
+            "PRIMARY KEY (digest, extractor, version)) WITHOUT ROWID")
+
+    def get(self,
+            digest: str,
+            extractor_class: Type[BaseExtractor]) -> Optional[ExtractedFields]:
+        """Cached fields of the current extractor version."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fields FROM extractions WHERE digest = ? "
+                "AND extractor = ? AND version = ?",
+                (digest, extractor_name(extractor_class),
+                 extractor_class.version)).fetchone()
+        if row is None:
+            return None
+        return ExtractedFields(*json.loads(row[0]))
+
+    def put(self,
+            digest: str,
+            extractor_class: Type[BaseExtractor],
+            fields: ExtractedFields):
+        """Store fields, written at once to be seen by other processes."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO extractions "
+                "(digest, extractor, version, fields) VALUES (?, ?, ?, ?)",
+                (digest, extractor_name(extractor_class),
+                 extractor_class.version,
+                 json.dumps(list(fields), ensure_ascii=False)))
+
+    def discard_stale(self,
+                      extractor_classes: Iterable[Type[BaseExtractor]]) \
+            -> int:
+        """
+        Remove entries of other versions of the extractors, entries of
+        other extractors are kept.
+
+        Returns
+        -------
+        int
+            Number of removed entries.
+        """
+        n_removed = 0
+        with self._lock:
+            for extractor_class in extractor_classes:
+                n_removed += self._connection.execute(
+                    "DELETE FROM extractions "
+                    "WHERE extractor = ? AND version != ?",
+                    (extractor_name(extractor_class),
+                     extractor_class.version)).rowcount
+        if n_removed:
+            logger.info("%d stale extraction results removed from '%s'",
+                        n_removed, self.path)
+        return n_removed
+
+    def close(self):
+        """Close the file."""
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,102 @@
+"""URL, statuscode and mimetype filter of CDX rows."""
+import functools
+import re
+from typing import Any, List, Optional, Pattern
+
+
+class DefaultFilter:
+    """Filter."""
+
+    def __init__(self,
+                 include_url: Optional[List[str]] = None,
+                 exclude_url: Optional[List[str]] = None,
+                 exclude_statuscodes: Optional[List[str]] = None,
+                 include_mimetypes: Optional[List[str]] = None,
+                 url_cache_size: Optional[int] = 100000):
+        """
+        Parameters
+        ----------
+        include_url : Optional[List[str]], optional
+            URL patterns to include, by default None.
+        exclude_url : Optional[List[str]], optional
+            URL patterns to exclude, by default None.
+        exclude_statuscodes : Optional[List[str]], optional
+            Statuscodes to exclude, by default None meaning ['404'].
+        include_mimetypes : Optional[List[str]], optional
+            Mimetypes to include, by default None meaning all.
+        url_cache_size : Optional[int], optional
+            Number of URL decisions kept in the LRU cache,
+            by default 100000. None means unbounded cache.
+        """
+
+        include_url_ = None
+        exclude_url_ = None
+
+        if include_url is not None:
+            include_url_ = [re.compile(exp) for exp in include_url]
+
+        if exclude_url is not None:
+            exclude_url_ = [re.compile(exp) for exp in exclude_url]
+
+        if exclude_statuscodes is None:
+            exclude_statuscodes = ['404']
+
+        self._exclude_url = exclude_url_
+        self._include_url = include_url_
+
+        self._exclude_statuscodes = exclude_statuscodes
+        self._include_mimetypes = include_mimetypes
+
+        self._filter_url_cached = functools.lru_cache(
+            maxsize=url_cache_size)(self._filter_url)
+
+    @staticmethod
+    def _is_in_list(value: str, exp_list: List[Pattern]) -> bool:
+        result = any(exp.fullmatch(value) is not None for exp in exp_list)
+        return result
+
+    def filter_statuscode(self, statuscode: str) -> bool:
+        """Filter statuscodes"""
+        return statuscode not in self._exclude_statuscodes
+
+    def filter_url(self, url: str) -> bool:
+        """"Filter by URL"""
+        return self._filter_url_cached(url)
+
+    def url_cache_info(self) -> Any:
+        """URL decisions cache statistics."""
+        return self._filter_url_cached.cache_info()
+
+    def _filter_url(self, url: str) -> bool:
+        if self._include_url is None or len(self._include_url) == 0:
+            inc = True
+        else:
+            inc = self._is_in_list(url, self._include_url)
+
+        if self._exclude_url is None or len(self._exclude_url) == 0:
+            not_exc = True
+        else:
+            not_exc = not self._is_in_list(url, self._exclude_url)
+
+        return inc and not_exc
+
+    def cdx_filters(self) -> List[str]:
+        """Statuscode and mimetype filters as CDX server parameters."""
+        filters = []
+        if self._exclude_statuscodes:
+            codes = "|".join(re.escape(code)
+                             for code in self._exclude_statuscodes)
+            filters.append(f"filter=!statuscode:({codes})")
+        if self._include_mimetypes is not None:
+            mimetypes = "|".join(re.escape(mimetype)
+                                 for mimetype in self._include_mimetypes)
+            filters.append(f"filter=mimetype:({mimetypes})")
+        return filters
+
+    def filter_mimetype(self, mimetype: str) -> bool:
+        """Mimetypes filtering"""
+        if self._include_mimetypes is None:
+            inc = True
+        else:
+            inc = mimetype in self._include_mimetypes
+        return inc
@@ -1,28 +1,42 @@
 """Meduza site scraping."""
 import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Type
 
 from bs4 import BeautifulSoup
-from scrapy.utils.log import configure_logging
 
-from wbm_newspapers.domains.meduza.extract import MeduzaExtractor
+from wbm_newspapers.domains.meduza.extract import (SECTION_EXTRACTORS,
+                                                   URL_DATE_FORMATS,
+                                                   MeduzaExtractor,
+                                                   get_section_extractor)
 from wbm_newspapers.extraction.extraction import BaseExtractor
 from wbm_newspapers.waybackmachine.spiders.base import SpiderWaybackMachineBase
 
-configure_logging(install_root_handler=False)
-
 logger = logging.getLogger(__name__)
-logger_handler = logging.FileHandler("spider_meduza.log",
-                                     encoding='utf-8',
-                                     mode="w")
-logger_handler.setFormatter(logging.Formatter(
-    "%(name)s:%(levelname)s:%(message)s"))
-logger.addHandler(logger_handler)
 
 
 class SpiderMeduza(SpiderWaybackMachineBase):
     """Spider for meduza.io scraping from WaybackMachine."""
 
     name = "spider_meduza"
+    log_file = "spider_meduza.log"
+
+    url_date_formats = URL_DATE_FORMATS
+
+    def get_extractor(self,
+                      soup: BeautifulSoup,
+                      url: str,
+                      url_date: Optional[datetime] = None) -> BaseExtractor:
+        return MeduzaExtractor(soup, url, url_date)
+
+    def get_extractor_class(self, url: str) -> Optional[Type[BaseExtractor]]:
+        # Section extractor does the work, its version keys the cache.
+        return get_section_extractor(url)
+
+    def extractor_classes(self) -> List[Type[BaseExtractor]]:
+        return [extractor for _, extractor in SECTION_EXTRACTORS]
 
-    def get_extractor(self, soup: BeautifulSoup, url: str) -> BaseExtractor:
-        return MeduzaExtractor(soup, url)
+    def cache_info(self) -> Dict[str, Any]:
+        info = super().cache_info()
+        info['extractor_route'] = get_section_extractor.cache_info()
+        return info
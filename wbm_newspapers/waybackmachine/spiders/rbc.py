@@ -1,22 +1,15 @@
 """Scraper for rbc.ru site from waybackmachine."""
 import logging
+from datetime import datetime
+from typing import List, Optional, Type
 
 from bs4 import BeautifulSoup
-from scrapy.utils.log import configure_logging
 
-from wbm_newspapers.domains.rbc.extract import RbcExtractor
+from wbm_newspapers.domains.rbc.extract import URL_DATE_FORMATS, RbcExtractor
 from wbm_newspapers.extraction.extraction import BaseExtractor
 from wbm_newspapers.waybackmachine.spiders.base import SpiderWaybackMachineBase
 
-configure_logging(install_root_handler=False)
-
 logger = logging.getLogger(__name__)
-logger_handler = logging.FileHandler("spider_rbc.log",
-                                     encoding='utf-8',
-                                     mode="w")
-logger_handler.setFormatter(logging.Formatter(
-    "%(name)s:%(levelname)s:%(message)s"))
-logger.addHandler(logger_handler)
 
 
 class SpiderRBC(SpiderWaybackMachineBase):
@@ -24,6 +17,18 @@ class SpiderRBC(SpiderWaybackMachineBase):
     CONNECTION = 'mongodb://localhost'
     DATABASE = 'anynews_wbm'
     name = "spider_rbc"
+    log_file = "spider_rbc.log"
+
+    url_date_formats = URL_DATE_FORMATS
+
+    def get_extractor(self,
+                      soup: BeautifulSoup,
+                      url: str,
+                      url_date: Optional[datetime] = None) -> BaseExtractor:
+        return RbcExtractor(soup, url, url_date)
+
+    def get_extractor_class(self, url: str) -> Optional[Type[BaseExtractor]]:
+        return RbcExtractor
 
-    def get_extractor(self, soup: BeautifulSoup, url: str) -> BaseExtractor:
-        return RbcExtractor(soup, url)
+    def extractor_classes(self) -> List[Type[BaseExtractor]]:
+        return [RbcExtractor]
@@ -0,0 +1,44 @@
+"""
+Spiders by domain without importing them.
+
+Spider modules pull in pandas, bs4 and the extractors, so commands
+which only need names and settings files use the registry and import
+the spider class on first use.
+"""
+import importlib
+from typing import Dict, NamedTuple
+
+
+class SpiderEntry(NamedTuple):
+    """Registered spider."""
+
+    name: str
+    class_path: str
+    settings_file: str
+
+
+SPIDERS: Dict[str, SpiderEntry] = {
+    'rbc': SpiderEntry(
+        'spider_rbc',
+        'wbm_newspapers.waybackmachine.spiders.rbc.SpiderRBC',
+        'rbc.yaml'),
+    'meduza': SpiderEntry(
+        'spider_meduza',
+        'wbm_newspapers.waybackmachine.spiders.meduza.SpiderMeduza',
+        'meduza.yaml'),
+}
+
+
+def get_entry(domain: str) -> SpiderEntry:
+    """Registered spider of the domain."""
+    try:
+        return SPIDERS[domain]
+    except KeyError as error:
+        raise KeyError(f"Unknown domain '{domain}'. "
+                       f"Available: {', '.join(SPIDERS)}") from error
+
+
+def load_spider(domain: str) -> type:
+    """Import spider class of the domain."""
+    module_name, class_name = get_entry(domain).class_path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
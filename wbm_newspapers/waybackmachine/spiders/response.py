@@ -1,39 +1,121 @@
 """WaybackMachine Response."""
 import json
-from typing import Callable, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
 import pandas as pd
 import parse
 
 
+def _string_dtype() -> Any:
+    """Arrow backed strings if pyarrow is available."""
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return object
+    return pd.StringDtype("pyarrow")
+
+
 class WaybackMachineResponseCDX:
-    """CDX response data."""
+    """
+    CDX response data.
+
+    Rows are stored once in a compact typed frame. Filtering only
+    narrows an array of row positions, so the frame is never copied
+    until `data` is requested.
+    """
 
     url_template = 'https://web.archive.org/web/{timestamp}/{original}'
 
-    def __init__(self, data: pd.DataFrame, resume_key: Optional[str] = None):
-        """Parse response"""
+    default_columns = ('timestamp', 'original', 'statuscode', 'mimetype',
+                       'digest', 'length')
+
+    column_dtypes = {
+        'timestamp': 'int64',
+        'original': _string_dtype(),
+        'statuscode': 'category',
+        'mimetype': 'category',
+        'digest': _string_dtype(),
+        'length': _string_dtype(),
+    }
+
+    def __init__(self,
+                 data: pd.DataFrame,
+                 resume_key: Optional[str] = None,
+                 index: Optional[np.ndarray] = None):
+        """
+        Parameters
+        ----------
+        data : pd.DataFrame
+            CDX rows.
+        resume_key : Optional[str], optional
+            Resume key of the response, by default None.
+        index : Optional[np.ndarray], optional
+            Positions of selected rows in `data`, by default None
+            meaning all rows.
+        """
         self._resume_key = resume_key
         self._data = data
+        self._index = index
+
+    @classmethod
+    def compact(cls,
+                data: pd.DataFrame,
+                columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Drop unused columns and convert the rest to compact types."""
+
+        if columns is None:
+            columns = cls.default_columns
+
+        data = data[[name for name in columns if name in data.columns]]
+
+        dtypes = {name: cls.column_dtypes[name]
+                  for name in data.columns
+                  if name in cls.column_dtypes}
+        return data.astype(dtypes)
 
     @classmethod
-    def from_list(cls, data: List[List[str]]) -> 'WaybackMachineResponseCDX':
+    def from_list(cls,
+                  data: List[List[str]],
+                  columns: Optional[Sequence[str]] = None) \
+            -> 'WaybackMachineResponseCDX':
         """Instantiate class form list of lists data."""
         resume_key: Optional[str] = None
 
-        if len(data[-2]) == 0:
+        if len(data) <= 1:
+            data = pd.DataFrame([], columns=data[0] if data else None)
+        elif len(data[-2]) == 0:
             resume_key = data[-1][0]
             data = pd.DataFrame(data[1:-2], columns=data[0])
         else:
             data = pd.DataFrame(data[1:], columns=data[0])
 
-        return cls(data, resume_key)
+        return cls(cls.compact(data, columns), resume_key)
+
+    @classmethod
+    def concat(cls,
+               responses: Sequence['WaybackMachineResponseCDX']) \
+            -> 'WaybackMachineResponseCDX':
+        """Concatenate selected rows of responses."""
+        frames = [response.data for response in responses
+                  if response.n_rows > 0]
+        if len(frames) == 0:
+            return responses[-1]
+        data = pd.concat(frames, ignore_index=True)
+        # Categories may differ between pages.
+        data = data.astype({name: 'category'
+                            for name, dtype in cls.column_dtypes.items()
+                            if dtype == 'category' and name in data.columns})
+        return cls(data, resume_key=responses[-1].resume_key)
 
     @classmethod
-    def from_text(cls, text) -> 'WaybackMachineResponseCDX':
+    def from_text(cls,
+                  text,
+                  columns: Optional[Sequence[str]] = None) \
+            -> 'WaybackMachineResponseCDX':
         """From text json response."""
         json_data = json.loads(text)
-        return cls.from_list(json_data)
+        return cls.from_list(json_data, columns)
 
     @property
     def resume_key(self) -> Optional[str]:
@@ -42,24 +124,83 @@ class WaybackMachineResponseCDX:
 
     @property
     def data(self) -> pd.DataFrame:
-        """data."""
-        return self._data
+        """Selected rows."""
+        if self._index is None:
+            return self._data
+        return self._data.iloc[self._index]
 
     @property
     def columns(self) -> List[str]:
         """Column names."""
         return self._data.columns
 
+    @property
+    def index(self) -> np.ndarray:
+        """Positions of selected rows."""
+        if self._index is None:
+            return np.arange(len(self._data.index))
+        return self._index
+
     @property
     def n_rows(self):
         """Number of rows in the response."""
-        return len(self.data.index)
+        if self._index is None:
+            return len(self._data.index)
+        return len(self._index)
+
+    def column(self, name: str) -> pd.Series:
+        """Values of the column for the selected rows."""
+        values = self._data[name]
+        if self._index is None:
+            return values
+        return values.iloc[self._index]
+
+    def assign(self,
+               name: str,
+               values: pd.Series) -> 'WaybackMachineResponseCDX':
+        """
+        Add column with values for the selected rows.
+
+        Other rows get missing values.
+        """
+        column = (pd.Series(np.asarray(values), index=self.index)
+                  .reindex(np.arange(len(self._data.index))))
+        return WaybackMachineResponseCDX(
+            self._data.assign(**{name: column.to_numpy()}),
+            resume_key=self.resume_key,
+            index=self._index)
+
+    def mask(self, where: np.ndarray) -> 'WaybackMachineResponseCDX':
+        """Select rows by boolean mask over the selected rows."""
+        return WaybackMachineResponseCDX(self._data,
+                                         resume_key=self.resume_key,
+                                         index=self.index[where])
 
     def filter(self, condition: Callable) -> 'WaybackMachineResponseCDX':
         """Filter by condition."""
-        where = self.data.apply(condition, axis=1)
-        data_new = self.data[where]
-        return WaybackMachineResponseCDX(data_new, resume_key=self.resume_key)
+        if self.n_rows == 0:
+            return self
+        where = self.data.apply(condition, axis=1).to_numpy(dtype=bool)
+        return self.mask(where)
+
+    def filter_values(self,
+                      name: str,
+                      condition: Callable[[Any], bool]) \
+            -> 'WaybackMachineResponseCDX':
+        """
+        Filter by condition on the column values.
+
+        Condition is evaluated once per unique value.
+        """
+        if self.n_rows == 0:
+            return self
+        codes, uniques = pd.factorize(self.column(name))
+        decisions = np.fromiter((bool(condition(value)) for value in uniques),
+                                dtype=bool,
+                                count=len(uniques))
+        # Missing values have code -1 and are taken from the last place.
+        decisions = np.append(decisions, False)
+        return self.mask(decisions[codes])
 
     @classmethod
     def snapshot_to_archive_url(cls, snapshot: Dict[str, str]) -> str:
@@ -0,0 +1,263 @@
+"""
+Storage schema of snapshot collections.
+
+Indexes used by deduplication, inserts and analysis queries are created
+and verified when a collection is opened. Queries sent by MongoDB
+clients of the process are grouped by shape (command and filter keys),
+slow shapes and shapes without a usable index (COLLSCAN plan) are
+reported when the crawl ends.
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class IndexSpec(NamedTuple):
+    """Index of snapshot collections."""
+
+    name: str
+    keys: Sequence[Tuple[str, int]]
+    sparse: bool = False
+
+
+INDEXES: Tuple[IndexSpec, ...] = (
+    # Deduplication by original URL and capture lookups.
+    IndexSpec('original_timestamp', (('original', 1), ('timestamp', 1))),
+    IndexSpec('url', (('url', 1),)),
+    IndexSpec('timestamp', (('timestamp', 1),)),
+    IndexSpec('digest', (('digest', 1),), sparse=True),
+    # Analysis by extracted article dates.
+    IndexSpec('url_date_original', (('url_date', 1), ('original', 1))),
+    IndexSpec('title_date', (('title_date', 1),)),
+    IndexSpec('publish_date', (('publish_date', 1),), sparse=True),
+)
+
+# Commands with a filter and the place of the filter in the command.
+_FILTERS = {
+    'find': ('filter',),
+    'count': ('query',),
+    'distinct': ('query',),
+    'findAndModify': ('query',),
+    'update': ('updates', 0, 'q'),
+    'delete': ('deletes', 0, 'q'),
+    'aggregate': ('pipeline', 0, '$match'),
+}
+
+
+def ensure_indexes(collection: Any,
+                   indexes: Sequence[IndexSpec] = INDEXES) -> List[str]:
+    """
+    Create missing indexes and verify existing ones.
+
+    Parameters
+    ----------
+    collection : Any
+        pymongo collection.
+    indexes : Sequence[IndexSpec], optional
+        Expected indexes, by default `INDEXES`.
+
+    Returns
+    -------
+    List[str]
+        Problems found, like an index with the same name and other keys.
+    """
+    existing = collection.index_information()
+    existing_keys = [[tuple(key) for key in info['key']]
+                     for info in existing.values()]
+    problems = []
+    for index in indexes:
+        info = existing.get(index.name)
+        if info is None and list(index.keys) in existing_keys:
+            # Same index created with another name.
+            continue
+        if info is None:
+            collection.create_index(list(index.keys),
+                                    name=index.name,
+                                    sparse=index.sparse,
+                                    background=True)
+            logger.info("Index '%s' of '%s' created",
+                        index.name, collection.name)
+        elif [tuple(key) for key in info['key']] != list(index.keys):
+            problems.append(f"index '{index.name}' of '{collection.name}' "
+                            f"has keys {info['key']}, expected "
+                            f"{list(index.keys)}")
+    for problem in problems:
+        logger.warning("Storage schema: %s", problem)
+    return problems
+
+
+def command_filter(command_name: str,
+                   command: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Filter of the command, None for commands without filter."""
+    path = _FILTERS.get(command_name)
+    if path is None:
+        return None
+    query: Any = command
+    for key in path:
+        try:
+            query = query[key]
+        except (KeyError, IndexError, TypeError):
+            return {}
+    return dict(query) if isinstance(query, dict) else {}
+
+
+def query_shape(command_name: str, query: Dict[str, Any]) -> str:
+    """Command name with filter keys."""
+    return f"{command_name} {{{', '.join(sorted(query))}}}"
+
+
+class _ShapeStats:  # pylint: disable=too-few-public-methods
+
+    def __init__(self, query: Dict[str, Any]):
+        self.query = query
+        self.count = 0
+        self.slow = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class QueryMonitor(monitoring.CommandListener):
+    """
+    pymongo command listener collecting query shapes per collection.
+
+    Installed once per process before MongoDB clients are created.
+    """
+
+    def __init__(self, slow_ms: float = 100.0):
+        """
+        Parameters
+        ----------
+        slow_ms : float, optional
+            Duration of slow queries, by default 100.0.
+        """
+        self.slow_ms = slow_ms
+        self._started: Dict[Tuple[Any, int], Tuple[str, str]] = {}
+        self._shapes: Dict[Tuple[str, str], _ShapeStats] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: Any):
+        """Remember shape of the started command."""
+        query = command_filter(event.command_name, event.command)
+        collection = event.command.get(event.command_name)
+        if query is None or not isinstance(collection, str):
+            return
+        key = (collection, query_shape(event.command_name, query))
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = key
+            if key not in self._shapes:
+                self._shapes[key] = _ShapeStats(query)
+
+    def succeeded(self, event: Any):
+        """Account duration of the command."""
+        self._finish(event)
+
+    def failed(self, event: Any):
+        """Account duration of the failed command."""
+        self._finish(event)
+
+    def _finish(self, event: Any):
+        with self._lock:
+            key = self._started.pop((event.connection_id, event.request_id),
+                                    None)
+            if key is None:
+                return
+            stats = self._shapes[key]
+            duration = event.duration_micros / 1000.0
+            stats.count += 1
+            stats.total += duration
+            stats.max = max(stats.max, duration)
+            if duration >= self.slow_ms:
+                stats.slow += 1
+
+    def shapes(self, collection: str) -> Dict[str, _ShapeStats]:
+        """Statistics of query shapes of the collection."""
+        with self._lock:
+            return {shape: stats for (name, shape), stats
+                    in self._shapes.items() if name == collection}
+
+
+_monitor: Dict[str, QueryMonitor] = {}
+
+
+def install_query_monitor(slow_ms: Optional[float] = None) -> QueryMonitor:
+    """
+    Register the process query monitor, it sees clients created later.
+
+    Parameters
+    ----------
+    slow_ms : Optional[float], optional
+        Duration of slow queries, by default None keeping the current one.
+    """
+    if 'monitor' not in _monitor:
+        _monitor['monitor'] = QueryMonitor()
+        monitoring.register(_monitor['monitor'])
+    if slow_ms is not None:
+        _monitor['monitor'].slow_ms = slow_ms
+    return _monitor['monitor']
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    stages = [plan.get('stage', '')]
+    for key in ['inputStage', 'queryPlan']:
+        if isinstance(plan.get(key), dict):
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get('inputStages', []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+def is_collscan(collection: Any, query: Dict[str, Any]) -> bool:
+    """Winning plan of the query scans the whole collection."""
+    explain = collection.find(query).explain()
+    plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+    return 'COLLSCAN' in _plan_stages(plan)
+
+
+def report_queries(collection: Any) -> List[str]:
+    """
+    Log slow and unindexed query shapes of the collection.
+
+    Parameters
+    ----------
+    collection : Any
+        pymongo collection.
+
+    Returns
+    -------
+    List[str]
+        Reported query shapes.
+    """
+    monitor = _monitor.get('monitor')
+    if monitor is None:
+        return []
+
+    start = time.perf_counter()
+    reported = []
+    for shape, shape_stats in monitor.shapes(collection.name).items():
+        problems = []
+        if shape_stats.slow > 0:
+            problems.append(f"{shape_stats.slow} slow")
+        try:
+            if shape_stats.query and is_collscan(collection,
+                                                 shape_stats.query):
+                problems.append("COLLSCAN")
+        except PyMongoError as error:
+            logger.debug("Explain of '%s' failed: %s", shape, error)
+        if not problems:
+            continue
+        reported.append(shape)
+        logger.warning("Query '%s' on '%s': %s, %d queries, "
+                       "mean %.1f ms, max %.1f ms",
+                       shape, collection.name, ', '.join(problems),
+                       shape_stats.count,
+                       shape_stats.total / max(shape_stats.count, 1),
+                       shape_stats.max)
+    logger.info("Query report of '%s' took %.2f s",
+                collection.name, time.perf_counter() - start)
+    return reported
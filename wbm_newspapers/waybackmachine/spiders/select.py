@@ -0,0 +1,176 @@
+"""Selection of one snapshot per URL key."""
+import logging
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from wbm_newspapers.waybackmachine.spiders.config import SELECT_POLICIES
+from wbm_newspapers.waybackmachine.spiders.response import \
+    WaybackMachineResponseCDX
+
+logger = logging.getLogger(__name__)
+
+# Scheme, 'www' prefix and default port of the host are not part of
+# the URL key, as in CDX URL keys.
+URL_KEY_PREFIX = (r'^(?:[a-z]+://)?(?:www\d*\.)?([^/?#]*?)'
+                  r'(?::(?:80|443))?([/?#]|$)')
+
+
+def url_keys(originals: pd.Series) -> pd.Series:
+    """
+    URL keys of original URLs.
+
+    http and https, 'www.' and ':80' variants of the URL have the same
+    key, CDX rows are sorted by it.
+    """
+    return (originals.astype(str)
+            .str.lower()
+            .str.replace(URL_KEY_PREFIX, r'\1\2', n=1, regex=True))
+
+
+class SnapshotSelector:
+    """
+    Select one capture per URL key within and across CDX pages.
+
+    CDX rows are sorted by URL key, so captures of one URL can only
+    continue on the next page of the same stream. The captures of the
+    last URL key of every page are held back until the next page
+    arrives, or until `flush` if it will not arrive. URL keys already
+    selected are never selected again.
+
+    Selection is final per stream: with CDX partitions a URL captured
+    in several partitions is selected from the partition which is
+    completed first, a closer capture in another partition is not
+    considered.
+
+    'closest' policy uses the 'url_date' column of CDX data.
+    """
+
+    POLICIES = SELECT_POLICIES
+
+    def __init__(self, policy: str = 'all'):
+        """
+        Parameters
+        ----------
+        policy : str, optional
+            'all' keeps every capture, 'earliest' and 'latest' keep the
+            first and the last capture, 'closest' keeps the capture
+            closest to the date in the URL. By default 'all'.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown snapshot selection policy '{policy}'. "
+                             f"Available: {self.POLICIES}")
+
+        self.policy = policy
+        self._carry: Dict[Hashable, WaybackMachineResponseCDX] = {}
+        self._selected: Set[str] = set()
+
+    @property
+    def n_selected(self) -> int:
+        """Number of selected URL keys."""
+        return len(self._selected)
+
+    @property
+    def held_streams(self) -> List[Hashable]:
+        """Streams with rows held back for their next page."""
+        return list(self._carry)
+
+    def flush(self, stream: Hashable = None) \
+            -> Optional[WaybackMachineResponseCDX]:
+        """
+        Select the rows held back for the stream, when its next page
+        will not arrive, like after a failed request.
+
+        Returns None if no rows are held back.
+        """
+        carry = self._carry.pop(stream, None)
+        if carry is None:
+            return None
+        logger.info("Snapshot selection: %d held rows flushed.",
+                    carry.n_rows)
+        return self.select(carry, stream=stream, final=True)
+
+    def select(self,
+               data: WaybackMachineResponseCDX,
+               stream: Hashable = None,
+               final: bool = True) -> WaybackMachineResponseCDX:
+        """
+        Select captures from the CDX page.
+
+        Parameters
+        ----------
+        data : WaybackMachineResponseCDX
+            Filtered CDX page.
+        stream : Hashable, optional
+            Key of the sequence of pages the page belongs to.
+        final : bool, optional
+            Page is the last one in the stream, by default True.
+        """
+        if self.policy == 'all':
+            return data
+
+        carry = self._carry.pop(stream, None)
+        if carry is not None:
+            data = WaybackMachineResponseCDX.concat([carry, data])
+
+        keys = url_keys(data.column('original')).to_numpy()
+        new = np.fromiter((key not in self._selected for key in keys),
+                          dtype=bool,
+                          count=len(keys))
+        data, keys = data.mask(new), keys[new]
+
+        if not final and data.n_rows > 0:
+            held = keys == keys[-1]
+            self._carry[stream] = data.mask(held)
+            data, keys = data.mask(~held), keys[~held]
+
+        if data.n_rows == 0:
+            return data
+
+        n_rows = data.n_rows
+        data, keys = self._select_best(data, keys)
+        self._selected.update(keys.tolist())
+
+        logger.info("Snapshot selection '%s': %d of %d rows selected.",
+                    self.policy, data.n_rows, n_rows)
+        return data
+
+    def _select_best(self,
+                     data: WaybackMachineResponseCDX,
+                     keys: np.ndarray) \
+            -> Tuple[WaybackMachineResponseCDX, np.ndarray]:
+
+        timestamps = data.column('timestamp').to_numpy()
+
+        if self.policy == 'earliest':
+            score = timestamps.astype(float)
+        elif self.policy == 'latest':
+            score = -timestamps.astype(float)
+        else:
+            captured = pd.to_datetime(timestamps.astype(str),
+                                      format="%Y%m%d%H%M%S")
+            if 'url_date' in data.columns:
+                url_dates = data.column('url_date')
+            else:
+                url_dates = pd.Series(pd.NaT, index=range(data.n_rows))
+            distance = np.abs((captured - pd.DatetimeIndex(url_dates))
+                              .total_seconds().to_numpy())
+            # Without URL date the earliest capture is taken.
+            score = np.where(np.isnan(distance),
+                             np.inf,
+                             distance)
+
+        frame = pd.DataFrame({
+            'key': keys,
+            'score': score,
+            'timestamp': timestamps,
+            'position': np.arange(data.n_rows),
+        })
+        best = (frame
+                .sort_values(['score', 'timestamp'], kind='stable')
+                .drop_duplicates('key'))
+
+        where = np.zeros(data.n_rows, dtype=bool)
+        where[best['position'].to_numpy()] = True
+        return data.mask(where), keys[where]
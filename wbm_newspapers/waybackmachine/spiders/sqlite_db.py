@@ -0,0 +1,262 @@
+"""
+Embedded snapshot storage without a database server.
+
+Snapshots are written to a SQLite file in WAL mode with batched
+transactions. The table is compacted to Parquet files for analysis
+when a crawl closes.
+"""
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from wbm_newspapers.sqlite import connect
+from wbm_newspapers.waybackmachine.spiders.response import \
+    WaybackMachineResponseCDX
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('url', 'original', 'timestamp', 'text', 'title', 'summary',
+           'publish_date', 'title_date', 'url_date', 'path', 'duplicate_of',
+           'snapshot')
+
+
+class SqliteSnapshotStore:
+    """Snapshot table of one spider in a SQLite file."""
+
+    def __init__(self, path: str, name: str, batch_size: int = 500):
+        """
+        Parameters
+        ----------
+        path : str
+            Database file.
+        name : str
+            Table name, the spider name.
+        batch_size : int, optional
+            Snapshots written in one transaction, by default 500.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.name = name
+        self.batch_size = batch_size
+        self._pending: List[Tuple[Any, ...]] = []
+        self._pending_originals: Set[str] = set()
+        self._lock = threading.RLock()
+        self._connection = connect(path)
+        self._create_table()
+
+    def _create_table(self):
+        columns = ', '.join(f"{column} TEXT" for column in COLUMNS
+                            if column != 'url')
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.name} ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            f"url TEXT UNIQUE NOT NULL, {columns}, inserted REAL)")
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.name}_original "
+            f"ON {self.name} (original, timestamp)")
+        # Tables created before a column was added.
+        existing = {row[1] for row in self._connection.execute(
+            f"PRAGMA table_info({self.name})")}
+        for column in COLUMNS:
+            if column not in existing:
+                self._connection.execute(
+                    f"ALTER TABLE {self.name} ADD COLUMN {column} TEXT")
+
+    def insert(self, data: Dict[str, Any]):
+        """Queue snapshot, snapshots with a stored URL are skipped."""
+        row = tuple(None if data.get(column) is None else str(data[column])
+                    for column in COLUMNS) + (time.time(),)
+        with self._lock:
+            self._pending.append(row)
+            self._pending_originals.add(str(data.get('original')))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Write queued snapshots in one transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            placeholders = ', '.join('?' * (len(COLUMNS) + 1))
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(
+                f"INSERT OR IGNORE INTO {self.name} "
+                f"({', '.join(COLUMNS)}, inserted) "
+                f"VALUES ({placeholders})", self._pending)
+            self._connection.execute("COMMIT")
+            logger.debug("%d snapshots written to '%s'",
+                         len(self._pending), self.name)
+            self._pending = []
+            self._pending_originals = set()
+
+    def has_original(self, original: str) -> bool:
+        """Snapshot of the original URL is stored or queued."""
+        with self._lock:
+            if original in self._pending_originals:
+                return True
+            row = self._connection.execute(
+                f"SELECT 1 FROM {self.name} WHERE original = ? LIMIT 1",
+                (original,)).fetchone()
+        return row is not None
+
+    def find_original_url(self, original: str) -> List[Dict[str, Any]]:
+        """Stored snapshots of the original URL without the raw page."""
+        self.flush()
+        return self._select("original = ?", (original,))
+
+    def find_url(self, url: str) -> Optional[Dict[str, Any]]:
+        """Stored snapshot of the archive URL without the raw page."""
+        self.flush()
+        rows = self._select("url = ?", (url,))
+        return rows[0] if rows else None
+
+    def _select(self, where: str, params: Tuple) -> List[Dict[str, Any]]:
+        columns = [column for column in COLUMNS if column != 'snapshot']
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT {', '.join(columns)} FROM {self.name} "
+                f"WHERE {where}", params).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def count(self) -> int:
+        """Number of stored snapshots."""
+        self.flush()
+        with self._lock:
+            return self._connection.execute(
+                f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+
+    def drop(self):
+        """Remove all snapshots."""
+        with self._lock:
+            self._pending = []
+            self._pending_originals = set()
+            self._connection.execute(f"DROP TABLE IF EXISTS {self.name}")
+            self._create_table()
+
+    def compact(self,
+                directory: str,
+                snapshot: bool = False,
+                chunk_size: int = 10000) -> int:
+        """
+        Rewrite the table to Parquet files, one file per chunk of rows.
+
+        Parameters
+        ----------
+        directory : str
+            Output directory, previous files are replaced.
+        snapshot : bool, optional
+            Keep raw pages, by default False.
+        chunk_size : int, optional
+            Rows read and written at once, by default 10000.
+
+        Returns
+        -------
+        int
+            Number of written rows.
+        """
+        self.flush()
+        os.makedirs(directory, exist_ok=True)
+        for filename in glob.glob(os.path.join(directory, "part-*.parquet")):
+            os.remove(filename)
+
+        columns = [column for column in COLUMNS
+                   if snapshot or column != 'snapshot']
+        n_rows = 0
+        with self._lock:
+            chunks = pd.read_sql_query(
+                f"SELECT id, {', '.join(columns)}, inserted "
+                f"FROM {self.name} ORDER BY id",
+                self._connection,
+                chunksize=chunk_size)
+            for part, chunk in enumerate(chunks):
+                chunk.to_parquet(
+                    os.path.join(directory, f"part-{part:05d}.parquet"),
+                    index=False)
+                n_rows += len(chunk)
+        logger.info("Table '%s' compacted to '%s': %d rows",
+                    self.name, directory, n_rows)
+        return n_rows
+
+    def close(self):
+        """Write queued snapshots and close the file."""
+        self.flush()
+        self._connection.close()
+
+
+_stores: Dict[Tuple[str, str], SqliteSnapshotStore] = {}
+_store_refs: Dict[Tuple[str, str], int] = {}
+_stores_lock = threading.Lock()
+
+
+def acquire_store(path: str,
+                  name: str,
+                  batch_size: int = 500) -> SqliteSnapshotStore:
+    """
+    Snapshot store shared by the spider and pipelines of the process.
+
+    Deduplication sees snapshots queued by the pipeline before they
+    are written. Every call must be paired with `release_store`.
+    """
+    key = (os.path.abspath(path), name)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SqliteSnapshotStore(path, name, batch_size)
+            _store_refs[key] = 0
+            logger.info("SQLite store '%s' of '%s' opened", path, name)
+        _store_refs[key] += 1
+        return _stores[key]
+
+
+def release_store(path: str, name: str):
+    """Release shared store, the last release closes it."""
+    key = (os.path.abspath(path), name)
+    with _stores_lock:
+        if key not in _stores:
+            return
+        _store_refs[key] -= 1
+        if _store_refs[key] <= 0:
+            _stores.pop(key).close()
+            _store_refs.pop(key)
+            logger.info("SQLite store '%s' of '%s' closed", path, name)
+
+
+class SqliteSpiderDatabase:
+    """Spider database with the `SpiderDatabase` interface on SQLite."""
+
+    def __init__(self, name: str, path: str, batch_size: int = 500):
+        """
+        Parameters
+        ----------
+        name : str
+            Spider name.
+        path : str
+            Database file.
+        batch_size : int, optional
+            Snapshots written in one transaction, by default 500.
+        """
+        self._address = (path, name)
+        self._store = acquire_store(path, name, batch_size)
+
+    @property
+    def store(self) -> SqliteSnapshotStore:
+        """Store object."""
+        return self._store
+
+    def close(self):
+        """Release store."""
+        release_store(*self._address)
+
+    def filter(self,
+               data: WaybackMachineResponseCDX) -> WaybackMachineResponseCDX:
+        """Filter urls."""
+        return data.filter_values('original', self._filter_original)
+
+    def _filter_original(self, original: str) -> bool:
+        return not self._store.has_original(original)
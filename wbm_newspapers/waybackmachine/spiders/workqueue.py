@@ -0,0 +1,347 @@
+"""
+Durable queue of snapshot work units shared by crawl workers.
+
+A coordinator publishes units, workers lease them for a limited time,
+acknowledge processed units and report failures. Units leased by a dead
+worker become available again when the lease expires. Units failed
+`max_attempts` times, or failed without retry, are not leased anymore.
+
+Backends: MongoDB collection for several hosts and SQLite file
+for a single host.
+"""
+import abc
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from wbm_newspapers.sqlite import connect
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class WorkUnit(NamedTuple):
+    """Leased work unit."""
+
+    id: str
+    key: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+class WorkQueue(abc.ABC):
+    """Work queue interface."""
+
+    def __init__(self,
+                 lease_seconds: float = 600.0,
+                 max_attempts: int = 3):
+        """
+        Parameters
+        ----------
+        lease_seconds : float, optional
+            Lease duration, by default 600.0.
+        max_attempts : int, optional
+            Leases of a unit before it is failed, by default 3.
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    @abc.abstractmethod
+    def publish(self, units: Iterable[Dict[str, Any]]) -> int:
+        """
+        Add units, units with known 'key' are skipped.
+
+        Returns number of added units.
+        """
+
+    @abc.abstractmethod
+    def lease(self, worker: str, count: int) -> List[WorkUnit]:
+        """Lease pending units and units with expired leases."""
+
+    @abc.abstractmethod
+    def ack(self, unit_id: str):
+        """Mark unit processed."""
+
+    @abc.abstractmethod
+    def fail(self, unit_id: str, error: str, retry: bool = True):
+        """
+        Return unit to the queue or fail it after `max_attempts`.
+
+        Unit is failed at once if `retry` is false, for errors which
+        another attempt repeats.
+        """
+
+    @abc.abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Number of units by state."""
+
+    @abc.abstractmethod
+    def set_closed(self, closed: bool = True):
+        """Mark publishing finished."""
+
+    @abc.abstractmethod
+    def is_closed(self) -> bool:
+        """Publishing is finished."""
+
+    def is_drained(self) -> bool:
+        """Publishing is finished and no unit waits or is being processed."""
+        counts = self.counts()
+        return (self.is_closed()
+                and counts.get(PENDING, 0) == 0
+                and counts.get(LEASED, 0) == 0)
+
+    def close(self):
+        """Release connection."""
+
+
+class SqliteWorkQueue(WorkQueue):
+    """Work queue in a SQLite table."""
+
+    def __init__(self, path: str, name: str, **kwargs):
+        """
+        Parameters
+        ----------
+        path : str
+            Database file.
+        name : str
+            Table name.
+        """
+        super().__init__(**kwargs)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.name = name
+        self._lock = threading.Lock()
+        self._connection = connect(path)
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "key TEXT UNIQUE NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "state TEXT NOT NULL, "
+            "worker TEXT, "
+            "lease_until REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT)")
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {name}_state "
+            f"ON {name} (state, lease_until)")
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {name}_meta "
+            "(key TEXT PRIMARY KEY, value TEXT)")
+
+    def publish(self, units: Iterable[Dict[str, Any]]) -> int:
+        rows = [(unit['key'], json.dumps(unit, default=str), PENDING)
+                for unit in units]
+        with self._lock:
+            before = self._connection.total_changes
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(
+                f"INSERT OR IGNORE INTO {self.name} (key, payload, state) "
+                "VALUES (?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+            return self._connection.total_changes - before
+
+    def lease(self, worker: str, count: int) -> List[WorkUnit]:
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            rows = self._connection.execute(
+                f"SELECT id, key, payload, attempts FROM {self.name} "
+                "WHERE (state = ? OR (state = ? AND lease_until < ?)) "
+                "AND attempts < ? ORDER BY id LIMIT ?",
+                (PENDING, LEASED, now, self.max_attempts, count)).fetchall()
+            self._connection.executemany(
+                f"UPDATE {self.name} SET state = ?, worker = ?, "
+                "lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                [(LEASED, worker, now + self.lease_seconds, row[0])
+                 for row in rows])
+            self._connection.execute("COMMIT")
+        return [WorkUnit(str(row[0]), row[1], json.loads(row[2]), row[3] + 1)
+                for row in rows]
+
+    def ack(self, unit_id: str):
+        with self._lock:
+            self._connection.execute(
+                f"UPDATE {self.name} SET state = ?, lease_until = NULL "
+                "WHERE id = ?", (DONE, int(unit_id)))
+
+    def fail(self, unit_id: str, error: str, retry: bool = True):
+        with self._lock:
+            self._connection.execute(
+                f"UPDATE {self.name} SET "
+                "state = CASE WHEN ? OR attempts >= ? THEN ? ELSE ? END, "
+                "lease_until = NULL, error = ? WHERE id = ?",
+                (not retry, self.max_attempts, FAILED, PENDING, error,
+                 int(unit_id)))
+
+    def counts(self) -> Dict[str, int]:
+        now = time.time()
+        with self._lock:
+            # Expired leases are counted as pending or, after the last
+            # attempt, as failed.
+            rows = self._connection.execute(
+                "SELECT CASE WHEN state = ? AND lease_until < ? "
+                "THEN CASE WHEN attempts < ? THEN ? ELSE ? END "
+                "ELSE state END AS s, COUNT(*) "
+                f"FROM {self.name} GROUP BY s",
+                (LEASED, now, self.max_attempts, PENDING, FAILED)).fetchall()
+        return dict(rows)
+
+    def set_closed(self, closed: bool = True):
+        with self._lock:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self.name}_meta (key, value) "
+                "VALUES ('closed', ?)", (str(int(closed)),))
+
+    def is_closed(self) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT value FROM {self.name}_meta "
+                "WHERE key = 'closed'").fetchone()
+        return row is not None and row[0] == '1'
+
+    def close(self):
+        self._connection.close()
+
+
+class MongoWorkQueue(WorkQueue):
+    """Work queue in a MongoDB collection."""
+
+    def __init__(self, db: Any, name: str, **kwargs):
+        """
+        Parameters
+        ----------
+        db : Any
+            pymongo database.
+        name : str
+            Collection name.
+        """
+        super().__init__(**kwargs)
+        self._collection = db[name]
+        self._meta = db[f'{name}_meta']
+        self._collection.create_index('key', unique=True)
+        self._collection.create_index([('state', 1), ('lease_until', 1)])
+
+    def publish(self, units: Iterable[Dict[str, Any]]) -> int:
+        from pymongo import UpdateOne  # pylint: disable=import-outside-toplevel
+
+        operations = [
+            UpdateOne({'key': unit['key']},
+                      {'$setOnInsert': {'key': unit['key'],
+                                        'payload': unit,
+                                        'state': PENDING,
+                                        'attempts': 0,
+                                        'created': time.time()}},
+                      upsert=True)
+            for unit in units]
+        if not operations:
+            return 0
+        result = self._collection.bulk_write(operations, ordered=False)
+        return result.upserted_count
+
+    def lease(self, worker: str, count: int) -> List[WorkUnit]:
+        from pymongo import \
+            ReturnDocument  # pylint: disable=import-outside-toplevel
+
+        units = []
+        for _ in range(count):
+            now = time.time()
+            document = self._collection.find_one_and_update(
+                {'$or': [{'state': PENDING},
+                         {'state': LEASED, 'lease_until': {'$lt': now}}],
+                 'attempts': {'$lt': self.max_attempts}},
+                {'$set': {'state': LEASED,
+                          'worker': worker,
+                          'lease_until': now + self.lease_seconds},
+                 '$inc': {'attempts': 1}},
+                sort=[('_id', 1)],
+                return_document=ReturnDocument.AFTER)
+            if document is None:
+                break
+            units.append(WorkUnit(str(document['_id']), document['key'],
+                                  document['payload'], document['attempts']))
+        return units
+
+    @staticmethod
+    def _object_id(unit_id: str) -> Any:
+        from bson import ObjectId  # pylint: disable=import-outside-toplevel
+        return ObjectId(unit_id)
+
+    def ack(self, unit_id: str):
+        self._collection.update_one(
+            {'_id': self._object_id(unit_id)},
+            {'$set': {'state': DONE, 'lease_until': None}})
+
+    def fail(self, unit_id: str, error: str, retry: bool = True):
+        state: Any = FAILED
+        if retry:
+            state = {'$cond': [{'$gte': ['$attempts', self.max_attempts]},
+                               FAILED, PENDING]}
+        self._collection.update_one(
+            {'_id': self._object_id(unit_id)},
+            [{'$set': {'state': state,
+                       'lease_until': None,
+                       'error': error}}])
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        now = time.time()
+        for state in [PENDING, DONE, FAILED]:
+            counts[state] = self._collection.count_documents({'state': state})
+        expired = self._collection.count_documents(
+            {'state': LEASED, 'lease_until': {'$lt': now}})
+        exhausted = self._collection.count_documents(
+            {'state': LEASED, 'lease_until': {'$lt': now},
+             'attempts': {'$gte': self.max_attempts}})
+        counts[LEASED] = self._collection.count_documents(
+            {'state': LEASED}) - expired
+        counts[PENDING] += expired - exhausted
+        counts[FAILED] += exhausted
+        return counts
+
+    def set_closed(self, closed: bool = True):
+        self._meta.update_one({'_id': 'closed'},
+                              {'$set': {'value': closed}},
+                              upsert=True)
+
+    def is_closed(self) -> bool:
+        document = self._meta.find_one({'_id': 'closed'})
+        return document is not None and bool(document['value'])
+
+
+def create_work_queue(queue_settings: Dict[str, Any],
+                      name: str,
+                      db: Optional[Any] = None) -> WorkQueue:
+    """
+    Work queue from the 'queue' section of spider settings.
+
+    Parameters
+    ----------
+    queue_settings : Dict[str, Any]
+        Settings with 'backend' ('sqlite' or 'mongodb'), 'path' of SQLite
+        file, 'name', 'lease_seconds' and 'max_attempts'.
+    name : str
+        Default table or collection name.
+    db : Optional[Any], optional
+        pymongo database of the MongoDB backend.
+    """
+    options = {'lease_seconds': queue_settings.get('lease_seconds', 600),
+               'max_attempts': queue_settings.get('max_attempts', 3)}
+    name = queue_settings.get('name', name)
+    backend = queue_settings.get('backend', 'sqlite')
+    if backend == 'sqlite':
+        path = os.path.expanduser(queue_settings['path'])
+        return SqliteWorkQueue(path, name, **options)
+    if backend == 'mongodb':
+        if db is None:
+            raise ValueError("MongoDB work queue requires a database")
+        return MongoWorkQueue(db, name, **options)
+    raise ValueError(f"Unknown work queue backend: '{backend}'")
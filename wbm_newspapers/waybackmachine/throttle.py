@@ -0,0 +1,235 @@
+"""
+Process-wide request budget for archive.org shared by all crawlers.
+
+Scrapy throttles requests per crawler, so several spiders in one process
+multiply the load on the Wayback Machine. The budget limits the rate and
+the number of requests in flight for the whole process and hands out
+slots to spiders in turn.
+"""
+import collections
+import logging
+import threading
+import time
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import scrapy
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer, reactor
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket rate limiter."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        """
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second.
+        burst : float, optional
+            Bucket capacity, by default 1.0.
+        """
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive: {rate}")
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if available."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def delay(self) -> float:
+        """Seconds until the next token is available."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self._tokens) / self.rate)
+
+
+class ArchiveBudget:
+    """
+    Rate and concurrency budget shared by crawlers of the process.
+
+    Waiting requests are queued per spider and released round-robin,
+    so a spider with a long queue does not starve the others.
+    """
+
+    _shared: Dict[Tuple[float, float, int], 'ArchiveBudget'] = {}
+
+    def __init__(self, rate: float, burst: float, concurrency: int):
+        """
+        Parameters
+        ----------
+        rate : float
+            Requests per second.
+        burst : float
+            Requests allowed at once after idle time.
+        concurrency : int
+            Maximum number of requests in flight.
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self._waiting: Dict[str, Deque[defer.Deferred]] = {}
+        self._turns: Deque[str] = collections.deque()
+        self._call = None
+
+    @classmethod
+    def shared(cls,
+               rate: float,
+               burst: float,
+               concurrency: int) -> 'ArchiveBudget':
+        """Budget instance shared by crawlers with the same limits."""
+        key = (rate, burst, concurrency)
+        if key not in cls._shared:
+            cls._shared[key] = cls(rate, burst, concurrency)
+        return cls._shared[key]
+
+    @property
+    def n_waiting(self) -> int:
+        """Number of queued requests."""
+        return sum(len(queue) for queue in self._waiting.values())
+
+    def acquire(self, key: str) -> defer.Deferred:
+        """Deferred fired when the request of the spider may be sent."""
+        deferred: defer.Deferred = defer.Deferred()
+        if key not in self._waiting:
+            self._waiting[key] = collections.deque()
+            self._turns.append(key)
+        self._waiting[key].append(deferred)
+        self._dispatch()
+        return deferred
+
+    def release(self):
+        """Request finished."""
+        self.in_flight = max(0, self.in_flight - 1)
+        self._dispatch()
+
+    def flush(self, key: str):
+        """Let all waiting requests of the spider through."""
+        queue = self._waiting.pop(key, None)
+        if key in self._turns:
+            self._turns.remove(key)
+        while queue:
+            self.in_flight += 1
+            queue.popleft().callback(None)
+
+    def _next_key(self) -> Optional[str]:
+        for _ in range(len(self._turns)):
+            key = self._turns[0]
+            self._turns.rotate(-1)
+            if self._waiting[key]:
+                return key
+        return None
+
+    def _dispatch(self):
+        while self.in_flight < self.concurrency:
+            key = self._next_key()
+            if key is None:
+                return
+            if not self.bucket.try_acquire():
+                self._schedule()
+                return
+            self.in_flight += 1
+            self._waiting[key].popleft().callback(None)
+
+    def _schedule(self):
+        if self._call is not None and self._call.active():
+            return
+        self._call = reactor.callLater(self.bucket.delay(), self._dispatch)
+
+
+class ArchiveBudgetMiddleware:
+    """
+    Downloader middleware holding archive.org requests until the shared
+    budget allows them.
+
+    Enabled by ARCHIVE_RATE_LIMIT in requests per second,
+    ARCHIVE_RATE_BURST and ARCHIVE_CONCURRENCY set the burst and the
+    number of requests in flight for the whole process.
+    """
+
+    META_KEY = 'archive_budget'
+
+    def __init__(self, budget: ArchiveBudget, stats):
+        self.budget = budget
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> 'ArchiveBudgetMiddleware':
+        """Instantiate from crawler."""
+        settings = crawler.settings
+        rate = settings.getfloat('ARCHIVE_RATE_LIMIT')
+        if rate <= 0:
+            raise NotConfigured
+        budget = ArchiveBudget.shared(
+            rate,
+            settings.getfloat('ARCHIVE_RATE_BURST', 1.0),
+            settings.getint('ARCHIVE_CONCURRENCY', 8))
+        middleware = cls(budget, crawler.stats)
+        crawler.signals.connect(middleware.spider_closed,
+                                signal=signals.spider_closed)
+        return middleware
+
+    @staticmethod
+    def is_archive(request: scrapy.Request) -> bool:
+        """Request to the Wayback Machine."""
+        return urlparse(request.url).netloc.endswith('archive.org')
+
+    def process_request(self,
+                        request: scrapy.Request,
+                        spider: scrapy.Spider) -> Optional[defer.Deferred]:
+        """Wait for the budget."""
+        if not self.is_archive(request) or request.meta.get(self.META_KEY):
+            return None
+
+        request.meta[self.META_KEY] = True
+        started = time.monotonic()
+        self.stats.max_value('archive_budget/waiting', self.budget.n_waiting)
+
+        def _record(_):
+            self.stats.inc_value('archive_budget/wait_seconds',
+                                 time.monotonic() - started)
+
+        return self.budget.acquire(spider.name).addCallback(_record)
+
+    def _release(self, request: scrapy.Request):
+        if request.meta.pop(self.META_KEY, False):
+            self.budget.release()
+
+    def process_response(self,
+                         request: scrapy.Request,
+                         response: scrapy.http.Response,
+                         spider: scrapy.Spider) -> scrapy.http.Response:  # pylint: disable=unused-argument
+        """Return the slot to the budget."""
+        self._release(request)
+        return response
+
+    def process_exception(self,
+                          request: scrapy.Request,
+                          exception: Exception,  # pylint: disable=unused-argument
+                          spider: scrapy.Spider):  # pylint: disable=unused-argument
+        """Return the slot to the budget."""
+        self._release(request)
+
+    def spider_closed(self, spider: scrapy.Spider):
+        """Do not hold requests of the closed spider."""
+        self.budget.flush(spider.name)